@@ -1,27 +1,326 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, render_template, request, jsonify, redirect, url_for, abort, Response, send_file, g
+from flask import make_response, send_from_directory, has_request_context
+from werkzeug.local import LocalProxy
+import click
+from flask import before_render_template, template_rendered
 import os
 import json
 from werkzeug.utils import secure_filename
 from datetime import datetime
 import uuid
+import threading
+import time
+import hmac
+import hashlib
+import functools
+from concurrent.futures import ProcessPoolExecutor
+from store import open_store
+from records import CODECS as RECORD_CODECS
+from cache import StoreCache
+from history_index import HistoryIndex, DEFAULT_PAGE_SIZE
+from search_index import SearchIndex, DEFAULT_LIMIT as DEFAULT_SEARCH_LIMIT, pack_segment as pack_search_segment
+import stats as bill_stats
+from customers import CustomerDirectory, DEFAULT_LIMIT as DEFAULT_SUGGEST_LIMIT, pack_segment as pack_customer_segment
+import export
+import reports as bill_reports
+import pdf
+import billing
+from render_cache import RenderCache, content_key
+from uploads import UploadStore, is_upload, is_immutable
+from tenants import DEFAULT_TENANT, Busy, ShardMap, ShardPool, TenantMiddleware, is_remote, is_tenant
+from jobs import JobQueue
+import template_registry
+from bill_numbers import BillNumbers, DEFAULT_PREFIX as DEFAULT_BILL_PREFIX
+from writer import atomic_write, atomic_write_json
+from metrics import Registry, CONTENT_TYPE, process_io
+from profiler import Sampler
+from json_provider import FastJSONProvider
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.config['UPLOAD_FOLDER'] = 'flask-version/static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB limit
+# Longest side, in pixels, of the thumbnails made for every upload.
+app.config['UPLOAD_THUMB_SIZES'] = (128, 512)
+app.config['THUMB_WORKERS'] = 1
+app.config['STORE_CACHE_MAX_BYTES'] = 256 * 1024 * 1024
 DATA_FILE = 'flask-version/data.json'
+DATA_DIR = 'flask-version/data'
+app.config['PDF_CACHE_DIR'] = os.path.join(DATA_DIR, 'pdf-cache')
+app.config['PDF_CACHE_MAX_BYTES'] = 256 * 1024 * 1024
+app.config['PDF_WORKERS'] = 2
+app.config['TEMPLATE_CACHE_DIR'] = os.path.join(DATA_DIR, 'jinja-cache')
+# A request carrying PROFILE_HEADER: <PROFILE_TOKEN> is run under the
+# sampling profiler; profiling is off while no token is configured.
+app.config['PROFILE_HEADER'] = 'X-Profile'
+app.config['PROFILE_TOKEN'] = os.environ.get('BILL_PROFILE_TOKEN')
+app.config['PROFILE_DIR'] = os.path.join(DATA_DIR, 'profiles')
+app.config['PROFILE_INTERVAL'] = 0.002
+# What to do when a posted grandTotal disagrees with the server's: 'flag'
+# stores the bill with the computed totals and marks it, 'reject' refuses it.
+app.config['BILL_TOTAL_POLICY'] = 'flag'
+# Bill numbers each worker reserves at a time; a larger block means fewer
+# trips to the shared sequence file and larger gaps when a worker stops.
+app.config['BILL_NUMBER_BLOCK'] = 50
+# Post-create work (invoice PDF, thumbnails, audit log) runs on this many
+# threads per worker process and is retried this many times.
+app.config['JOB_WORKERS'] = 2
+app.config['JOB_MAX_ATTEMPTS'] = 5
+app.config['AUDIT_LOG'] = os.path.join(DATA_DIR, 'audit.log')
+# Seconds browsers may keep an upload or thumbnail without asking again;
+# their URLs are content hashes, so a changed image gets a new URL.
+app.config['IMMUTABLE_MAX_AGE'] = 365 * 24 * 3600
+app.config['BILL_STORE'] = os.environ.get('BILL_STORE', 'log')
+# Format of new log records: 'json', or 'packed' for a smaller log that
+# older releases cannot read (see records.py).
+app.config['BILL_RECORD_FORMAT'] = os.environ.get('BILL_RECORD_FORMAT', 'json')
+# Businesses are picked by a /t/<tenant> URL prefix or by a subdomain of
+# TENANT_DOMAIN; requests that name none are served from DATA_DIR. Where
+# each tenant's shard lives is read from the SHARD_MAP file (see tenants.py);
+# without one, tenants are kept under TENANT_ROOTS.
+app.config['TENANT_PREFIX'] = '/t/'
+app.config['TENANT_DOMAIN'] = os.environ.get('BILL_TENANT_DOMAIN')
+app.config['SHARD_MAP'] = os.environ.get('BILL_SHARD_MAP')
+app.config['TENANT_ROOTS'] = [os.path.join(DATA_DIR, 'tenants')]
+# Shards kept open per worker, requests each tenant may have in flight per
+# worker (the default shard is not limited), and the bill cache of each
+# tenant's shard.
+app.config['TENANT_MAX_OPEN'] = 32
+app.config['TENANT_MAX_ACTIVE'] = 8
+app.config['TENANT_CACHE_MAX_BYTES'] = 64 * 1024 * 1024
 
-# Ensure folders exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+_thumb_pool = None
+
+def thumb_pool():
+    # One pool makes the thumbnails of every shard.
+    global _thumb_pool
+    if _thumb_pool is None:
+        _thumb_pool = ProcessPoolExecutor(max_workers=app.config['THUMB_WORKERS'])
+    return _thumb_pool
+
+class Shard:
+    """A business's bills, indexes, bill number sequences and uploads."""
+
+    def __init__(self, name, directory, upload_dir, audit_log, legacy_file=None, cache_bytes=None):
+        self.name = name
+        self.directory = directory
+        self.audit_log = audit_log
+        # Uploads are stored under their content hash; thumbnails are made
+        # in the background.
+        self.uploads = UploadStore(upload_dir, sizes=app.config['UPLOAD_THUMB_SIZES'], pool=thumb_pool)
+        # Bills are kept in an append-only log by default or in SQLite with
+        # BILL_STORE=sqlite; an existing legacy_file is imported on first
+        # start. The log keeps the current month; earlier months are sealed
+        # into compressed segments that carry their search postings,
+        # dashboard totals, customers and report columns.
+        sections = {'search': pack_search_segment, 'stats': bill_stats.pack_segment,
+                    'customers': pack_customer_segment}
+        if bill_reports.np is not None:
+            sections['reports'] = bill_reports.pack_segment
+        self.store = open_store(app.config['BILL_STORE'], directory, legacy_file=legacy_file, sections=sections,
+                                codec=app.config['BILL_RECORD_FORMAT'])
+        # Parsed bills stay in memory until another write changes the store;
+        # nothing is read before the shard's first request needs it.
+        self.cache = StoreCache(self.store, max_bytes=cache_bytes or app.config['STORE_CACHE_MAX_BYTES'])
+        self.bill_numbers = BillNumbers(directory, block_size=app.config['BILL_NUMBER_BLOCK'])
+        self.history_index = HistoryIndex()
+        self.dashboard_stats = bill_stats.BillStats()
+        self.search_index = SearchIndex()
+        # Customers seen on bills, for autocomplete on the create page.
+        self.customers = CustomerDirectory()
+        for listener in (self.history_index, self.dashboard_stats, self.search_index, self.customers):
+            self.cache.subscribe(listener)
+        # Columns of bills and line items for reports; needs NumPy.
+        self.reports = None
+        if bill_reports.np is not None:
+            self.reports = bill_reports.ReportColumns()
+            self.cache.subscribe(self.reports)
+        self.seal_queued = 0.0
+
+    def close(self):
+        self.bill_numbers.release()
+        if hasattr(self.store, 'close'):
+            self.store.close()
+
+def open_shard(name):
+    if name == DEFAULT_TENANT:
+        return Shard(name, DATA_DIR, app.config['UPLOAD_FOLDER'], app.config['AUDIT_LOG'], legacy_file=DATA_FILE)
+    directory = shard_map.locate(name)
+    if directory is None or is_remote(directory):
+        raise LookupError('tenant %s has no shard here' % name)
+    return Shard(name, directory, os.path.join(directory, 'uploads'), os.path.join(directory, 'audit.log'),
+                 cache_bytes=app.config['TENANT_CACHE_MAX_BYTES'])
+
+shard_map = ShardMap(app.config['SHARD_MAP'], roots=app.config['TENANT_ROOTS'])
+shards = ShardPool(open_shard, max_open=app.config['TENANT_MAX_OPEN'], max_active=app.config['TENANT_MAX_ACTIVE'])
+app.wsgi_app = TenantMiddleware(app.wsgi_app, prefix=app.config['TENANT_PREFIX'], domain=app.config['TENANT_DOMAIN'])
+# The shard a job or CLI command works on; requests keep theirs in g.
+_bound = threading.local()
+
+def current_shard():
+    """Shard of the request's tenant, or of the job or command being run."""
+    shard = g.get('shard') if has_request_context() else getattr(_bound, 'shard', None)
+    return shard if shard is not None else shards.get(DEFAULT_TENANT)
+
+# The current shard's parts, under the names they had before tenants.
+uploads = LocalProxy(lambda: current_shard().uploads)
+store = LocalProxy(lambda: current_shard().store)
+cache = LocalProxy(lambda: current_shard().cache)
+bill_numbers = LocalProxy(lambda: current_shard().bill_numbers)
+history_index = LocalProxy(lambda: current_shard().history_index)
+dashboard_stats = LocalProxy(lambda: current_shard().dashboard_stats)
+search_index = LocalProxy(lambda: current_shard().search_index)
+customers = LocalProxy(lambda: current_shard().customers)
+report_columns = LocalProxy(lambda: current_shard().reports)
+
+# Jobs are kept in SQLite under DATA_DIR and shared by every worker and
+# tenant; each tenant's jobs are a lane of their own.
+job_queue = JobQueue(os.path.join(DATA_DIR, 'jobs.db'), workers=app.config['JOB_WORKERS'],
+                     max_attempts=app.config['JOB_MAX_ATTEMPTS'])
+
+# Invoice PDFs are rendered in worker processes and kept on disk under a
+# hash of everything that goes into them.
+pdf_cache = RenderCache(app.config['PDF_CACHE_DIR'], '.pdf', max_bytes=app.config['PDF_CACHE_MAX_BYTES'])
+_pdf_pool = None
+_pdf_renders = {}
+_pdf_lock = threading.Lock()
+
+# Templates are compiled once per process, with bytecode cached on disk.
+template_registry.install(app, cache_dir=app.config['TEMPLATE_CACHE_DIR'])
+
+# Served at /metrics. Request and render times are histograms; the rest
+# are counters the store, cache and upload store keep anyway, read on scrape.
+metrics = Registry()
+request_seconds = metrics.histogram('bill_http_request_duration_seconds',
+                                    'Time to serve a request, by route.', ('route', 'method', 'status'))
+render_seconds = metrics.histogram('bill_template_render_seconds',
+                                   'Time to render a template.', ('template',))
+
+def over_shards(read):
+    """Scrape function summing ``read(shard)`` over the open shards."""
+    def total():
+        values = [value for value in map(read, shards.shards()) if value is not None]
+        return sum(values) if values else None
+    return total
+
+metrics.counter('bill_cache_hits_total', 'Reads served from the bill cache.', over_shards(lambda s: s.cache.hits))
+metrics.counter('bill_cache_misses_total', 'Reads that had to reload from the store.',
+                over_shards(lambda s: s.cache.misses))
+metrics.counter('bill_store_load_seconds_total', 'Time spent loading bills from the store.',
+                over_shards(lambda s: s.cache.load_seconds))
+metrics.counter('bill_store_commits_total', 'Bill writes committed to the store.',
+                over_shards(lambda s: s.store.commits))
+metrics.counter('bill_store_commit_seconds_total', 'Time spent committing bill writes.',
+                over_shards(lambda s: s.store.commit_seconds))
+metrics.counter('bill_store_read_bytes_total', 'Log and index bytes read (log store only).',
+                over_shards(lambda s: getattr(s.store, 'bytes_read', None)))
+metrics.counter('bill_store_written_bytes_total', 'Log and index bytes written (log store only).',
+                over_shards(lambda s: getattr(s.store, 'bytes_written', None)))
+metrics.counter('bill_number_leases_total', 'Blocks of bill numbers leased by this worker.',
+                over_shards(lambda s: s.bill_numbers.leases))
+metrics.gauge('bill_tenants_open', 'Tenant shards open in this worker.', lambda: len(shards.shards()))
+metrics.counter('bill_tenant_shards_opened_total', 'Tenant shards opened by this worker.', lambda: shards.opened)
+metrics.counter('bill_tenant_rejected_total', 'Requests turned away because their tenant had too many in flight.',
+                lambda: shards.rejected)
+metrics.counter('bill_jobs_total', 'Background jobs by what happened to them in this worker.',
+                lambda: [(('enqueued',), job_queue.enqueued), (('completed',), job_queue.completed),
+                         (('retried',), job_queue.retried), (('failed',), job_queue.failed)],
+                labels=('outcome',))
+metrics.gauge('bill_jobs', 'Background jobs in the queue by state.',
+              lambda: [((state,), count) for state, count in sorted(job_queue.counts().items())],
+              labels=('state',))
+metrics.gauge('bill_store_bytes', 'Size of the live bill data.', over_shards(lambda s: s.store.data_bytes()))
+metrics.gauge('bill_store_bills', 'Number of bills in the store.', over_shards(lambda s: s.store.count()))
+metrics.gauge('bill_store_hot_bytes', 'Size of the bills not sealed yet.', over_shards(lambda s: s.store.hot_bytes()))
+metrics.gauge('bill_store_sealed_months', 'Months sealed into segments.',
+              over_shards(lambda s: len(s.store.months())))
+_uploads_stored = over_shards(lambda s: s.uploads.saves - s.uploads.duplicates)
+_uploads_duplicate = over_shards(lambda s: s.uploads.duplicates)
+metrics.counter('bill_uploads_total', 'Uploads received, by whether the content was new.',
+                lambda: [(('stored',), _uploads_stored() or 0), (('duplicate',), _uploads_duplicate() or 0)],
+                ('result',))
+metrics.counter('bill_upload_bytes_total', 'Upload bytes received.', over_shards(lambda s: s.uploads.bytes_received))
+metrics.counter('bill_upload_seconds_total', 'Time spent storing uploads.',
+                over_shards(lambda s: s.uploads.save_seconds))
+metrics.counter('bill_process_io_bytes_total', 'Bytes read and written by this process, from /proc/self/io.',
+                lambda: [((kind,), value) for kind, value in sorted(process_io().items())
+                         if kind in ('rchar', 'wchar', 'read_bytes', 'write_bytes')], ('kind',))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    token = app.config['PROFILE_TOKEN']
+    if token and hmac.compare_digest(request.headers.get(app.config['PROFILE_HEADER'], ''), token):
+        g.profiler = Sampler(interval=app.config['PROFILE_INTERVAL']).start()
+
+@app.after_request
+def record_request(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    labels = (request.url_rule.rule if request.url_rule else 'unmatched', request.method,
+              str(response.status_code))
+    sampler = g.pop('profiler', None)
+    profile = None
+    if sampler is not None:
+        profile = os.path.join(app.config['PROFILE_DIR'], '%s-%s.txt' % (
+            time.strftime('%Y%m%dT%H%M%S'), uuid.uuid4().hex[:8]))
+        response.headers[app.config['PROFILE_HEADER']] = os.path.basename(profile)
+
+    # Streamed responses are only done once the body has been sent.
+    def finished():
+        request_seconds.observe(time.perf_counter() - started, *labels)
+        if sampler is not None:
+            sampler.stop()
+            os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+            atomic_write(profile, sampler.collapsed().encode('utf-8'))
+
+    response.call_on_close(finished)
+    return response
+
+@app.before_request
+def select_shard():
+    tenant = request.environ.get('bills.tenant', DEFAULT_TENANT)
+    if tenant != DEFAULT_TENANT:
+        location = shard_map.locate(tenant) if is_tenant(tenant) else None
+        if location is None:
+            abort(404)
+        if is_remote(location):
+            query = request.query_string.decode('latin-1')
+            return redirect(location.rstrip('/') + request.path + ('?' + query if query else ''), code=307)
+    try:
+        g.shard = shards.acquire(tenant, limited=tenant != DEFAULT_TENANT)
+    except Busy:
+        response = jsonify({'error': 'Too many requests for this business; try again shortly'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+
+@app.teardown_request
+def release_shard(exc):
+    shard = g.pop('shard', None)
+    if shard is not None:
+        shards.release(shard.name)
+
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def record_render(sender, template, context, **extra):
+    started = g.pop('render_started', None)
+    if started is not None:
+        render_seconds.observe(time.perf_counter() - started, template.name or 'string')
+
+@app.route('/metrics')
+def metrics_page():
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
 
 def load_data():
-    if not os.path.exists(DATA_FILE):
-        return {"business": {}, "bills": []}
-    with open(DATA_FILE, 'r') as f:
-        return json.load(f)
+    return cache.load()
 
 def save_data(data):
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
+    store.save(data)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
@@ -29,14 +328,201 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def _iso_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        abort(400)
+
+# Query arguments of the history filter form, kept in its "Older bills" link.
+HISTORY_FILTER_ARGS = ('q', 'from', 'to', 'min', 'max')
+
+def history_filters():
+    args = request.args
+    return {
+        'customer': args.get('q') or None,
+        'date_from': _iso_date(args.get('from')),
+        'date_to': _iso_date(args.get('to')),
+        'min_total': args.get('min', type=float),
+        'max_total': args.get('max', type=float),
+    }
+
+def _code_version():
+    # Pages change with the code and templates too, i.e. on every deploy.
+    root = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha1()
+    for folder in (root, os.path.join(root, 'templates')):
+        for name in sorted(os.listdir(folder)):
+            if name.endswith(('.py', '.html')):
+                st = os.stat(os.path.join(folder, name))
+                digest.update(('%s %d %d\n' % (name, st.st_mtime_ns, st.st_size)).encode('utf-8'))
+    return digest.hexdigest()[:12]
+
+CODE_VERSION = _code_version()
+
+def store_validators():
+    """``(etag, last_modified)`` of pages built from the store as it is now."""
+    # The time is read first, so a write landing in between makes the page
+    # look older than it is and never newer.
+    modified = store.modified()
+    stamp = (CODE_VERSION, current_shard().name, store.stamp())
+    etag = hashlib.sha1(repr(stamp).encode('utf-8')).hexdigest()[:20]
+    # Last-Modified has whole seconds: another write later in the same
+    # second would go unnoticed, so it is only sent once that second is over.
+    if not modified or time.time() - modified < 1:
+        modified = None
+    return etag, modified
+
+def conditional(view):
+    """Answer 304 without running ``view`` if the store hasn't changed since the client's copy."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        etag, modified = store_validators()
+        if request.if_none_match:
+            fresh = request.if_none_match.contains_weak(etag)
+        else:
+            since = request.if_modified_since
+            fresh = bool(since and modified and int(modified) <= since.timestamp())
+        if fresh:
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            # A page showing an image in place of its unfinished thumbnail
+            # must not be revalidated, or it would keep that image.
+            if response.status_code != 200 or g.get('thumbnail_pending'):
+                return response
+        response.set_etag(etag, weak=True)
+        if modified:
+            response.last_modified = modified
+        # Browsers may keep the page but must ask before showing it again.
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
+
+def history_page():
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    with cache.lock:
+        cache.sync()
+        try:
+            keys, next_cursor = history_index.page(
+                cursor=request.args.get('cursor'), limit=limit, keys=True, **history_filters())
+        except ValueError:
+            abort(400)
+        # The month a bill was created in is where a sealed one is found.
+        bills = [cache.get_bill(bill_id, created[:7]) for created, bill_id in keys]
+    return [bill for bill in bills if bill], next_cursor
+
 @app.route('/')
+@conditional
 def index():
-    data = load_data()
-    return render_template('index.html', business=data['business'], bills=data['bills'])
+    business = cache.get_business()
+    with cache.lock:
+        stats = {'count': dashboard_stats.count, 'revenue': dashboard_stats.revenue}
+    return render_template('index.html', business=business, stats=stats)
+
+@app.route('/api/stats')
+@conditional
+def api_stats():
+    days = request.args.get('days', 30, type=int)
+    top = request.args.get('top', 0, type=int)
+    with cache.lock:
+        cache.sync()
+        return jsonify(dashboard_stats.snapshot(days=days, top_customers=top))
+
+def with_shard(command):
+    """Give a CLI command a --tenant option and run it on that tenant's shard."""
+    @click.option('--tenant', default=DEFAULT_TENANT, help='Business to work on; the default one if omitted.')
+    @functools.wraps(command)
+    def run(tenant, *args, **kwargs):
+        try:
+            _bound.shard = shards.acquire(tenant, limited=False)
+        except LookupError as exc:
+            raise click.ClickException(str(exc))
+        try:
+            return command(*args, **kwargs)
+        finally:
+            _bound.shard = None
+            shards.release(tenant)
+    return run
+
+@app.cli.command('create-tenant')
+@click.argument('name')
+def create_tenant(name):
+    """Make the shard of a new business on the root the shard map picks."""
+    try:
+        print(shard_map.create(name))
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+
+@app.cli.command('rebuild-stats')
+@with_shard
+def rebuild_stats():
+    """Recompute dashboard aggregates from every bill and check the running ones.
+
+    The running aggregates are only kept in memory, built from the store's
+    sealed stats sections and the hot bills; nothing is written.
+    """
+    fresh = bill_stats.rebuild(store.iter_bills())
+    with cache.lock:
+        cache.sync()
+        matches = fresh.totals() == dashboard_stats.totals()
+    print('%d bills, revenue %.2f' % (fresh.count, fresh.revenue))
+    if not matches:
+        raise click.ClickException('running totals do not match the bills')
+    print('matches running totals')
+
+@app.cli.command('seal-bills')
+@with_shard
+def seal_bills():
+    """Move bills from before this month out of the log into sealed segments."""
+    months = store.seal()
+    print('sealed %s' % ', '.join(months) if months else 'nothing to seal')
+
+@app.cli.command('convert-bills')
+@click.argument('record_format', type=click.Choice(sorted(RECORD_CODECS)))
+@with_shard
+def convert_bills(record_format):
+    """Rewrite every bill, sealed months too, in RECORD_FORMAT.
+
+    Set BILL_RECORD_FORMAT to match, or new bills go on being written in the
+    old format.
+    """
+    if not hasattr(store, 'compact'):
+        raise click.ClickException('only the log store has record formats')
+    store.codec = record_format
+    store.compact(list(store.iter_bills()))
+    print('%d bills written as %s' % (store.count(), record_format))
+
+@app.cli.command('export-json')
+@click.argument('path', type=click.Path(dir_okay=False))
+@with_shard
+def export_json(path):
+    """Write the business settings and every bill to PATH as readable JSON.
+
+    The file has the layout of the old data.json, which a new store imports.
+    """
+    data = store.load()
+    atomic_write_json(path, data)
+    print('%d bills written to %s' % (len(data['bills']), path))
+
+@app.cli.command('revalidate-bills')
+@with_shard
+def revalidate_bills():
+    """Recompute every stored bill's totals and list the ones that disagree."""
+    bad = 0
+    store.refresh()
+    for bill, result in billing.revalidate(store.iter_bills()):
+        bad += 1
+        problem = '; '.join(result['errors']) or 'grandTotal %s, computed %s' % (
+            result['claimedTotal'], result['grandTotal'])
+        print('%s %s: %s' % (bill.get('id'), bill.get('billNumber'), problem))
+    print('%d of %d bills need attention' % (bad, store.count()))
 
 @app.route('/settings', methods=['GET', 'POST'])
 def settings():
-    data = load_data()
+    current = cache.get_business()
     if request.method == 'POST':
         business = {
             "shopName": request.form.get('shopName'),
@@ -44,43 +530,390 @@ def settings():
             "phone": request.form.get('phone'),
             "email": request.form.get('email'),
             "gstin": request.form.get('gstin'),
-            "logo": data['business'].get('logo', '')
+            "billPrefix": (request.form.get('billPrefix') or '').strip()[:16] or DEFAULT_BILL_PREFIX,
+            "billNumberReset": 'never' if request.form.get('billNumberReset') == 'never' else 'yearly',
+            "logo": current.get('logo', '')
         }
         
         logo = request.files.get('logo')
         if logo and allowed_file(logo.filename):
-            filename = secure_filename(logo.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            logo.save(filepath)
-            business['logo'] = url_for('static', filename='uploads/' + filename)
+            try:
+                business['logo'] = upload_url(uploads.save(logo.stream))
+            except ValueError:
+                pass
             
-        data['business'] = business
-        save_data(data)
+        store.set_business(business)
+        jobs = [audit('business.updated', shopName=business['shopName'])]
+        if upload_name(business['logo']):
+            jobs.append(('thumbnails', {'name': upload_name(business['logo'])}))
+        queue_jobs(jobs)
         return redirect(url_for('index'))
         
-    return render_template('settings.html', business=data['business'])
+    return render_template('settings.html', business=current)
 
 @app.route('/create', methods=['GET', 'POST'])
 def create():
-    data = load_data()
-    if not data['business']:
+    business = cache.get_business()
+    if not business:
         return redirect(url_for('settings'))
         
     if request.method == 'POST':
         # Logic to save a new bill
-        bill_data = request.json
-        bill_data['id'] = str(uuid.uuid4())
-        bill_data['createdAt'] = datetime.now().isoformat()
-        data['bills'].append(bill_data)
-        save_data(data)
-        return jsonify({'success': True, 'id': bill_data['id']})
+        bill_data = request.get_json(silent=True)
+        result = billing.evaluate(bill_data)
+        errors = billing.problems(result, app.config['BILL_TOTAL_POLICY'])
+        if errors:
+            return jsonify({'success': False, 'errors': errors}), 400
+        bill_data = prepare_bill(billing.apply_totals(bill_data, result), next_bill_numbers(business, 1)[0])
+        store.append_bill(bill_data)
+        job_ids = after_create_jobs(bill_data)
+        seal_if_due()
+        return jsonify({'success': True, 'id': bill_data['id'], 'billNumber': bill_data['billNumber'],
+                        'grandTotal': bill_data['grandTotal'], 'totalsMismatch': result['mismatch'],
+                        'jobs': job_ids})
         
-    return render_template('create.html', business=data['business'])
+    return render_template('create.html', business=business)
+
+def prepare_bill(bill_data, bill_number):
+    bill_data['id'] = str(uuid.uuid4())
+    bill_data['billNumber'] = bill_number
+    bill_data['createdAt'] = datetime.now().isoformat()
+    # Bulk records may leave the date out; the history lists bills by it.
+    if not isinstance(bill_data.get('billDate'), str) or not bill_data['billDate']:
+        bill_data['billDate'] = bill_data['createdAt']
+    return bill_data
+
+def next_bill_numbers(business, count):
+    """Allocate ``count`` bill numbers in the business's numbering scheme."""
+    prefix = business.get('billPrefix') or DEFAULT_BILL_PREFIX
+    year = None if business.get('billNumberReset') == 'never' else datetime.now().year
+    return bill_numbers.allocate(prefix, year, count)
+
+def read_bulk_records():
+    """Yield ``(bill, error)`` for each record of a JSON array or NDJSON body."""
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line), None
+            except ValueError:
+                yield None, 'invalid JSON line'
+        return
+    records = request.get_json(silent=True)
+    if not isinstance(records, list):
+        abort(400)
+    for record in records:
+        yield record, None
+
+@app.route('/api/bills/bulk', methods=['POST'])
+def bulk_create():
+    started = time.perf_counter()
+    records = list(read_bulk_records())
+    checks = billing.evaluate_many([bill_data for bill_data, _ in records])
+    results, valid = [], []
+    for index, ((bill_data, error), result) in enumerate(zip(records, checks)):
+        errors = [error] if error else billing.problems(result, app.config['BILL_TOTAL_POLICY'])
+        if errors:
+            results.append({'index': index, 'ok': False, 'errors': errors})
+            continue
+        valid.append((bill_data, result))
+        results.append({'index': index, 'ok': True, 'totalsMismatch': result['mismatch']})
+    numbers = next_bill_numbers(cache.get_business(), len(valid)) if valid else []
+    bills = [prepare_bill(billing.apply_totals(bill_data, result), number)
+             for (bill_data, result), number in zip(valid, numbers)]
+    for row, bill in zip((row for row in results if row['ok']), bills):
+        row.update(id=bill['id'], billNumber=bill['billNumber'])
+    store.append_bills(bills)
+    if bills:
+        queue_jobs([audit('bills.imported', count=len(bills), firstBillNumber=bills[0]['billNumber'],
+                          lastBillNumber=bills[-1]['billNumber'])])
+        seal_if_due()
+    elapsed = time.perf_counter() - started
+    return jsonify({
+        'created': len(bills),
+        'failed': len(results) - len(bills),
+        'seconds': round(elapsed, 4),
+        'billsPerSecond': round(len(bills) / elapsed, 1) if elapsed else None,
+        'results': results,
+    })
 
 @app.route('/history')
+@conditional
 def history():
-    data = load_data()
-    return render_template('history.html', bills=data['bills'])
+    bills, next_cursor = history_page()
+    filters = {k: request.args[k] for k in HISTORY_FILTER_ARGS if request.args.get(k)}
+    return render_template('history.html', bills=bills, next_cursor=next_cursor, filters=filters)
+
+@app.route('/api/bills')
+@conditional
+def api_bills():
+    bills, next_cursor = history_page()
+    return jsonify({'bills': bills, 'nextCursor': next_cursor})
+
+@app.route('/api/search')
+def api_search():
+    query = request.args.get('q', '')
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = request.args.get('limit', DEFAULT_SEARCH_LIMIT, type=int)
+    with cache.lock:
+        cache.sync()
+        hits, total = search_index.search(query, offset=offset, limit=limit)
+        results = []
+        for bill_id, score in hits:
+            bill = cache.get_bill(bill_id)
+            if bill:
+                results.append({
+                    'id': bill_id,
+                    'billNumber': bill.get('billNumber'),
+                    'billDate': bill.get('billDate'),
+                    'customerName': bill.get('customerName'),
+                    'customerPhone': bill.get('customerPhone'),
+                    'grandTotal': bill.get('grandTotal'),
+                    'score': score,
+                })
+    next_offset = offset + len(hits) if offset + len(hits) < total else None
+    return jsonify({'query': query, 'total': total, 'results': results, 'nextOffset': next_offset})
+
+@app.route('/api/customers/suggest')
+def suggest_customers():
+    prefix = request.args.get('prefix', '')
+    limit = request.args.get('limit', DEFAULT_SUGGEST_LIMIT, type=int)
+    with cache.lock:
+        cache.sync()
+        found = customers.suggest(prefix, limit=limit)
+    return jsonify({'prefix': prefix, 'customers': found})
+
+@app.route('/reports/<name>')
+@conditional
+def report(name):
+    if name not in bill_reports.REPORTS:
+        abort(404)
+    if bill_reports.np is None:
+        abort(501)
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'json'):
+        abort(400)
+    date_from = _iso_date(request.args.get('from'))
+    date_to = _iso_date(request.args.get('to'))
+    top = request.args.get('top', bill_reports.DEFAULT_TOP, type=int)
+    with cache.lock:
+        cache.sync()
+        snapshot = report_columns.snapshot(date_from, date_to)
+    build, columns = bill_reports.REPORTS[name]
+    rows = build(snapshot, top=top)
+    if fmt == 'json':
+        return jsonify({'report': name, 'from': date_from, 'to': date_to, 'rows': list(rows)})
+    filename = '%s_%s_%s.csv' % (name, date_from or 'start', date_to or 'end')
+    return Response(export.stream(export.csv_lines(rows, columns)), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=' + filename})
+
+@app.route('/export/bills.<fmt>')
+def export_bills(fmt):
+    if fmt not in ('csv', 'jsonl'):
+        abort(404)
+    rows = request.args.get('rows', 'items')
+    if rows not in ('items', 'bills'):
+        abort(400)
+    compress = request.args.get('gzip') in ('1', 'true')
+    date_from = _iso_date(request.args.get('from'))
+    date_to = _iso_date(request.args.get('to'))
+    store.refresh()
+    flat = export.flatten(export.in_date_range(store.iter_bills(date_from, date_to), date_from, date_to), rows)
+    if fmt == 'csv':
+        lines, mimetype = export.csv_lines(flat, export.columns_for(rows)), 'text/csv'
+    else:
+        lines, mimetype = export.jsonl_lines(flat), 'application/x-ndjson'
+    filename = 'bills.' + fmt
+    if compress:
+        filename, mimetype = filename + '.gz', 'application/gzip'
+    return Response(export.stream(lines, compress), mimetype=mimetype,
+                    headers={'Content-Disposition': 'attachment; filename=' + filename})
+
+def pdf_pool():
+    global _pdf_pool
+    if _pdf_pool is None:
+        _pdf_pool = ProcessPoolExecutor(max_workers=app.config['PDF_WORKERS'])
+    return _pdf_pool
+
+def static_file_bytes(url):
+    """Read a file referenced by a /static/... URL, or None."""
+    if not url or not url.startswith('/static/'):
+        return None
+    root = os.path.abspath(app.static_folder)
+    path = os.path.abspath(os.path.join(root, url[len('/static/'):]))
+    if not path.startswith(root + os.sep):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+def upload_url(name):
+    return url_for('upload_file', name=name)
+
+def upload_name(url):
+    """Name in the upload store of a .../static/uploads/... URL, or None."""
+    head, found, name = (url or '').partition('/static/uploads/')
+    prefix = app.config['TENANT_PREFIX']
+    if found and (not head or head.startswith(prefix) and is_tenant(head[len(prefix):])) and is_upload(name):
+        return name
+    return None
+
+@app.template_global()
+def thumbnail_url(url, size=128):
+    """URL of the ``size`` thumbnail of an uploaded image once it exists.
+
+    Falls back to ``url`` itself while the thumbnail is still being made and
+    for images that were not uploaded through the upload store.
+    """
+    name = upload_name(url)
+    thumb = uploads.thumbnail(name, size) if name else None
+    if name and not thumb and size in uploads.sizes and has_request_context():
+        g.thumbnail_pending = True
+    return upload_url(thumb) if thumb else url
+
+def image_bytes(url, size=512):
+    """Bytes of the ``size`` thumbnail of an uploaded image, or of the image
+    while there is none; other /static/ files are read as they are."""
+    name = upload_name(url)
+    if name is None:
+        return static_file_bytes(url)
+    thumb = uploads.thumbnail(name, size)
+    try:
+        with open(uploads.path(thumb or name), 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+@app.route('/static/uploads/<path:name>')
+def upload_file(name):
+    response = send_from_directory(os.path.abspath(uploads.directory), name)
+    if is_immutable(name):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['IMMUTABLE_MAX_AGE']
+        response.cache_control.immutable = True
+    return response
+
+def render_pdf(key, bill, business, logo, signature):
+    # Concurrent requests for the same invoice share one render.
+    with _pdf_lock:
+        future = _pdf_renders.get(key)
+        if future is None:
+            future = pdf_pool().submit(pdf.render_invoice, bill, business, logo, signature)
+            _pdf_renders[key] = future
+    try:
+        data = future.result()
+    finally:
+        with _pdf_lock:
+            if _pdf_renders.get(key) is future:
+                del _pdf_renders[key]
+    return pdf_cache.get(key) or pdf_cache.put(key, data)
+
+def invoice_pdf(bill):
+    """Path of ``bill``'s invoice in the PDF cache, rendering it if need be."""
+    business = cache.get_business()
+    logo = image_bytes(business.get('logo'))
+    signature = image_bytes(bill.get('signature'))
+    key = content_key(pdf.RENDERER_VERSION, bill, business, logo or b'', signature or b'')
+    return pdf_cache.get(key) or render_pdf(key, bill, business, logo, signature)
+
+@app.route('/bills/<bill_id>.pdf')
+def bill_pdf(bill_id):
+    bill = cache.get_bill(bill_id)
+    if bill is None:
+        abort(404)
+    try:
+        path = invoice_pdf(bill)
+    except pdf.UnsupportedText as exc:
+        return jsonify({'error': str(exc)}), 422
+    return send_file(os.path.abspath(path), mimetype='application/pdf', conditional=True,
+                     download_name='%s.pdf' % secure_filename(bill.get('billNumber') or bill_id))
+
+# -- background jobs ---------------------------------------------------------
+
+def shard_job(kind):
+    """Register the handler of ``kind`` jobs, run on the shard that queued them."""
+    def register(fn):
+        @functools.wraps(fn)
+        def run(payload):
+            # Held like a request's, so the pool cannot close it mid-job.
+            tenant = payload.get('tenant', DEFAULT_TENANT)
+            _bound.shard = shards.acquire(tenant, limited=False)
+            try:
+                return fn(payload)
+            finally:
+                _bound.shard = None
+                shards.release(tenant)
+        job_queue.handler(kind)(run)
+        return fn
+    return register
+
+def queue_jobs(jobs):
+    """Queue ``(kind, payload)`` jobs in the current tenant's lane; return their ids."""
+    tenant = current_shard().name
+    return job_queue.enqueue_many([(kind, dict(payload or {}, tenant=tenant)) for kind, payload in jobs],
+                                  lane=tenant)
+
+@shard_job('invoice-pdf')
+def invoice_pdf_job(payload):
+    bill = cache.get_bill(payload['billId'])
+    if bill is None:
+        raise LookupError('no bill %s' % payload['billId'])
+    return os.path.basename(invoice_pdf(bill))
+
+@shard_job('thumbnails')
+def thumbnails_job(payload):
+    return uploads.make_thumbnails(payload['name'])
+
+@shard_job('audit')
+def audit_job(payload):
+    line = json.dumps(payload, sort_keys=True).encode('utf-8') + b'\n'
+    # One O_APPEND write, so lines from several workers never interleave.
+    fd = os.open(current_shard().audit_log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+def audit(event, **details):
+    details.update(event=event, at=datetime.now().isoformat(), remoteAddr=request.remote_addr)
+    return 'audit', details
+
+def after_create_jobs(bill):
+    jobs = [audit('bill.created', billId=bill['id'], billNumber=bill['billNumber'],
+                  grandTotal=bill['grandTotal']),
+            ('invoice-pdf', {'billId': bill['id']})]
+    name = upload_name(bill.get('signature'))
+    if name:
+        jobs.append(('thumbnails', {'name': name}))
+    return queue_jobs(jobs)
+
+@shard_job('seal-bills')
+def seal_bills_job(payload):
+    return store.seal()
+
+def seal_if_due():
+    """Queue sealing of past months once the log has bills of a new month."""
+    shard = current_shard()
+    if store.needs_seal() and time.time() - shard.seal_queued > 60:
+        shard.seal_queued = time.time()
+        queue_jobs([('seal-bills', None)])
+
+@app.before_request
+def start_job_workers():
+    # Once per process, so that forked gunicorn workers get their own.
+    job_queue.start()
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None or job['lane'] != current_shard().name:
+        abort(404)
+    return jsonify(job)
 
 @app.route('/api/upload-signature', methods=['POST'])
 def upload_signature():
@@ -92,10 +925,11 @@ def upload_signature():
         return jsonify({'error': 'No selected file'}), 400
     
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        return jsonify({'message': 'Upload successful', 'filepath': url_for('static', filename='uploads/' + filename)}), 200
+        try:
+            name = uploads.save(file.stream)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'message': 'Upload successful', 'filepath': upload_url(name)}), 200
     
     return jsonify({'error': 'File type not allowed'}), 400
 
@@ -0,0 +1,8 @@
+"""Benchmarks for the Flask bill generator.
+
+Run the modules from flask-version/; they work in temporary directories
+and never touch the real data.
+
+    python -m benchmarks.render   # template render latency per page
+    python -m benchmarks.suite    # load test against synthetic stores
+"""
@@ -0,0 +1,130 @@
+"""Requests for the benchmarked routes and two ways of driving them.
+
+``client_load`` runs requests one after another through Flask's test
+client, in the app's own process. ``http_load`` spreads them over several
+client processes that hit a real server over keep-alive HTTP connections.
+Both return the per-request latencies in seconds.
+"""
+import datetime
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import resource
+import time
+
+from benchmarks import synth
+
+ROUTES = ('/', '/history', '/create', '/api/upload-signature')
+BOUNDARY = 'benchmark-boundary-7c1f'
+
+
+def build_request(route, index):
+    """Return ``(method, path, body, headers)`` for request ``index``."""
+    if route == '/create':
+        rng = random.Random(index)
+        bill = synth.make_bill(rng, 10 ** 7 + index, created=datetime.datetime.now())
+        del bill['id']
+        return 'POST', route, json.dumps(bill).encode('utf-8'), {'Content-Type': 'application/json'}
+    if route == '/api/upload-signature':
+        body = b''.join([
+            b'--%s\r\n' % BOUNDARY.encode('ascii'),
+            b'Content-Disposition: form-data; name="signature"; filename="signature.png"\r\n',
+            b'Content-Type: image/png\r\n\r\n',
+            synth.signature_png(index),
+            b'\r\n--%s--\r\n' % BOUNDARY.encode('ascii'),
+        ])
+        return 'POST', route, body, {'Content-Type': 'multipart/form-data; boundary=' + BOUNDARY}
+    return 'GET', route, None, {}
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def at(fraction):
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] * 1000
+
+    return {'p50_ms': at(0.50), 'p95_ms': at(0.95), 'p99_ms': at(0.99),
+            'mean_ms': sum(ordered) / len(ordered) * 1000, 'max_ms': ordered[-1] * 1000}
+
+
+# -- peak RSS --------------------------------------------------------------
+
+def reset_peak_rss(pid='self'):
+    """Reset the kernel's high-water RSS mark of ``pid`` (Linux only)."""
+    try:
+        with open('/proc/%s/clear_refs' % pid, 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb(pid='self'):
+    try:
+        with open('/proc/%s/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid == 'self':
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return None
+
+
+# -- drivers ---------------------------------------------------------------
+
+def client_load(client, route, requests, offset=0):
+    """Returns ``(samples, errors, elapsed_seconds)``."""
+    prepared = [build_request(route, index) for index in range(offset, offset + requests)]
+    samples, errors = [], 0
+    began = time.perf_counter()
+    for method, path, body, headers in prepared:
+        start = time.perf_counter()
+        response = client.open(path, method=method, data=body, headers=headers)
+        response.get_data()
+        samples.append(time.perf_counter() - start)
+        errors += response.status_code >= 400
+    return samples, errors, time.perf_counter() - began
+
+
+def _http_worker(job):
+    host, port, route, start, count = job
+    prepared = [build_request(route, index) for index in range(start, start + count)]
+    connection = http.client.HTTPConnection(host, port, timeout=300)
+    samples, errors = [], 0
+    first = time.perf_counter()
+    for method, path, body, headers in prepared:
+        began = time.perf_counter()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            errors += response.status >= 400
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            connection = http.client.HTTPConnection(host, port, timeout=300)
+        samples.append(time.perf_counter() - began)
+    connection.close()
+    # perf_counter is system-wide on Linux, so spans compare across workers.
+    return samples, errors, first, time.perf_counter()
+
+
+def http_load(host, port, route, requests, concurrency=4, offset=0):
+    """Returns ``(samples, errors, wall_seconds)``."""
+    share, extra = divmod(requests, concurrency)
+    jobs, start = [], offset
+    for worker in range(concurrency):
+        count = share + (worker < extra)
+        jobs.append((host, port, route, start, count))
+        start += count
+    with multiprocessing.get_context('fork' if os.name == 'posix' else 'spawn').Pool(concurrency) as pool:
+        results = pool.map(_http_worker, jobs, chunksize=1)
+    samples = [sample for result in results for sample in result[0]]
+    wall = max(result[3] for result in results) - min(result[2] for result in results)
+    return samples, sum(result[1] for result in results), wall
@@ -0,0 +1,101 @@
+"""Size, load time and memory of bills in each record format.
+
+"legacy" is the old ``data.json`` (one document, ``indent=4``); "json" and
+"packed" are the log store with that record codec. For each it reports the
+bytes on disk per bill, the time to open the store and parse every bill,
+and the bytes of a sealed segment per bill. Memory per bill compares the
+hot bills held as dicts with the ``Bill`` records the cache keeps.
+
+    python -m benchmarks.records [--bills 100000]
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks import synth  # noqa: E402
+from records import CODECS, Bill  # noqa: E402
+from segments import write_segment  # noqa: E402
+from store import LogStore  # noqa: E402
+
+
+def this_month_bills(count, seed):
+    # Dated this month, so the store keeps them all in the log.
+    rng = random.Random(seed)
+    start = datetime.datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return [synth.make_bill(rng, number, created=start + datetime.timedelta(seconds=number))
+            for number in range(count)]
+
+
+def timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def held_bytes(make):
+    gc.collect()
+    tracemalloc.start()
+    held = make()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del held
+    return size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--bills', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    bills = this_month_bills(args.bills, args.seed)
+    workdir = tempfile.mkdtemp(prefix='bench-records-')
+    try:
+        print('%-8s %12s %12s %12s' % ('format', 'bytes/bill', 'load (ms)', 'sealed B/bill'))
+        legacy = os.path.join(workdir, 'data.json')
+        with open(legacy, 'w') as f:
+            json.dump({'business': synth.BUSINESS, 'bills': bills}, f, indent=4)
+
+        def load_legacy():
+            with open(legacy) as f:
+                json.load(f)
+        print('%-8s %12.1f %12.1f %12s' % ('legacy', os.path.getsize(legacy) / len(bills),
+                                           timed(load_legacy) * 1e3, '-'))
+        for codec in CODECS:
+            directory = os.path.join(workdir, codec)
+            store = LogStore(directory, codec=codec)
+            store.append_bills(bills)
+            segment = os.path.join(workdir, codec + '.seg')
+            write_segment(segment, 'bench', bills, codec=codec)
+            print('%-8s %12.1f %12.1f %12.1f' % (
+                codec, os.path.getsize(store.log_path) / len(bills),
+                timed(lambda: list(LogStore(directory, codec=codec).iter_hot())) * 1e3,
+                os.path.getsize(segment) / len(bills)))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print()
+    dicts = held_bytes(lambda: [json.loads(json.dumps(bill)) for bill in bills])
+    records = held_bytes(lambda: [Bill.from_dict(json.loads(json.dumps(bill))) for bill in bills])
+    print('memory per bill: %.0f B as dicts, %.0f B as Bill records' % (dicts / len(bills), records / len(bills)))
+
+
+if __name__ == '__main__':
+    main()
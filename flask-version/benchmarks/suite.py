@@ -0,0 +1,257 @@
+"""Load-test app.py against synthetic stores of growing size.
+
+For every store size, a copy of a pristine synthetic store is benchmarked
+in a fresh process in two ways. ``client`` drives the routes
+sequentially through the Flask test client. ``http`` serves the app with
+a threaded WSGI server and drives it from several client processes. Each
+route gets a cold first request, which loads the store into the cache
+when it is the first route, followed by ``--requests`` timed ones. The
+results (p50/p95/p99 latency, throughput, peak RSS) are printed and
+written as JSON. With ``--baseline`` they are compared against an earlier
+run's file.
+
+    python -m benchmarks.suite --sizes 1k,10k --out results.json
+    python -m benchmarks.suite --sizes 1k,10k --baseline results.json --max-regression 15
+
+Pristine stores are built once and kept under ``--cache-dir``. Building
+1m bills takes a few minutes and about a gigabyte of disk.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from benchmarks import load, synth
+
+ROOT = synth.ROOT
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'bill-bench')
+
+
+def pristine_store(cache_dir, backend, count, seed):
+    directory = os.path.join(cache_dir, 'stores', '%s-%d-seed%d' % (backend, count, seed))
+    if not os.path.exists(os.path.join(directory, 'COMPLETE')):
+        shutil.rmtree(directory, ignore_errors=True)
+        started = time.perf_counter()
+        print('building %d-bill %s store...' % (count, backend), file=sys.stderr)
+        synth.build_store(directory, count, backend, seed)
+        open(os.path.join(directory, 'COMPLETE'), 'w').close()
+        print('  built in %.1fs' % (time.perf_counter() - started), file=sys.stderr)
+    return directory
+
+
+def workdir_for(pristine):
+    """A scratch tree laid out the way app.py expects, relative to the cwd."""
+    work = tempfile.mkdtemp(prefix='bill-bench-')
+    shutil.copytree(pristine, os.path.join(work, 'flask-version', 'data'),
+                    ignore=shutil.ignore_patterns('COMPLETE', 'LOCK'))
+    return work
+
+
+def _import_app(workdir, backend):
+    os.chdir(workdir)
+    os.environ['BILL_STORE'] = backend
+    sys.path.insert(0, ROOT)
+    import app
+    return app.app
+
+
+def _result(route, samples, errors, elapsed, first, rss):
+    row = {'route': route, 'requests': len(samples), 'errors': errors,
+           'first_ms': first * 1000, 'throughput_rps': len(samples) / elapsed if elapsed else None,
+           'peak_rss_mb': rss}
+    row.update(load.percentiles(samples))
+    return row
+
+
+# -- child processes -------------------------------------------------------
+
+def run_client(args):
+    """Child: benchmark every route in this process via the test client."""
+    client = _import_app(args.workdir, args.backend).test_client()
+    rows = []
+    for route in args.routes.split(','):
+        load.reset_peak_rss()
+        first, _, _ = load.client_load(client, route, 1, offset=10 ** 6)
+        samples, errors, elapsed = load.client_load(client, route, args.requests)
+        rows.append(_result(route, samples, errors, elapsed, first[0], load.peak_rss_mb()))
+    json.dump(rows, sys.stdout)
+
+
+def run_server(args):
+    """Child: serve the app until killed."""
+    import logging
+    import signal
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    application = _import_app(args.workdir, args.backend)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    # Exit normally on terminate() so the app's worker pools are shut down too.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    make_server('127.0.0.1', args.port, application, threaded=True).serve_forever()
+
+
+# -- orchestration ---------------------------------------------------------
+
+def _child(args, command, workdir, *extra):
+    return [sys.executable, '-m', 'benchmarks.suite', command, '--workdir', workdir,
+            '--backend', args.backend] + list(extra)
+
+
+def bench_client(args, pristine):
+    workdir = workdir_for(pristine)
+    try:
+        out = subprocess.run(_child(args, '_client', workdir, '--requests', str(args.requests),
+                                    '--routes', args.routes),
+                             cwd=ROOT, check=True, stdout=subprocess.PIPE).stdout
+        return json.loads(out)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def bench_http(args, pristine):
+    workdir = workdir_for(pristine)
+    port = _free_port()
+    server = subprocess.Popen(_child(args, '_serve', workdir, '--port', str(port)), cwd=ROOT,
+                              stdout=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 60
+        while True:
+            # Probe a missing page so that no route warms the bill cache early.
+            try:
+                urllib.request.urlopen('http://127.0.0.1:%d/__ready' % port, timeout=5).read()
+                break
+            except urllib.error.HTTPError:
+                break
+            except OSError:
+                if time.time() > deadline or server.poll() is not None:
+                    raise RuntimeError('benchmark server did not start')
+                time.sleep(0.1)
+        rows = []
+        for route in args.routes.split(','):
+            load.reset_peak_rss(server.pid)
+            first, _, _ = load.http_load('127.0.0.1', port, route, 1, 1, offset=10 ** 6)
+            samples, errors, wall = load.http_load('127.0.0.1', port, route, args.requests,
+                                                   args.concurrency)
+            rows.append(_result(route, samples, errors, wall, first[0], load.peak_rss_mb(server.pid)))
+        return rows
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(results, baseline, max_regression):
+    """Print changes against ``baseline``; return the rows that regressed."""
+    def key(row):
+        return row['size'], row['backend'], row['mode'], row['route']
+
+    before = {key(row): row for row in baseline['results']}
+    regressed = []
+    print()
+    print('%-6s %-6s %-24s %10s %10s %10s' % ('size', 'mode', 'route', 'p50', 'p95', 'rps'))
+    for row in results:
+        old = before.get(key(row))
+        if old is None:
+            continue
+
+        def change(field):
+            if not old.get(field) or row.get(field) is None:
+                return None
+            return (row[field] - old[field]) / old[field] * 100
+
+        p50, p95, rps = change('p50_ms'), change('p95_ms'), change('throughput_rps')
+        print('%-6s %-6s %-24s %+9.1f%% %+9.1f%% %+9.1f%%' % (
+            row['size'], row['mode'], row['route'], p50 or 0, p95 or 0, rps or 0))
+        if max_regression is not None and p95 is not None and p95 > max_regression:
+            regressed.append(row)
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('command', nargs='?', default='run', choices=['run', '_client', '_serve'],
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--sizes', default='1k,10k,100k', help='comma-separated: 1k,10k,100k,1m or counts')
+    parser.add_argument('--modes', default='client,http')
+    parser.add_argument('--routes', default=','.join(load.ROUTES))
+    parser.add_argument('--backend', default='log', choices=['log', 'sqlite'])
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per route')
+    parser.add_argument('--concurrency', type=int, default=4, help='HTTP client processes')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--out', help='write results here as JSON')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--max-regression', type=float,
+                        help='exit non-zero when a p95 is this many percent worse than the baseline')
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.command == '_client':
+        return run_client(args)
+    if args.command == '_serve':
+        return run_server(args)
+
+    results = []
+    print('%-6s %-6s %-24s %8s %8s %8s %8s %9s %8s %4s' % (
+        'size', 'mode', 'route', 'first', 'p50', 'p95', 'p99', 'req/s', 'rss MB', 'err'))
+    for size in args.sizes.split(','):
+        count = synth.parse_size(size)
+        pristine = pristine_store(args.cache_dir, args.backend, count, args.seed)
+        for mode in args.modes.split(','):
+            rows = bench_client(args, pristine) if mode == 'client' else bench_http(args, pristine)
+            for row in rows:
+                row.update(size=size, bills=count, backend=args.backend, mode=mode)
+                results.append(row)
+                print('%-6s %-6s %-24s %8.1f %8.2f %8.2f %8.2f %9.1f %8.1f %4d' % (
+                    size, mode, row['route'], row['first_ms'], row['p50_ms'], row['p95_ms'],
+                    row['p99_ms'], row['throughput_rps'] or 0, row['peak_rss_mb'] or 0, row['errors']))
+
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'commit': _git_commit(),
+            'args': {name: value for name, value in vars(args).items()
+                     if name not in ('command', 'workdir', 'port', 'out', 'baseline')},
+        },
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressed = compare(results, json.load(f), args.max_regression)
+        if regressed:
+            print('%d route(s) regressed by more than %g%% at p95' % (len(regressed), args.max_regression))
+            return 1
+    return 0
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    sys.exit(main())
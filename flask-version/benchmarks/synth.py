@@ -0,0 +1,123 @@
+"""Synthetic, reproducible bill stores.
+
+Bills look like the ones the create page posts: a few line items drawn
+from a shop catalogue, repeat customers, GST-style tax rates and the
+occasional discount, with totals worked out the way the browser does.
+The same ``seed`` always produces the same bills.
+"""
+import datetime
+import os
+import random
+import sys
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import customers  # noqa: E402
+import reports  # noqa: E402
+import search_index  # noqa: E402
+import stats  # noqa: E402
+from store import open_store  # noqa: E402
+from uploads import encode_png  # noqa: E402
+
+SIZES = {'1k': 1000, '10k': 10000, '100k': 100000, '1m': 1000000}
+
+CATALOGUE = [
+    ('Basmati rice 5kg', 625.0), ('Toor dal 1kg', 168.0), ('Sunflower oil 1L', 145.0),
+    ('Sugar 1kg', 46.0), ('Tea powder 500g', 260.0), ('Wheat flour 10kg', 455.0),
+    ('Detergent 1kg', 120.0), ('Toothpaste 150g', 95.0), ('Bath soap x4', 160.0),
+    ('Biscuits family pack', 60.0), ('Milk 1L', 66.0), ('Paneer 200g', 90.0),
+    ('Notebook A4', 55.0), ('Ball pens x10', 100.0), ('LED bulb 9W', 99.0),
+    ('Extension board', 349.0), ('Phone charger', 499.0), ('Water bottle 1L', 20.0),
+    ('Chips 52g', 20.0), ('Instant noodles x4', 56.0), ('Coffee 200g', 310.0),
+    ('Masala mix 100g', 72.0), ('Ghee 500ml', 330.0), ('Salt 1kg', 28.0),
+]
+FIRST_NAMES = ['Aarav', 'Priya', 'Rahul', 'Ananya', 'Vikram', 'Sneha', 'Arjun', 'Kavya',
+               'Rohan', 'Meera', 'Sanjay', 'Divya', 'Karan', 'Lakshmi', 'Imran', 'Fatima']
+LAST_NAMES = ['Sharma', 'Iyer', 'Patel', 'Reddy', 'Khan', 'Nair', 'Gupta', 'Singh',
+              'Das', 'Menon', 'Joshi', 'Rao']
+TAX_RATES = [0, 5, 5, 12, 18, 18]
+START = datetime.datetime(2023, 1, 1, 9, 0)
+
+BUSINESS = {'shopName': 'Benchmark Stores', 'shopAddress': '12 MG Road, Bengaluru',
+            'phone': '080 4000 1234', 'email': 'billing@example.com', 'gstin': '29ABCDE1234F1Z5',
+            'logo': ''}
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    return SIZES[text] if text in SIZES else int(text)
+
+
+def make_bill(rng, number, customers=5000, created=None):
+    customer = rng.randrange(customers)
+    name = '%s %s' % (FIRST_NAMES[customer % len(FIRST_NAMES)], LAST_NAMES[customer % len(LAST_NAMES)])
+    items = []
+    for _ in range(rng.choice((1, 1, 2, 2, 3, 3, 4, 5, 6, 8))):
+        description, price = rng.choice(CATALOGUE)
+        items.append({'description': description, 'quantity': rng.choice((1, 1, 1, 2, 2, 3, 5)),
+                      'price': price})
+    subtotal = sum(item['quantity'] * item['price'] for item in items)
+    tax_rate = rng.choice(TAX_RATES)
+    discount = rng.choice((0, 0, 0, 0, 10, 25, 50))
+    when = created or START + datetime.timedelta(minutes=number * 7 + rng.randrange(7))
+    return {
+        'id': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        'billNumber': 'BILL-%06d' % number,
+        'customerName': name,
+        'customerPhone': '9%09d' % (customer * 7919 % 10 ** 9),
+        'items': items,
+        'subtotal': subtotal,
+        'taxRate': tax_rate,
+        'discount': discount,
+        'grandTotal': subtotal + subtotal * tax_rate / 100 - discount,
+        'billDate': when.isoformat(),
+        'createdAt': when.isoformat(),
+        'signature': '',
+    }
+
+
+def make_bills(count, seed=1):
+    rng = random.Random(seed)
+    for number in range(count):
+        yield make_bill(rng, number)
+
+
+def build_store(directory, count, backend='log', seed=1, batch_size=10000):
+    """Fill a new store in ``directory`` with ``count`` synthetic bills.
+
+    Months before the current one are sealed, with the same segment
+    sections as app.py writes, as a running app would have.
+    """
+    os.makedirs(directory, exist_ok=True)
+    sections = {'search': search_index.pack_segment, 'stats': stats.pack_segment,
+                'customers': customers.pack_segment}
+    if reports.np is not None:
+        sections['reports'] = reports.pack_segment
+    store = open_store(backend, directory, sections=sections)
+    if store.count():
+        raise ValueError('%s already holds a store' % directory)
+    store.set_business(BUSINESS)
+    batch = []
+    for bill in make_bills(count, seed):
+        batch.append(bill)
+        if len(batch) >= batch_size:
+            store.append_bills(batch)
+            batch = []
+    store.append_bills(batch)
+    store.seal()
+    return store
+
+
+def signature_png(seed, width=240, height=80):
+    """A small grayscale PNG of a scribble, different for every ``seed``."""
+    rng = random.Random(seed)
+    pixels = bytearray(b'\xff' * (width * height))
+    x, y = 10, height // 2
+    for _ in range(width * 2):
+        x = min(width - 1, max(0, x + rng.choice((0, 1, 1, 2))))
+        y = min(height - 1, max(0, y + rng.choice((-2, -1, 0, 1, 2))))
+        pixels[y * width + x] = 0
+    return encode_png(width, height, 1, bytes(pixels))
@@ -0,0 +1,92 @@
+"""Server-side bill numbers.
+
+Numbers come from sequences kept in one small JSON file: one per prefix,
+and per year when numbering restarts every year. A worker leases a block
+of numbers at a time under a file lock and hands them out from memory,
+so a bill costs no cross-process lock and no two workers ever give out
+the same number. Numbers still unused in a block when the worker exits
+are given back if nothing was leased after them, and skipped otherwise:
+numbers are unique and increase within a worker, but may have gaps.
+"""
+import atexit
+import json
+import os
+import threading
+
+from writer import FileLock, atomic_write_json
+
+DEFAULT_PREFIX = 'BILL-'
+BLOCK_SIZE = 50
+
+
+def format_number(prefix, year, sequence):
+    if year is None:
+        return '%s%06d' % (prefix, sequence)
+    return '%s%d-%06d' % (prefix, year, sequence)
+
+
+class BillNumbers:
+    def __init__(self, directory, block_size=BLOCK_SIZE):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, 'bill-numbers.json')
+        self.block_size = block_size
+        self.leases = 0
+        self._file_lock = FileLock(os.path.join(directory, 'bill-numbers.lock'))
+        self._lock = threading.Lock()
+        # (prefix, year) -> [next, end) of the block this worker holds.
+        self._blocks = {}
+        atexit.register(self.release)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _lease(self, key, count, old=None):
+        """Lease a block of ``count`` numbers; return it as ``[next, end]``.
+
+        What is left of the ``old`` block starts the new one if nothing was
+        leased after it, and is skipped otherwise.
+        """
+        with self._file_lock:
+            sequences = self._read()
+            start = sequences.get(key, 1)
+            if old is not None and old[0] < old[1] and start == old[1]:
+                start = old[0]
+            sequences[key] = start + count
+            atomic_write_json(self.path, sequences)
+        self.leases += 1
+        return [start, start + count]
+
+    def allocate(self, prefix=DEFAULT_PREFIX, year=None, count=1):
+        """Return ``count`` new bill numbers, one contiguous increasing run."""
+        key = '%s|%s' % (prefix, '' if year is None else year)
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None or block[1] - block[0] < count:
+                block = self._blocks[key] = self._lease(key, max(self.block_size, count), block)
+            numbers = range(block[0], block[0] + count)
+            block[0] += count
+        return [format_number(prefix, year, sequence) for sequence in numbers]
+
+    def release(self):
+        """Give back unused numbers that are still the end of their sequence."""
+        # Called by a shard's close() too; don't keep a closed shard alive
+        # until exit.
+        atexit.unregister(self.release)
+        with self._lock:
+            blocks = [(key, block) for key, block in self._blocks.items() if block[0] < block[1]]
+            self._blocks = {}
+            if not blocks:
+                return
+            with self._file_lock:
+                sequences = self._read()
+                changed = False
+                for key, (start, end) in blocks:
+                    if sequences.get(key) == end:
+                        sequences[key] = start
+                        changed = True
+                if changed:
+                    atomic_write_json(self.path, sequences)
@@ -0,0 +1,217 @@
+"""Server-side bill validation and totals.
+
+The browser's ``calculateTotals()`` works in binary floating point and the
+create page posts a ``grandTotal`` scraped from the DOM. This module is the
+authority instead: it checks the shape of a bill and its ``items`` and
+recomputes line totals, subtotal, tax and grand total with exact decimal
+arithmetic, rounding each money value half-up to the paisa.
+
+``evaluate_many()`` works over a whole batch at once: every line item of
+every bill is converted and multiplied in one flat pass, which is what
+create(), bulk imports and store re-validation all go through.
+"""
+from decimal import Decimal, DecimalException, InvalidOperation, ROUND_HALF_UP
+import operator
+
+PAISA = Decimal('0.01')
+HUNDRED = Decimal(100)
+ZERO = Decimal(0)
+# Differences up to this are rounding noise from the client's float maths.
+TOLERANCE = Decimal('0.01')
+# Upper limits on what a bill may hold. Totals stay exact as float rupees
+# and as int64 paise, which the store and the reports keep them in.
+MAX_QUANTITY = Decimal(10 ** 6)
+MAX_PRICE = Decimal(10 ** 9)
+MAX_AMOUNT = Decimal(10 ** 11)
+
+
+def client_total(products, tax_rate, discount):
+    """Grand total the way ``calculateTotals()`` works it out, exactly.
+
+    The browser sums unrounded ``quantity * price`` and rounds only the
+    grand total, so with many fractional lines it can be a few paise off
+    a total built from rounded line totals and still be right.
+    """
+    subtotal = sum(products, ZERO)
+    return max(ZERO, money(subtotal + subtotal * tax_rate / HUNDRED - discount))
+
+
+def to_decimal(value):
+    """Convert a JSON number or numeric string; None if it is not one."""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float, str)):
+        try:
+            result = Decimal(str(value).strip())
+        except InvalidOperation:
+            return None
+        return result if result.is_finite() else None
+    return None
+
+
+def money(value):
+    return value.quantize(PAISA, rounding=ROUND_HALF_UP)
+
+
+class _Converter:
+    """Memoising ``to_decimal`` for one batch; POS data repeats prices a lot."""
+
+    def __init__(self):
+        self._numbers = {}
+        self._lines = {}
+
+    def number(self, raw):
+        key = (type(raw), raw)
+        try:
+            return self._numbers[key]
+        except KeyError:
+            value = self._numbers[key] = to_decimal(raw)
+            return value
+        except TypeError:  # unhashable
+            return None
+
+    def line_total(self, quantity, price):
+        key = (quantity, price)
+        try:
+            return self._lines[key]
+        except KeyError:
+            value = self._lines[key] = money(quantity * price)
+            return value
+
+
+def _field(convert, record, name, errors, index=None, maximum=None):
+    raw = record.get(name)
+    if raw is None or raw == '':
+        return ZERO
+    value = convert.number(raw)
+    if value is None or value < 0 or (maximum is not None and value > maximum):
+        label = name if index is None else 'items[%d].%s' % (index, name)
+        errors.append('%s must be a number%s' % (
+            label, ' between 0 and %s' % maximum if maximum is not None else ' >= 0'))
+        return ZERO
+    return value
+
+
+def check_shape(bill, convert=None):
+    """Return ``(errors, quantities, prices, tax_rate, discount)``."""
+    convert = convert or _Converter()
+    errors = []
+    quantities, prices = [], []
+    if not isinstance(bill, dict):
+        return ['bill must be a JSON object'], quantities, prices, ZERO, ZERO
+    name = bill.get('customerName')
+    if not isinstance(name, str) or not name.strip():
+        errors.append('customerName is required')
+    items = bill.get('items')
+    if not isinstance(items, list) or not items:
+        errors.append('items must be a non-empty list')
+        items = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append('items[%d] must be an object' % index)
+            continue
+        if not isinstance(item.get('description', ''), str):
+            errors.append('items[%d].description must be a string' % index)
+        quantities.append(_field(convert, item, 'quantity', errors, index, MAX_QUANTITY))
+        prices.append(_field(convert, item, 'price', errors, index, MAX_PRICE))
+    tax_rate = _field(convert, bill, 'taxRate', errors, maximum=HUNDRED)
+    discount = _field(convert, bill, 'discount', errors, maximum=MAX_AMOUNT)
+    return errors, quantities, prices, tax_rate, discount
+
+
+def evaluate_many(bills):
+    """Validate and total every bill in ``bills``.
+
+    Returns one dict per bill with ``errors`` (schema problems), the
+    computed ``lineTotals``, ``subtotal``, ``taxAmount`` and ``grandTotal``
+    as Decimals, and ``mismatch`` when the bill's own grandTotal is more
+    than a paisa away from both the computed one and ``client_total()``.
+    Amounts over the limits are errors of their bill, not exceptions.
+    """
+    convert = _Converter()
+    shapes = [check_shape(bill, convert) for bill in bills]
+    # One flat pass over every line item in the batch.
+    quantities = [q for shape in shapes for q in shape[1]]
+    prices = [p for shape in shapes for p in shape[2]]
+    line_totals = list(map(convert.line_total, quantities, prices))
+    products = list(map(operator.mul, quantities, prices))
+
+    results = []
+    position = 0
+    for bill, (errors, bill_quantities, _, tax_rate, discount) in zip(bills, shapes):
+        lines = line_totals[position:position + len(bill_quantities)]
+        unrounded = products[position:position + len(bill_quantities)]
+        position += len(bill_quantities)
+        subtotal = sum(lines, ZERO)
+        tax = money(subtotal * tax_rate / HUNDRED)
+        grand_total = max(ZERO, money(subtotal + tax - discount))
+        claimed = convert.number(bill.get('grandTotal')) if isinstance(bill, dict) else None
+        if subtotal + tax > MAX_AMOUNT:
+            errors.append('total must not exceed %s' % MAX_AMOUNT)
+        try:
+            mismatch = claimed is not None and abs(claimed - grand_total) > TOLERANCE \
+                and abs(claimed - client_total(unrounded, tax_rate, discount)) > TOLERANCE
+        except DecimalException:  # a claimed total too large to compare
+            errors.append('grandTotal is out of range')
+            claimed, mismatch = None, False
+        results.append({
+            'errors': errors,
+            'lineTotals': lines,
+            'subtotal': subtotal,
+            'taxAmount': tax,
+            'grandTotal': grand_total,
+            'claimedTotal': claimed,
+            'mismatch': mismatch,
+        })
+    return results
+
+
+def evaluate(bill):
+    return evaluate_many([bill])[0]
+
+
+def apply_totals(bill, result):
+    """Overwrite the bill's money fields with the computed ones.
+
+    A client total that disagreed is kept as ``clientGrandTotal`` and the
+    bill is flagged with ``totalsMismatch``.
+    """
+    for item, line_total in zip(bill.get('items') or [], result['lineTotals']):
+        item['total'] = float(line_total)
+    bill['subtotal'] = float(result['subtotal'])
+    bill['taxAmount'] = float(result['taxAmount'])
+    bill['grandTotal'] = float(result['grandTotal'])
+    if result['mismatch']:
+        bill['clientGrandTotal'] = float(result['claimedTotal'])
+        bill['totalsMismatch'] = True
+    return bill
+
+
+def problems(result, policy):
+    """Errors that should stop a bill from being stored under ``policy``."""
+    errors = list(result['errors'])
+    if policy == 'reject' and result['mismatch'] and not errors:
+        errors.append('grandTotal %s does not match computed total %s' % (
+            result['claimedTotal'], result['grandTotal']))
+    return errors
+
+
+def revalidate(bills, batch_size=5000):
+    """Re-check stored bills in batches; yield ``(bill, result)`` for bad ones.
+
+    Stored bills that were already flagged are only reported when their
+    recorded total no longer matches the recomputation.
+    """
+    batch = []
+    for bill in bills:
+        batch.append(bill)
+        if len(batch) >= batch_size:
+            yield from _bad(batch)
+            batch = []
+    yield from _bad(batch)
+
+
+def _bad(batch):
+    for bill, result in zip(batch, evaluate_many(batch)):
+        if result['errors'] or result['mismatch']:
+            yield bill, result
@@ -0,0 +1,150 @@
+"""In-process cache of the parsed bill store.
+
+Every read first compares the store's ``stamp()`` (a couple of ``stat``
+calls for the log store, one tiny query for SQLite) with the one seen last.
+If nothing changed, the cached business settings and bills are served
+without touching the data files. If another worker appended bills, only
+those are read via ``changes_since()``; a compaction or rewrite falls back
+to a full reload. Subscribed indexes are fed the same stream of changes.
+
+Only the log store's hot month is parsed and held, as compact ``Bill``
+records rather than dicts; readers get a fresh dict. Sealed months are handed
+to listeners as an archive they read lazily, and single bills from them are
+fetched from the store.
+"""
+import threading
+import time
+
+from records import Bill
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class StoreCache:
+    def __init__(self, store, max_bytes=DEFAULT_MAX_BYTES):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Time spent (re)loading from the store on misses.
+        self.load_seconds = 0.0
+        self.lock = threading.RLock()
+        self._stamp = None
+        self._cursor = None
+        self._business = {}
+        self._bills = []
+        self._positions = {}
+        self._holds_bills = False
+        self._archived = False
+        self._listeners = []
+
+    def subscribe(self, listener):
+        """Keep ``listener`` in step with the store.
+
+        Listeners implement ``clear()`` and ``add(bill)``; ``add`` is also
+        called for a bill that supersedes one with the same id. A listener
+        with an ``add_archive(store)`` method gets it called after every
+        ``clear()``, before the hot bills are added, to take in the store's
+        sealed months (``store.months()``, ``store.segment(month)``, ...).
+        """
+        with self.lock:
+            self._listeners.append(listener)
+            self._stamp = None
+            self._cursor = None
+
+    def _sync(self):
+        stamp = self.store.stamp()
+        if stamp == self._stamp:
+            self.hits += 1
+            return
+        self.misses += 1
+        started = time.perf_counter()
+        self._business = self.store.get_business()
+        # Over the cap only business settings are kept and bill reads go
+        # straight to the store; listeners are still fed every change.
+        hold = self.store.hot_bytes() <= self.max_bytes
+        if hold and not self._holds_bills:
+            self._cursor = None
+        cursor, changed = self.store.changes_since(self._cursor)
+        try:
+            if changed is None:
+                self._bills, self._positions = [], {}
+                self._archived = bool(self.store.months())
+                for listener in self._listeners:
+                    listener.clear()
+                    if hasattr(listener, 'add_archive'):
+                        listener.add_archive(self.store)
+                changed = self.store.iter_hot()
+            for bill in changed:
+                if hold:
+                    self._apply(bill)
+                for listener in self._listeners:
+                    listener.add(bill)
+        except Exception:
+            # Some listeners have seen bills others have not; the next sync
+            # starts them all over from a full reload.
+            self._stamp = self._cursor = None
+            raise
+        self._cursor = cursor
+        if not hold:
+            self._bills, self._positions = [], {}
+        self._holds_bills = hold
+        self._stamp = stamp
+        self.load_seconds += time.perf_counter() - started
+
+    def _apply(self, bill):
+        position = self._positions.get(bill.get('id'))
+        record = Bill.from_dict(bill)
+        if position is None:
+            self._positions[bill.get('id')] = len(self._bills)
+            self._bills.append(record)
+        else:
+            self._bills[position] = record
+
+    def sync(self):
+        with self.lock:
+            self._sync()
+
+    def invalidate(self):
+        with self.lock:
+            self._stamp = None
+            self._cursor = None
+
+    def get_business(self):
+        with self.lock:
+            self._sync()
+            return dict(self._business)
+
+    def get_bill(self, bill_id, month=None):
+        """The bill with ``bill_id``; ``month`` is a hint for sealed bills."""
+        with self.lock:
+            self._sync()
+            if self._holds_bills:
+                position = self._positions.get(bill_id)
+                if position is not None:
+                    return self._bills[position].to_dict()
+                if not self._archived:
+                    return None
+        return self.store.get_bill(bill_id, month)
+
+    def load(self):
+        """Return ``{"business", "bills"}``.
+
+        With sealed months this reads every bill from the store.
+        """
+        with self.lock:
+            self._sync()
+            if self._holds_bills and not self._archived:
+                return {"business": dict(self._business), "bills": [bill.to_dict() for bill in self._bills]}
+        return self.store.load()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'loadSeconds': self.load_seconds,
+            'bills': len(self._bills),
+            'holdsBills': self._holds_bills,
+            'sealedMonths': len(self.store.months()),
+            'maxBytes': self.max_bytes,
+        }
@@ -0,0 +1,181 @@
+"""Directory of the customers seen on bills, for autocomplete.
+
+Bills are grouped into customers by ``stats.customer_key()`` (phone digits,
+or the name when there is no phone). Each customer keeps the name and phone
+of their latest bill and how many bills they have.
+
+Suggestions come from one sorted array of ``term \\0 customer`` entries,
+where the terms are the words of the name and the phone digits, the same
+terms the history filter uses. A prefix lookup is a bisect plus a short scan
+that stops once ``limit`` customers are found, so its cost does not grow
+with the size of the directory. Customers come out in order of the term that
+matched, then of their key.
+
+Entries for new customers are buffered and merged into the array on the
+next lookup, so loading a store with many customers sorts once instead of
+inserting one at a time. Sealed months of the log store carry their
+customers in a ``customers`` segment section written by ``pack_segment()``.
+"""
+from bisect import bisect_left, insort
+import json
+
+from history_index import customer_terms, query_terms, sort_key
+from records import id_key
+from segments import bill_month
+from stats import customer_key
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+# Entries looked at for a query of several words before giving up.
+MAX_SCAN = 2000
+# Fewer buffered entries than this are inserted one by one, more are sorted in.
+MERGE_BATCH = 64
+
+
+def _entry(term, key):
+    return '%s\0%s' % (term, key)
+
+
+def _words(terms):
+    # Matched against ' ' + word for queries of several words.
+    return ' ' + ' '.join(terms)
+
+
+def _contribution(bill):
+    return (customer_key(bill), (bill.get('customerName') or '').strip(), (bill.get('customerPhone') or '').strip(),
+            sort_key(bill)[0])
+
+
+class CustomerDirectory:
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # key -> [name, phone, bills, last bill's createdAt, _words(terms)]
+        self._customers = {}
+        # Hot bill id -> customer key, to move a bill that is written again.
+        self._bills = {}
+        self._entries = []
+        self._pending = []
+        self._archive = None
+
+    def __len__(self):
+        return len(self._customers)
+
+    def add_archive(self, archive):
+        self._archive = archive
+        for month in archive.months():
+            segment = archive.segment(month)
+            section = segment.section('customers')
+            if section is None:
+                for bill in segment.iter_bills():
+                    self._add(*_contribution(bill))
+            else:
+                for key, (name, phone, count, last) in json.loads(bytes(section)).items():
+                    self._add(key, name, phone, last, count)
+
+    def add(self, bill):
+        bill_id = str(bill.get('id', ''))
+        previous = self._bills.pop(bill_id, None)
+        if previous is None and self._archive is not None:
+            previous = self._sealed(bill_id, bill)
+        if previous is not None:
+            self._drop(previous)
+        contribution = _contribution(bill)
+        if contribution[0]:
+            self._bills[bill_id] = contribution[0]
+            self._add(*contribution)
+
+    def _sealed(self, bill_id, bill):
+        """Customer key of the sealed copy of ``bill``, if its month has one."""
+        segment = self._archive.segment(bill_month(bill))
+        doc = None if segment is None else segment.find(id_key(bill_id))
+        return None if doc is None else customer_key(segment.read(doc))
+
+    def _add(self, key, name, phone, created, count=1):
+        if not key:
+            return
+        customer = self._customers.get(key)
+        if customer is None:
+            terms = customer_terms(name, phone)
+            self._customers[key] = [name, phone, count, created, _words(terms)]
+            self._index(key, terms)
+            return
+        customer[2] += count
+        if created >= customer[3] and (name or phone):
+            old = customer_terms(customer[0], customer[1])
+            customer[0], customer[1], customer[3] = name or customer[0], phone or customer[1], created
+            new = customer_terms(customer[0], customer[1])
+            if new != old:
+                customer[4] = _words(new)
+                self._unindex(key, old - new)
+                self._index(key, new - old)
+
+    def _drop(self, key):
+        customer = self._customers.get(key)
+        if customer is None:
+            return
+        customer[2] -= 1
+        if customer[2] <= 0:
+            del self._customers[key]
+            self._unindex(key, customer_terms(customer[0], customer[1]))
+
+    def _index(self, key, terms):
+        self._pending.extend(_entry(term, key) for term in terms)
+
+    def _unindex(self, key, terms):
+        self._flush()
+        for term in terms:
+            entry = _entry(term, key)
+            position = bisect_left(self._entries, entry)
+            if position < len(self._entries) and self._entries[position] == entry:
+                del self._entries[position]
+
+    def _flush(self):
+        if len(self._pending) < MERGE_BATCH:
+            for entry in self._pending:
+                insort(self._entries, entry)
+        else:
+            self._entries.extend(self._pending)
+            self._entries.sort()
+        self._pending = []
+
+    def suggest(self, prefix, limit=DEFAULT_LIMIT):
+        """Customers with a name word or phone starting with each word of ``prefix``."""
+        words = [word for word in query_terms(prefix) if word]
+        limit = max(1, min(limit, MAX_LIMIT))
+        if not words:
+            return []
+        if self._pending:
+            self._flush()
+        entries = self._entries
+        # Scan the word with the fewest entries; check the others against
+        # each customer's words.
+        ranges = sorted((bisect_left(entries, word[:-1] + chr(ord(word[-1]) + 1)) - bisect_left(entries, word),
+                         word) for word in words)
+        first = ranges[0][1]
+        rest = [' ' + word for _, word in ranges[1:]]
+        position = bisect_left(entries, first)
+        found, seen, scanned = [], set(), 0
+        while position < len(entries) and len(found) < limit and scanned < MAX_SCAN:
+            term, _, key = entries[position].partition('\0')
+            if not term.startswith(first):
+                break
+            position += 1
+            scanned += 1
+            if key in seen:
+                continue
+            seen.add(key)
+            name, phone, count, last, haystack = self._customers[key]
+            if all(word in haystack for word in rest):
+                found.append({'name': name, 'phone': phone, 'bills': count, 'lastBillAt': last or None})
+        return found
+
+
+def pack_segment(bills):
+    """The ``customers`` section of a sealed segment holding ``bills``."""
+    directory = CustomerDirectory()
+    for bill in bills:
+        directory._add(*_contribution(bill))
+    customers = {key: customer[:4] for key, customer in directory._customers.items()}
+    return json.dumps(customers, separators=(',', ':')).encode('utf-8')
@@ -0,0 +1,99 @@
+"""Streaming CSV / JSON Lines export of stored bills.
+
+Everything here is a generator over ``store.iter_bills()``, so an export
+holds one buffered chunk in memory however many bills there are.
+"""
+import csv
+import io
+import json
+import zlib
+
+from history_index import sort_key
+
+CHUNK_SIZE = 64 * 1024
+
+BILL_COLUMNS = ['id', 'billNumber', 'createdAt', 'billDate', 'customerName', 'customerPhone',
+                'subtotal', 'taxRate', 'discount', 'grandTotal']
+ITEM_COLUMNS = ['itemIndex', 'description', 'quantity', 'price', 'lineTotal']
+
+
+def in_date_range(bills, date_from=None, date_to=None):
+    for bill in bills:
+        day = sort_key(bill)[0][:10]
+        if (date_from is None or day >= date_from) and (date_to is None or day <= date_to):
+            yield bill
+
+
+def _line_total(item):
+    try:
+        return round(float(item.get('quantity') or 0) * float(item.get('price') or 0), 2)
+    except (TypeError, ValueError):
+        return None
+
+
+def flatten(bills, rows='items'):
+    """Yield flat dicts: one per bill, or one per line item.
+
+    In ``items`` mode a bill without items still gets one row so that it
+    shows up in the export.
+    """
+    for bill in bills:
+        base = {column: bill.get(column) for column in BILL_COLUMNS}
+        if rows == 'bills':
+            base['itemCount'] = len(bill.get('items') or [])
+            yield base
+            continue
+        items = bill.get('items') or [None]
+        for index, item in enumerate(items):
+            row = dict(base)
+            if item is not None:
+                row.update(itemIndex=index, description=item.get('description'),
+                           quantity=item.get('quantity'), price=item.get('price'),
+                           lineTotal=_line_total(item))
+            yield row
+
+
+def columns_for(rows):
+    return BILL_COLUMNS + (['itemCount'] if rows == 'bills' else ITEM_COLUMNS)
+
+
+def _chunked(pieces):
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer).encode('utf-8')
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def csv_lines(rows, columns):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+    yield out.getvalue()
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def stream(lines, compress=False):
+    chunks = _chunked(lines)
+    if not compress:
+        yield from chunks
+        return
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = gz.compress(chunk)
+        if data:
+            yield data
+    yield gz.flush()
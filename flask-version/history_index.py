@@ -0,0 +1,204 @@
+"""Sorted index over bills for paginated, filtered history views.
+
+Bills are ordered newest first by ``(createdAt, id)``. Pages are addressed
+by an opaque cursor holding the sort key of the last bill shown, so a page
+costs O(page size) no matter how deep into history it is. Customer filters
+use a prefix-searchable term index over names and phone numbers instead of
+scanning every bill.
+
+Sealed months of the log store are indexed one month at a time, when a
+page first reaches them, and only the most recently used ``max_months``
+are kept.
+"""
+import base64
+import binascii
+from bisect import bisect_left, insort
+from collections import OrderedDict
+import heapq
+import json
+import re
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_MONTHS = 12
+UNDATED = 'undated'
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def sort_key(bill):
+    # Bills from the standalone app predate createdAt; fall back to billDate.
+    return (bill.get('createdAt') or bill.get('billDate') or '', str(bill.get('id', '')))
+
+
+def customer_terms(name, phone):
+    terms = set(_WORD.findall((name or '').lower()))
+    digits = re.sub(r'\D', '', phone or '')
+    if digits:
+        terms.add(digits)
+    return terms
+
+
+def query_terms(text):
+    text = text.strip()
+    if re.fullmatch(r'[\d\s+()-]+', text):
+        return {re.sub(r'\D', '', text)}
+    return set(_WORD.findall(text.lower()))
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, bill_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError('invalid cursor')
+    return (str(created_at), str(bill_id))
+
+
+def _amount(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class HistoryIndex:
+    def __init__(self, max_months=MAX_MONTHS):
+        self.max_months = max_months
+        self.clear()
+
+    def clear(self):
+        self._keys = []
+        self._entries = {}
+        self._terms = {}
+        self._term_list = []
+        self._archive = None
+        self._sealed = OrderedDict()
+
+    def add_archive(self, archive):
+        self._archive = archive
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, bill):
+        bill_id = str(bill.get('id', ''))
+        if bill_id in self._entries:
+            self._remove(bill_id)
+        key = sort_key(bill)
+        terms = customer_terms(bill.get('customerName'), bill.get('customerPhone'))
+        self._entries[bill_id] = (key, _amount(bill.get('grandTotal')), terms)
+        if not self._keys or key >= self._keys[-1]:
+            self._keys.append(key)
+        else:
+            insort(self._keys, key)
+        for term in terms:
+            ids = self._terms.get(term)
+            if ids is None:
+                ids = self._terms[term] = set()
+                insort(self._term_list, term)
+            ids.add(bill_id)
+
+    def _remove(self, bill_id):
+        key, _, terms = self._entries.pop(bill_id)
+        position = bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position] == key:
+            del self._keys[position]
+        for term in terms:
+            self._terms[term].discard(bill_id)
+
+    def _matching(self, customer):
+        """Ids whose name words or phone start with every word of ``customer``."""
+        matched = None
+        for word in query_terms(customer):
+            ids = set()
+            position = bisect_left(self._term_list, word)
+            while position < len(self._term_list) and self._term_list[position].startswith(word):
+                ids |= self._terms[self._term_list[position]]
+                position += 1
+            matched = ids if matched is None else matched & ids
+        return matched
+
+    def _month(self, month):
+        index = self._sealed.get(month)
+        if index is None:
+            index = self._sealed[month] = HistoryIndex()
+            for bill in self._archive.iter_month(month):
+                index.add(bill)
+            while len(self._sealed) > self.max_months:
+                self._sealed.popitem(last=False)
+        else:
+            self._sealed.move_to_end(month)
+        return index
+
+    def _candidates(self, lower, upper, customer, min_total, max_total):
+        """Keys in ``[lower, upper)`` passing the filters, newest first."""
+        def in_range(key):
+            return lower <= key and (upper is None or key < upper)
+
+        if customer:
+            matched = self._matching(customer) or ()
+            candidates = sorted(
+                (key for key in (self._entries[bill_id][0] for bill_id in matched) if in_range(key)),
+                reverse=True)
+        else:
+            stop = bisect_left(self._keys, lower)
+            start = len(self._keys) if upper is None else bisect_left(self._keys, upper)
+            candidates = (self._keys[i] for i in range(start - 1, stop - 1, -1))
+        for key in candidates:
+            total = self._entries[key[1]][1]
+            if (min_total is None or total >= min_total) and (max_total is None or total <= max_total):
+                yield key
+
+    def _sealed_candidates(self, months, *filters):
+        lower, upper = filters[:2]
+        for month in reversed(months):
+            if month == UNDATED or upper is not None and month > upper[0][:7]:
+                continue
+            if month < lower[0][:7]:
+                break
+            yield from self._month(month)._candidates(*filters)
+
+    def _archived(self, *filters):
+        """Candidates from sealed months that the hot bills don't shadow.
+
+        A month's keys all start with the month, so months are read newest
+        first one after another; undated bills can sort anywhere and are
+        merged in.
+        """
+        months = self._archive.months()
+        sources = [self._sealed_candidates(months, *filters)]
+        if UNDATED in months:
+            sources.append(self._month(UNDATED)._candidates(*filters))
+        for key in heapq.merge(*sources, reverse=True):
+            if key[1] not in self._entries:
+                yield key
+
+    def page(self, cursor=None, limit=DEFAULT_PAGE_SIZE, customer=None, date_from=None,
+             date_to=None, min_total=None, max_total=None, keys=False):
+        """Return ``(bill_ids, next_cursor)`` for one page, newest first.
+
+        ``date_from``/``date_to`` are inclusive ISO dates; ``next_cursor`` is
+        None on the last page. With ``keys`` the page holds the bills' sort
+        keys instead of their ids.
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        lower = (date_from or '',)
+        upper = (date_to + '\uffff',) if date_to else None
+        if cursor:
+            after = decode_cursor(cursor)
+            upper = after if upper is None or after < upper else upper
+        filters = (lower, upper, customer if customer and customer.strip() else None, min_total, max_total)
+        candidates = self._candidates(*filters)
+        if self._archive is not None and self._archive.months():
+            candidates = heapq.merge(candidates, self._archived(*filters), reverse=True)
+
+        found = []
+        for key in candidates:
+            if len(found) == limit:
+                return (found if keys else [k[1] for k in found]), encode_cursor(found[-1])
+            found.append(key)
+        return (found if keys else [k[1] for k in found]), None
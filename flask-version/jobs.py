@@ -0,0 +1,290 @@
+"""Background jobs persisted on the local disk.
+
+Jobs live in a SQLite database next to the bills, so they survive a
+restart and every gunicorn worker on the machine shares one queue with no
+broker. Each process runs a fixed number of worker threads that claim
+queued jobs in a transaction. A claim is a lease: a job whose worker died
+is queued again once its lease runs out, so handlers must not mind
+running twice. A handler that raises is retried with exponential backoff
+until it has had ``max_attempts`` tries, and is then marked failed.
+Jobs may be queued in lanes (one per business, say): a free worker takes
+the oldest job of the lane with the fewest jobs running, so a lane with a
+long backlog does not hold up the others.
+Handlers run in the worker threads; CPU-heavy ones should hand the work
+to a process pool. On Linux the worker threads lower their own priority
+by ``nice``, so queued work yields the CPU to requests being served.
+"""
+from datetime import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+from sqlite_store import _transaction
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    lane TEXT NOT NULL DEFAULT '',
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after REAL NOT NULL,
+    lease_until REAL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state, run_after);
+"""
+
+LANE_INDEX = 'CREATE INDEX IF NOT EXISTS jobs_lane ON jobs(lane, state, run_after)'
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+STATES = (QUEUED, RUNNING, DONE, FAILED)
+
+log = logging.getLogger(__name__)
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
+
+
+class JobQueue:
+    def __init__(self, path, workers=2, max_attempts=5, backoff=2.0, lease=300.0,
+                 keep=86400.0, poll=1.0, nice=10):
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        # Seconds before the first retry; doubled for every later one.
+        self.backoff = backoff
+        # Longest a job may run before another worker takes it over.
+        self.lease = lease
+        # How long finished jobs stay around for /api/jobs/<id>.
+        self.keep = keep
+        self.poll = poll
+        self.nice = nice
+        self.enqueued = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self._handlers = {}
+        self._local = threading.local()
+        self._start_lock = threading.Lock()
+        self._wake = threading.Condition()
+        self._pid = None
+        self._stopping = False
+        self._threads = []
+        self._pruned = 0.0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        if 'lane' not in [row[1] for row in conn.execute('PRAGMA table_info(jobs)')]:
+            conn.execute("ALTER TABLE jobs ADD COLUMN lane TEXT NOT NULL DEFAULT ''")
+        conn.execute(LANE_INDEX)
+
+    def _conn(self):
+        # A connection must not cross a fork, so it is kept per thread and pid.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def handler(self, kind):
+        """Decorator registering the function that runs jobs of ``kind``.
+
+        It is called with the job's payload; its return value, which must
+        be JSON-serialisable, becomes the job's result.
+        """
+        def register(fn):
+            self._handlers[kind] = fn
+            return fn
+        return register
+
+    # -- producers -----------------------------------------------------
+
+    def enqueue(self, kind, payload=None, delay=0, lane=''):
+        """Queue one job; return its id."""
+        return self.enqueue_many([(kind, payload)], delay=delay, lane=lane)[0]
+
+    def enqueue_many(self, jobs, delay=0, lane=''):
+        """Queue ``(kind, payload)`` pairs in one transaction; return their ids."""
+        now = time.time()
+        rows = []
+        for kind, payload in jobs:
+            if kind not in self._handlers:
+                raise KeyError('no handler for job kind %r' % kind)
+            rows.append((uuid.uuid4().hex, kind, lane, json.dumps(payload), QUEUED, self.max_attempts,
+                         now + delay, now, now))
+        if not rows:
+            return []
+        conn = self._conn()
+        with _transaction(conn):
+            conn.executemany('INSERT INTO jobs (id, kind, lane, payload, state, max_attempts, run_after, '
+                             'created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self.enqueued += len(rows)
+        self.start()
+        with self._wake:
+            self._wake.notify(len(rows))
+        return [row[0] for row in rows]
+
+    def get(self, job_id):
+        """Return the job as a dict, or None."""
+        row = self._conn().execute(
+            'SELECT id, kind, lane, payload, state, attempts, max_attempts, run_after, created, updated, '
+            'result, error FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        (job_id, kind, lane, payload, state, attempts, max_attempts, run_after, created, updated, result,
+         error) = row
+        return {
+            'id': job_id,
+            'kind': kind,
+            'lane': lane,
+            'payload': json.loads(payload),
+            'state': state,
+            'attempts': attempts,
+            'maxAttempts': max_attempts,
+            'runAfter': _iso(run_after) if state == QUEUED else None,
+            'createdAt': _iso(created),
+            'updatedAt': _iso(updated),
+            'result': json.loads(result) if result is not None else None,
+            'error': error,
+        }
+
+    def counts(self):
+        """Number of jobs in each state."""
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(self._conn().execute('SELECT state, COUNT(*) FROM jobs GROUP BY state'))
+        return counts
+
+    # -- workers -------------------------------------------------------
+
+    def start(self):
+        """Start this process's worker threads, once per process."""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # Threads and conditions don't survive a fork; start afresh.
+            self._wake = threading.Condition()
+            self._stopping = False
+            self._threads = [threading.Thread(target=self._run, name='job-worker-%d' % index, daemon=True)
+                             for index in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def stop(self, timeout=None):
+        """Let running jobs finish and stop the worker threads."""
+        self._stopping = True
+        with self._wake:
+            self._wake.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._pid = None
+
+    def _run(self):
+        if self.nice and hasattr(os, 'setpriority') and hasattr(threading, 'get_native_id'):
+            try:
+                tid = threading.get_native_id()
+                os.setpriority(os.PRIO_PROCESS, tid, os.getpriority(os.PRIO_PROCESS, tid) + self.nice)
+            except OSError:
+                pass
+        while not self._stopping:
+            try:
+                job, next_at = self._claim()
+            except sqlite3.Error:
+                log.exception('could not claim a job')
+                job, next_at = None, None
+            if job is None:
+                if time.time() - self._pruned > 3600:
+                    self.prune()
+                wait = self.poll if next_at is None else min(self.poll, max(0.0, next_at - time.time()))
+                with self._wake:
+                    if not self._stopping:
+                        self._wake.wait(wait)
+                continue
+            self._execute(*job)
+
+    def _claim(self):
+        now = time.time()
+        conn = self._conn()
+        with _transaction(conn):
+            # Jobs whose worker went away: retry them or give up on them.
+            conn.execute('UPDATE jobs SET state = ?, error = ?, updated = ? WHERE state = ? '
+                         'AND lease_until < ? AND attempts >= max_attempts',
+                         (FAILED, 'worker lost', now, RUNNING, now))
+            conn.execute('UPDATE jobs SET state = ?, updated = ? WHERE state = ? AND lease_until < ?',
+                         (QUEUED, now, RUNNING, now))
+            lane = conn.execute('SELECT lane FROM jobs WHERE state = ? AND run_after <= ? GROUP BY lane '
+                                'ORDER BY (SELECT COUNT(*) FROM jobs AS running WHERE running.lane = jobs.lane '
+                                'AND running.state = ?), MIN(run_after) LIMIT 1',
+                                (QUEUED, now, RUNNING)).fetchone()
+            if lane is None:
+                next_at = conn.execute('SELECT MIN(run_after) FROM jobs WHERE state = ?', (QUEUED,)).fetchone()[0]
+                return None, next_at
+            row = conn.execute('SELECT id, kind, payload, attempts, max_attempts FROM jobs '
+                               'WHERE lane = ? AND state = ? AND run_after <= ? ORDER BY run_after LIMIT 1',
+                               (lane[0], QUEUED, now)).fetchone()
+            conn.execute('UPDATE jobs SET state = ?, attempts = attempts + 1, lease_until = ?, updated = ? '
+                         'WHERE id = ?', (RUNNING, now + self.lease, now, row[0]))
+        return row, None
+
+    def _execute(self, job_id, kind, payload, attempts, max_attempts):
+        attempts += 1
+        try:
+            handler = self._handlers.get(kind)
+            if handler is None:
+                raise KeyError('no handler for job kind %r' % kind)
+            result = json.dumps(handler(json.loads(payload)))
+        except Exception as exc:
+            error = ''.join(traceback.format_exception_only(type(exc), exc)).strip()
+            now = time.time()
+            if attempts < max_attempts:
+                state, run_after = QUEUED, now + self.backoff * 2 ** (attempts - 1)
+                self.retried += 1
+            else:
+                state, run_after = FAILED, now
+                self.failed += 1
+                log.error('job %s (%s) failed after %d attempts: %s', job_id, kind, attempts, error)
+            self._finish(job_id, state, None, error, run_after)
+        else:
+            self.completed += 1
+            self._finish(job_id, DONE, result, None, time.time())
+
+    def _finish(self, job_id, state, result, error, run_after):
+        conn = self._conn()
+        try:
+            with _transaction(conn):
+                conn.execute('UPDATE jobs SET state = ?, result = ?, error = ?, run_after = ?, '
+                             'lease_until = NULL, updated = ? WHERE id = ?',
+                             (state, result, error, run_after, time.time(), job_id))
+        except sqlite3.Error:
+            # The lease runs out and the job is run again.
+            log.exception('could not record the outcome of job %s', job_id)
+
+    def prune(self):
+        """Forget finished jobs older than ``keep`` seconds."""
+        self._pruned = time.time()
+        conn = self._conn()
+        try:
+            with _transaction(conn):
+                conn.execute('DELETE FROM jobs WHERE state IN (?, ?) AND updated < ?',
+                             (DONE, FAILED, time.time() - self.keep))
+        except sqlite3.Error:
+            log.exception('could not prune finished jobs')
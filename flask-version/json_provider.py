@@ -0,0 +1,45 @@
+"""Flask JSON provider that encodes with orjson when it is installed.
+
+Responses come out as Flask's own provider would write them (compact, keys
+sorted, dates as HTTP dates, non-ASCII escaped) but several times faster.
+Pretty-printed output in debug mode, objects orjson cannot encode, and
+output with non-ASCII characters while ``ensure_ascii`` is set go through
+the stdlib json module as before.
+
+One difference remains: NaN and Infinity are written as ``null``, where
+the stdlib writes ``NaN`` and ``Infinity``, which are not JSON and which
+browsers' ``JSON.parse`` rejects.
+"""
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+_COMPACT = (',', ':')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        # Responses ask for compact separators, which is all orjson writes;
+        # anything else (tojson, debug mode) keeps the stdlib's layout.
+        if orjson is None or kwargs != {'separators': _COMPACT}:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_PASSTHROUGH_DATETIME | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+        try:
+            payload = orjson.dumps(obj, default=self.default, option=option)
+        except TypeError:  # integers over 64 bits, keys that are not strings
+            return super().dumps(obj, **kwargs)
+        # orjson writes UTF-8; leave escaping to the stdlib.
+        if self.ensure_ascii and not payload.isascii():
+            return super().dumps(obj, **kwargs)
+        return payload.decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        try:
+            return orjson.loads(s)
+        except ValueError:  # NaN and Infinity, or not JSON at all
+            return super().loads(s)
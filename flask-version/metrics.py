@@ -0,0 +1,122 @@
+"""Prometheus text-format metrics.
+
+Histograms are updated on the request path and cost a bisect and a lock
+per observation. Everything else is read at scrape time from collector
+functions, so counters that the store, cache and upload store already
+keep as plain attributes don't add any work while serving.
+"""
+import bisect
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = ['%s="%s"' % (name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        with self._lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        for values, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    self.name, _labels(self.labels, values, 'le="%s"' % _number(bound)), cumulative))
+            lines.append('%s_sum%s %s' % (self.name, _labels(self.labels, values), _number(total)))
+            lines.append('%s_count%s %d' % (self.name, _labels(self.labels, values), cumulative))
+        return lines
+
+
+class Collector:
+    """A counter or gauge whose value is read from ``fn`` at scrape time.
+
+    ``fn`` returns a number, or a list of ``(label_values, number)``; a
+    None value leaves the sample out.
+    """
+
+    def __init__(self, name, kind, help, fn, labels=()):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.fn = fn
+        self.labels = tuple(labels)
+
+    def render(self):
+        value = self.fn()
+        samples = value if isinstance(value, list) else [((), value)]
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.kind)]
+        for values, number in samples:
+            if number is not None:
+                lines.append('%s%s %s' % (self.name, _labels(self.labels, values), _number(number)))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, fn, labels=()):
+        self._metrics.append(Collector(name, 'counter', help, fn, labels))
+
+    def gauge(self, name, help, fn, labels=()):
+        self._metrics.append(Collector(name, 'gauge', help, fn, labels))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def process_io():
+    """Bytes this process has read and written, from /proc/self/io.
+
+    ``rchar``/``wchar`` count every read and write call, sockets included;
+    ``read_bytes``/``write_bytes`` only what reached the storage layer.
+    Empty where /proc isn't available.
+    """
+    try:
+        with open('/proc/self/io') as f:
+            return {key: int(value) for key, value in (line.split(': ') for line in f)}
+    except (OSError, ValueError):
+        return {}
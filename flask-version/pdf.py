@@ -0,0 +1,446 @@
+"""Pure-Python invoice PDF renderer.
+
+Produces a single- or multi-page A4 invoice using the PDF base-14 Helvetica
+fonts, so no font files or native libraries are needed. Those fonts only
+have glyphs for WinAnsi (Western European) text; an invoice with other
+text, such as a name in Devanagari or Tamil, raises UnsupportedText rather
+than coming out with question marks in its place. JPEG logos and
+signatures are embedded as-is and 8-bit PNGs are decoded here; other image
+formats are converted with Pillow when it is installed and skipped
+otherwise.
+"""
+import io
+import struct
+import zlib
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional
+    Image = None
+
+RENDERER_VERSION = 2
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+MARGIN = 50
+BOTTOM = 150
+
+_HELVETICA = (
+    '278 278 355 556 556 889 667 191 333 333 389 584 278 333 278 278 556 556 556 556 556 556 '
+    '556 556 556 556 278 278 584 584 584 556 1015 667 667 722 722 667 611 778 722 278 500 667 '
+    '556 833 722 778 667 778 722 667 611 722 667 944 667 667 611 278 278 278 469 556 333 556 '
+    '556 500 556 556 278 556 556 222 222 500 222 833 556 556 556 556 333 500 278 556 500 722 '
+    '500 500 500 334 260 334 584')
+_HELVETICA_BOLD = (
+    '278 333 474 556 556 889 722 238 333 333 389 584 278 333 278 278 556 556 556 556 556 556 '
+    '556 556 556 556 333 333 584 584 584 611 975 722 722 722 722 667 611 778 722 278 556 722 '
+    '611 833 722 778 667 778 722 667 611 722 667 944 667 667 611 333 278 333 584 556 333 556 '
+    '611 556 611 556 333 611 611 278 278 556 278 889 611 611 611 611 389 556 333 611 556 778 '
+    '556 556 500 389 280 389 584')
+WIDTHS = {
+    'F1': [int(w) for w in _HELVETICA.split()],
+    'F2': [int(w) for w in _HELVETICA_BOLD.split()],
+}
+
+
+def text_width(text, font, size):
+    widths = WIDTHS[font]
+    total = 0
+    for ch in text:
+        code = ord(ch)
+        total += widths[code - 32] if 32 <= code < 127 else 556
+    return total * size / 1000
+
+
+class UnsupportedText(ValueError):
+    """Text the invoice fonts have no glyphs for."""
+
+
+def _escape(text):
+    text = str(text)
+    try:
+        # The fonts use WinAnsiEncoding, which is Windows code page 1252.
+        data = text.encode('cp1252')
+    except UnicodeEncodeError as exc:
+        raise UnsupportedText('the invoice fonts cannot show %r in %r' % (exc.object[exc.start:exc.end], text))
+    return data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def _fit(text, font, size, width):
+    text = str(text if text is not None else '')
+    if text_width(text, font, size) <= width:
+        return text
+    while text and text_width(text + '...', font, size) > width:
+        text = text[:-1]
+    return text + '...'
+
+
+def _number(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _money(value):
+    return 'Rs. %.2f' % _number(value)
+
+
+# -- images ----------------------------------------------------------------
+
+def _jpeg(data):
+    position = 2
+    while position + 9 < len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        length = struct.unpack('>H', data[position + 2:position + 4])[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack('>HH', data[position + 5:position + 9])
+            components = data[position + 9]
+            space = {1: '/DeviceGray', 3: '/DeviceRGB', 4: '/DeviceCMYK'}.get(components)
+            if space is None:
+                return None
+            return {'width': width, 'height': height, 'space': space,
+                    'filter': '/DCTDecode', 'parms': None, 'data': data, 'alpha': None}
+        position += 2 + length
+    return None
+
+
+def _paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    return b if pb <= pc else c
+
+
+def _unfilter(raw, width, height, channels):
+    stride = width * channels
+    out = bytearray()
+    previous = bytearray(stride)
+    position = 0
+    for _ in range(height):
+        kind = raw[position]
+        row = bytearray(raw[position + 1:position + 1 + stride])
+        position += 1 + stride
+        if kind == 2:
+            row = bytearray((a + b) & 0xFF for a, b in zip(row, previous))
+        elif kind:
+            for i in range(stride):
+                left = row[i - channels] if i >= channels else 0
+                up = previous[i]
+                if kind == 1:
+                    row[i] = (row[i] + left) & 0xFF
+                elif kind == 3:
+                    row[i] = (row[i] + ((left + up) >> 1)) & 0xFF
+                elif kind == 4:
+                    upper_left = previous[i - channels] if i >= channels else 0
+                    row[i] = (row[i] + _paeth(left, up, upper_left)) & 0xFF
+        out += row
+        previous = row
+    return bytes(out)
+
+
+def _raw_image(width, height, color, channels, alpha=None):
+    return {'width': width, 'height': height,
+            'space': '/DeviceGray' if channels == 1 else '/DeviceRGB',
+            'filter': '/FlateDecode', 'parms': None, 'data': zlib.compress(color),
+            'alpha': zlib.compress(alpha) if alpha is not None else None}
+
+
+def _png_chunks(data):
+    position = 8
+    header = palette = transparency = None
+    idat = bytearray()
+    while position + 8 <= len(data):
+        length, kind = struct.unpack('>I4s', data[position:position + 8])
+        chunk = data[position + 8:position + 8 + length]
+        position += 12 + length
+        if kind == b'IHDR':
+            header = struct.unpack('>IIBBBBB', chunk)
+        elif kind == b'PLTE':
+            palette = chunk
+        elif kind == b'tRNS':
+            transparency = chunk
+        elif kind == b'IDAT':
+            idat += chunk
+        elif kind == b'IEND':
+            break
+    return header, palette, transparency, bytes(idat)
+
+
+def png_pixels(data):
+    """Decode an 8-bit, non-interlaced PNG.
+
+    Returns ``(width, height, channels, pixels)`` with palette images
+    expanded to RGB, or RGBA when they have transparency; None for any other
+    kind of PNG.
+    """
+    header, palette, transparency, idat = _png_chunks(data)
+    if header is None:
+        return None
+    width, height, depth, color_type, _, _, interlace = header
+    channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}.get(color_type)
+    if depth != 8 or interlace or channels is None:
+        return None
+    pixels = _unfilter(zlib.decompress(idat), width, height, channels)
+    if color_type == 3:
+        if palette is None:
+            return None
+        alphas = transparency or b''
+        entries = []
+        for index in range(256):
+            entry = palette[index * 3:index * 3 + 3].ljust(3, b'\0')
+            if transparency:
+                entry += bytes([alphas[index] if index < len(alphas) else 255])
+            entries.append(entry)
+        return width, height, 4 if transparency else 3, b''.join(map(entries.__getitem__, pixels))
+    return width, height, channels, pixels
+
+
+def _png(data):
+    header, _, transparency, idat = _png_chunks(data)
+    if header is None:
+        return None
+    width, height, depth, color_type, _, _, interlace = header
+    if depth == 8 and not interlace and color_type in (0, 2) and transparency is None:
+        # PDF reads these IDAT streams as-is through the PNG predictor.
+        channels = 1 if color_type == 0 else 3
+        return {'width': width, 'height': height,
+                'space': '/DeviceGray' if channels == 1 else '/DeviceRGB',
+                'filter': '/FlateDecode', 'data': idat, 'alpha': None,
+                'parms': '<< /Predictor 15 /Colors %d /BitsPerComponent 8 /Columns %d >>' % (channels, width)}
+    decoded = png_pixels(data)
+    if decoded is None:
+        return None
+    width, height, channels, pixels = decoded
+    if channels in (2, 4):
+        color_channels = channels - 1
+        color = bytearray(len(pixels) // channels * color_channels)
+        for channel in range(color_channels):
+            color[channel::color_channels] = pixels[channel::channels]
+        return _raw_image(width, height, bytes(color), color_channels, pixels[color_channels::channels])
+    return _raw_image(width, height, pixels, channels)
+
+
+def _pillow(data):
+    if Image is None:
+        return None
+    try:
+        image = Image.open(io.BytesIO(data)).convert('RGBA')
+    except Exception:
+        return None
+    return _raw_image(image.width, image.height, image.convert('RGB').tobytes(), 3,
+                      image.getchannel('A').tobytes())
+
+
+def decode_image(data):
+    """Return an embeddable image description for ``data`` or None."""
+    if not data:
+        return None
+    try:
+        if data.startswith(b'\xff\xd8'):
+            image = _jpeg(data)
+        elif data.startswith(b'\x89PNG\r\n\x1a\n'):
+            image = _png(data)
+        else:
+            image = None
+    except (struct.error, zlib.error, IndexError):
+        image = None
+    return image or _pillow(data)
+
+
+# -- document --------------------------------------------------------------
+
+class _Document:
+    def __init__(self):
+        self.objects = []
+
+    def reserve(self):
+        self.objects.append(None)
+        return len(self.objects)
+
+    def set(self, number, body):
+        self.objects[number - 1] = body
+
+    def add(self, body):
+        number = self.reserve()
+        self.set(number, body)
+        return number
+
+    def stream(self, data, entries=''):
+        return self.add(b'<< %s /Length %d >>\nstream\n' % (entries.encode('ascii'), len(data))
+                        + data + b'\nendstream')
+
+    def image(self, image):
+        smask = ''
+        if image['alpha'] is not None:
+            number = self.stream(image['alpha'], '/Type /XObject /Subtype /Image /Width %d /Height %d '
+                                 '/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode'
+                                 % (image['width'], image['height']))
+            smask = ' /SMask %d 0 R' % number
+        parms = ' /DecodeParms %s' % image['parms'] if image['parms'] else ''
+        return self.stream(image['data'], '/Type /XObject /Subtype /Image /Width %d /Height %d '
+                           '/ColorSpace %s /BitsPerComponent 8 /Filter %s%s%s'
+                           % (image['width'], image['height'], image['space'], image['filter'],
+                              parms, smask))
+
+    def render(self):
+        out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for number, body in enumerate(self.objects, 1):
+            offsets.append(len(out))
+            out += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+        xref = len(out)
+        out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(self.objects) + 1)
+        for offset in offsets:
+            out += b'%010d 00000 n \n' % offset
+        out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+            len(self.objects) + 1, xref)
+        return bytes(out)
+
+
+class _Page:
+    def __init__(self):
+        self.ops = []
+
+    def text(self, x, y, text, font='F1', size=10, align='left', color=None):
+        text = str(text if text is not None else '')
+        if align == 'right':
+            x -= text_width(text, font, size)
+        elif align == 'center':
+            x -= text_width(text, font, size) / 2
+        fill = '%.3f %.3f %.3f rg ' % color if color else ''
+        self.ops.append(b'BT %s/%s %g Tf %.2f %.2f Td (%s) Tj ET 0 g'
+                        % (fill.encode('ascii'), font.encode('ascii'), size, x, y, _escape(text)))
+
+    def line(self, x1, y1, x2, y2, gray=0.85):
+        self.ops.append(b'%.2f G 0.75 w %.2f %.2f m %.2f %.2f l S 0 G' % (gray, x1, y1, x2, y2))
+
+    def image(self, name, x, y, width, height):
+        self.ops.append(b'q %.2f 0 0 %.2f %.2f %.2f cm /%s Do Q'
+                        % (width, height, x, y, name.encode('ascii')))
+
+    def content(self):
+        return b'\n'.join(self.ops)
+
+
+def _scaled(image, max_width, max_height):
+    scale = min(max_width / image['width'], max_height / image['height'], 1.0)
+    return image['width'] * scale, image['height'] * scale
+
+
+def render_invoice(bill, business, logo=None, signature=None):
+    """Render ``bill`` for ``business`` and return the PDF bytes.
+
+    ``logo`` and ``signature`` are raw image file contents.
+    """
+    doc = _Document()
+    catalog = doc.reserve()
+    pages_ref = doc.reserve()
+    fonts = {'F1': doc.add(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+                           b'/Encoding /WinAnsiEncoding >>'),
+             'F2': doc.add(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold '
+                           b'/Encoding /WinAnsiEncoding >>')}
+    images = {}
+    for name, data in (('Logo', logo), ('Sig', signature)):
+        image = decode_image(data)
+        if image:
+            images[name] = (doc.image(image), image)
+
+    right = PAGE_WIDTH - MARGIN
+    accent = (0.85, 0.47, 0.02)
+    pages = []
+
+    def new_page():
+        page = _Page()
+        pages.append(page)
+        y = PAGE_HEIGHT - MARGIN
+        x = MARGIN
+        if 'Logo' in images:
+            width, height = _scaled(images['Logo'][1], 60, 60)
+            page.image('Logo', x, y - height, width, height)
+            x += 72
+        page.text(x, y - 16, business.get('shopName') or '', 'F2', 16)
+        line_y = y - 30
+        for detail in (business.get('shopAddress'), business.get('phone'), business.get('email')):
+            if detail:
+                page.text(x, line_y, _fit(detail, 'F1', 9, right - x - 170), size=9)
+                line_y -= 12
+        if business.get('gstin'):
+            page.text(x, line_y, 'GSTIN: %s' % business['gstin'], 'F2', 9)
+        page.text(right, y - 18, 'INVOICE', 'F2', 20, 'right', accent)
+        page.text(right, y - 36, 'Bill No: %s' % (bill.get('billNumber') or ''), size=10, align='right')
+        page.text(right, y - 50, 'Date: %s' % (bill.get('billDate') or bill.get('createdAt') or '')[:10],
+                  size=10, align='right')
+        page.line(MARGIN, y - 80, right, y - 80)
+        return page, y - 100
+
+    columns = ((MARGIN, 'Description', 'left'), (right - 200, 'Qty', 'right'),
+               (right - 100, 'Price', 'right'), (right, 'Total', 'right'))
+
+    def table_header(page, y):
+        for x, title, align in columns:
+            page.text(x, y, title, 'F2', 10, align)
+        page.line(MARGIN, y - 6, right, y - 6)
+        return y - 22
+
+    page, y = new_page()
+    page.text(MARGIN, y, 'Bill To', 'F2', 11)
+    page.text(MARGIN, y - 15, bill.get('customerName') or '', size=10)
+    if bill.get('customerPhone'):
+        page.text(MARGIN, y - 28, bill['customerPhone'], size=10)
+    y = table_header(page, y - 55)
+
+    subtotal = 0.0
+    for item in bill.get('items') or []:
+        if y < BOTTOM:
+            page, y = new_page()
+            y = table_header(page, y)
+        quantity = _number(item.get('quantity'))
+        price = _number(item.get('price'))
+        subtotal += quantity * price
+        page.text(MARGIN, y, _fit(item.get('description'), 'F1', 10, right - 230 - MARGIN))
+        page.text(right - 200, y, '%g' % quantity, align='right')
+        page.text(right - 100, y, _money(price), align='right')
+        page.text(right, y, _money(quantity * price), align='right')
+        y -= 18
+
+    if y < BOTTOM:
+        page, y = new_page()
+    page.line(MARGIN, y + 6, right, y + 6)
+    y -= 12
+    subtotal = _number(bill.get('subtotal', subtotal))
+    tax_rate = _number(bill.get('taxRate'))
+    rows = [('Subtotal', _money(subtotal))]
+    if tax_rate:
+        rows.append(('Tax (%g%%)' % tax_rate, _money(subtotal * tax_rate / 100)))
+    if _number(bill.get('discount')):
+        rows.append(('Discount', '- ' + _money(bill['discount'])))
+    for label, value in rows:
+        page.text(right - 150, y, label, align='left')
+        page.text(right, y, value, align='right')
+        y -= 16
+    page.text(right - 150, y - 4, 'Grand Total', 'F2', 12)
+    page.text(right, y - 4, _money(bill.get('grandTotal')), 'F2', 12, 'right', accent)
+
+    if 'Sig' in images:
+        width, height = _scaled(images['Sig'][1], 140, 50)
+        page.image('Sig', right - width, 70, width, height)
+    page.line(right - 140, 64, right, 64)
+    page.text(right, 52, 'Authorised Signatory', size=9, align='right')
+
+    xobjects = ' '.join('/%s %d 0 R' % (name, ref) for name, (ref, _) in images.items())
+    resources = '<< /Font << /F1 %d 0 R /F2 %d 0 R >> /XObject << %s >> >>' % (
+        fonts['F1'], fonts['F2'], xobjects)
+    kids = []
+    for number, page in enumerate(pages, 1):
+        page.text(PAGE_WIDTH / 2, 30, 'Page %d of %d' % (number, len(pages)), size=8, align='center')
+        content = doc.stream(zlib.compress(page.content()), '/Filter /FlateDecode')
+        kids.append(doc.add(('<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] /Resources %s '
+                             '/Contents %d 0 R >>' % (pages_ref, PAGE_WIDTH, PAGE_HEIGHT, resources,
+                                                      content)).encode('ascii')))
+    doc.set(pages_ref, ('<< /Type /Pages /Kids [%s] /Count %d >>' % (
+        ' '.join('%d 0 R' % kid for kid in kids), len(kids))).encode('ascii'))
+    doc.set(catalog, ('<< /Type /Catalog /Pages %d 0 R >>' % pages_ref).encode('ascii'))
+    return doc.render()
@@ -0,0 +1,175 @@
+"""Record format shared by the hot bill log and sealed segments.
+
+A record is one line: the CRC-32 of the payload in hex, one byte naming the
+codec the payload was written with, the payload and a newline. Records of
+every codec can be read back whichever one the store writes, so a log may
+mix them and changing codecs needs no migration.
+
+``json`` payloads are the bill as compact JSON, through orjson when it is
+installed, which makes them the quickest to write and read. ``packed``
+payloads are a JSON array ``[version, values, items, extra]``: the bill's
+known fields in a fixed order without their keys, each item the same way,
+and a dict of the fields the layout does not know about. They are about
+40% smaller than ``json`` ones but take about twice as long to read, and
+are still plain JSON, so nothing but a documented, stable encoding reaches
+the disk. Releases that predate a codec
+or a layout version cannot read its records, and take them for a torn tail
+of the log.
+
+``Bill`` keeps the same layout in memory, as tuples.
+"""
+import hashlib
+from itertools import zip_longest
+import json
+import operator
+import uuid
+import zlib
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+BILL_FIELDS = ('id', 'billNumber', 'customerName', 'customerPhone', 'billDate', 'createdAt',
+               'subtotal', 'taxRate', 'taxAmount', 'discount', 'grandTotal', 'signature')
+ITEM_FIELDS = ('description', 'quantity', 'price', 'total')
+# Version of the packed layout; bump it when BILL_FIELDS or ITEM_FIELDS change.
+PACKED_VERSION = 1
+
+
+def id_key(bill_id):
+    try:
+        return uuid.UUID(str(bill_id)).bytes
+    except ValueError:
+        return hashlib.md5(str(bill_id).encode('utf-8')).digest()
+
+
+def _split(record, fields, skip=None):
+    """``record``'s values of ``fields`` and a dict of the other keys (but ``skip``), or None.
+
+    Absent fields are None, and trailing ones are left off. A field that is
+    present but None goes in the dict.
+    """
+    values = tuple(map(record.get, fields))
+    extra = None
+    if len(record) - (skip in record) > len(fields) - values.count(None):
+        extra = {key: value for key, value in record.items()
+                 if key != skip and (key not in fields or value is None)}
+    while values and values[-1] is None:
+        values = values[:-1]
+    return values, extra
+
+
+def _join(fields, values, extra):
+    record = dict(zip(fields, values))
+    if None in values:
+        for field, value in zip(fields, values):
+            if value is None:
+                del record[field]
+    if extra:
+        record.update(extra)
+    return record
+
+
+def pack_bill(bill):
+    """``bill`` as ``(BILL_FIELDS values, items as (values, extra) pairs, extra)``."""
+    items = bill.get('items')
+    if isinstance(items, list) and all(type(item) is dict for item in items):
+        values, extra = _split(bill, BILL_FIELDS, 'items')
+        return values, tuple([_split(item, ITEM_FIELDS) for item in items]), extra
+    # Odd shapes of items are kept as they are, with the other keys.
+    values, extra = _split(bill, BILL_FIELDS)
+    return values, None, extra
+
+
+def unpack_bill(packed):
+    """The bill dict of ``pack_bill()``'s tuple."""
+    values, items, extra = packed
+    bill = _join(BILL_FIELDS, values, extra)
+    if items is not None:
+        bill['items'] = [dict(zip(ITEM_FIELDS, item)) if more is None and None not in item
+                         else _join(ITEM_FIELDS, item, more) for item, more in items]
+    return bill
+
+
+class JSONCodec:
+    name = 'json'
+    tag = b' '
+
+    def encode(self, bill):
+        if orjson is not None:
+            try:
+                payload = orjson.dumps(bill)
+            except TypeError:  # integers over 64 bits, keys that are not strings
+                payload = b'null'
+            # orjson writes NaN and Infinity as null; json keeps them.
+            if b'null' not in payload:
+                return payload
+        return json.dumps(bill, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+    def decode(self, payload):
+        if orjson is not None:
+            try:
+                return orjson.loads(payload)
+            except ValueError:  # NaN and Infinity, which json writes
+                pass
+        return json.loads(payload)
+
+
+class PackedCodec(JSONCodec):
+    name = 'packed'
+    tag = b'p'
+
+    def encode(self, bill):
+        return super().encode((PACKED_VERSION,) + pack_bill(bill))
+
+    def decode(self, payload):
+        packed = super().decode(payload)
+        if not isinstance(packed, list) or len(packed) != 4 or packed[0] != PACKED_VERSION:
+            raise ValueError('not a packed bill')
+        return unpack_bill(packed[1:])
+
+
+CODECS = {codec.name: codec for codec in (JSONCodec(), PackedCodec())}
+_BY_TAG = {codec.tag: codec for codec in CODECS.values()}
+
+
+def encode_record(bill, codec='json'):
+    payload = CODECS[codec].encode(bill)
+    return b'%08x' % zlib.crc32(payload) + CODECS[codec].tag + payload + b'\n'
+
+
+def decode_record(line):
+    """Return the bill stored in ``line`` or None if the record is torn."""
+    codec = _BY_TAG.get(line[8:9])
+    if len(line) < 11 or not line.endswith(b'\n') or codec is None:
+        return None
+    payload = line[9:-1]
+    try:
+        if int(line[:8], 16) != zlib.crc32(payload):
+            return None
+        return codec.decode(payload)
+    except (ValueError, TypeError):
+        return None
+
+
+class Bill:
+    """A bill held in memory: its known fields as slots, line items as tuples.
+
+    About half the memory of the bill's dict; ``to_dict()`` gives the dict
+    back.
+    """
+    __slots__ = BILL_FIELDS + ('items', 'extra')
+    _values = operator.attrgetter(*BILL_FIELDS)
+
+    def __init__(self, packed):
+        values, self.items, self.extra = packed
+        for name, value in zip_longest(BILL_FIELDS, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def from_dict(cls, bill):
+        return cls(pack_bill(bill))
+
+    def to_dict(self):
+        return unpack_bill((self._values(self), self.items, self.extra))
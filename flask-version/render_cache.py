@@ -0,0 +1,83 @@
+"""Content-addressed on-disk cache for rendered files.
+
+Entries are named after a SHA-256 of everything that went into producing
+them, so an unchanged bill is never rendered twice and a changed one can
+never be served stale. A hit refreshes the entry's mtime; when the cache
+grows past ``max_bytes`` the least recently used entries are removed.
+"""
+import hashlib
+import json
+import os
+import threading
+
+from writer import atomic_write
+
+
+def content_key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = json.dumps(part, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        digest.update(b'%d:' % len(part))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class RenderCache:
+    def __init__(self, directory, suffix, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._approx_bytes = None
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def get(self, key):
+        """Return the path of a cached entry, or None."""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, data)
+        with self._lock:
+            if self._approx_bytes is None:
+                self._approx_bytes = sum(size for _, size, _ in self._entries())
+            else:
+                self._approx_bytes += len(data)
+            if self._approx_bytes > self.max_bytes:
+                self._evict()
+        return path
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(self.suffix):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield path, st.st_size, st.st_mtime
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._approx_bytes = total
@@ -0,0 +1,358 @@
+"""Month-end reports computed over columns of bills and line items.
+
+ReportColumns subscribes to the store cache and keeps every bill as a row of
+flat columns (day, hour, subtotal, tax, discount and total in paise, tax
+rate, customer) and every line item as a row pointing at its bill (item,
+quantity, amount). Bills of the hot month are appended to ``array`` buffers
+as they arrive. Each sealed month becomes a chunk of NumPy arrays the first
+time a report reaches it. Sealing writes the chunk into a ``reports``
+segment section, so loading it reads no bills. A report concatenates the
+chunks of the months it covers, masks rows outside the date range or
+superseded by a later write, and groups with ``bincount``. A bill whose
+amounts overflow the columns is left out of the reports.
+
+NumPy is optional; without it ``np`` is None and there are no reports.
+"""
+from array import array
+from collections import OrderedDict
+import datetime
+import io
+import json
+
+from history_index import sort_key
+from stats import _paise, customer_key
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+MAX_MONTHS = 24
+DEFAULT_TOP = 20
+# day of an undated bill; hour of a bill without a time.
+NO_DAY = -2 ** 31
+NO_HOUR = -1
+_EPOCH = datetime.date(1970, 1, 1).toordinal()
+
+BILL_COLUMNS = (('day', 'i'), ('hour', 'b'), ('subtotal', 'q'), ('tax', 'q'), ('discount', 'q'),
+                ('total', 'q'), ('rate', 'i'), ('customer', 'i'))
+ITEM_COLUMNS = (('bill', 'i'), ('item', 'i'), ('quantity', 'd'), ('amount', 'q'))
+# Values of the integer columns lie in [-limit, limit).
+_LIMITS = {'b': 2 ** 7, 'i': 2 ** 31, 'q': 2 ** 63}
+
+
+def to_day(date):
+    """Days since 1970-01-01 of a ``YYYY-MM-DD...`` string, or NO_DAY."""
+    try:
+        return datetime.date.fromisoformat(date[:10]).toordinal() - _EPOCH
+    except (TypeError, ValueError):
+        return NO_DAY
+
+
+def from_day(day):
+    return datetime.date.fromordinal(int(day) + _EPOCH).isoformat()
+
+
+def _number(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def bill_rows(bill):
+    """``(bill values, [(description, quantity, amount), ...])`` in column order, less the customer."""
+    created = sort_key(bill)[0]
+    hour = created[11:13]
+    items = []
+    subtotal = 0
+    for item in bill.get('items') or []:
+        if not isinstance(item, dict):
+            continue
+        quantity = _number(item.get('quantity'))
+        total = item.get('total')
+        amount = _paise(total) if total is not None else int(round(quantity * _number(item.get('price')) * 100))
+        subtotal += amount
+        items.append((str(item.get('description') or '').strip(), quantity, amount))
+    if bill.get('subtotal') is not None:
+        subtotal = _paise(bill.get('subtotal'))
+    rate = _number(bill.get('taxRate'))
+    tax = bill.get('taxAmount')
+    tax = _paise(tax) if tax is not None else int(round(subtotal * rate / 100))
+    values = (to_day(created), int(hour) if hour.isdigit() else NO_HOUR, subtotal, tax, _paise(bill.get('discount')),
+              _paise(bill.get('grandTotal')), int(round(rate * 100)))
+    return values, items
+
+
+class _Codes:
+    """Dense integer codes for strings, in order of first appearance."""
+
+    def __init__(self):
+        self.codes = {}
+        self.names = []
+
+    def __call__(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def remap(self, names):
+        """Array turning the codes of another _Codes with ``names`` into ours."""
+        return np.array([self(name) for name in names], dtype=np.int32)
+
+
+def _fits(values, columns):
+    return all(kind not in _LIMITS or -_LIMITS[kind] <= value < _LIMITS[kind]
+               for value, (_, kind) in zip(values, columns))
+
+
+class _Buffer:
+    """Growing columns of one set of bills and their items."""
+
+    def __init__(self):
+        self.bills = {name: array(kind) for name, kind in BILL_COLUMNS}
+        self.items = {name: array(kind) for name, kind in ITEM_COLUMNS}
+        self.live = array('b')
+        # Bills whose amounts do not fit the columns; they get a dead row.
+        self.unfit = 0
+
+    def __len__(self):
+        return len(self.live)
+
+    def append(self, bill, customers, items, names=None):
+        """Add a row for ``bill`` and return its number.
+
+        Every value is checked before any column grows, so the columns keep
+        the same length; a bill that does not fit gets an empty, dead row.
+        """
+        try:
+            values, lines = bill_rows(bill)
+            fits = _fits(values, BILL_COLUMNS) and all(_fits(line[2:], ITEM_COLUMNS[3:]) for line in lines)
+        except (OverflowError, ValueError):  # infinite or NaN amounts
+            fits = False
+        if not fits:
+            values, lines = (NO_DAY, NO_HOUR, 0, 0, 0, 0, 0), []
+            self.unfit += 1
+        row = len(self.live)
+        for (name, _), value in zip(BILL_COLUMNS, values):
+            self.bills[name].append(value)
+        key = customer_key(bill)
+        self.bills['customer'].append(customers(key))
+        name = (bill.get('customerName') or '').strip()
+        if fits and names is not None and name and values[0] >= names.get(key, (NO_DAY,))[0]:
+            names[key] = (values[0], name)
+        self.live.append(fits)
+        for description, quantity, amount in lines:
+            self.items['bill'].append(row)
+            self.items['item'].append(items(description))
+            self.items['quantity'].append(quantity)
+            self.items['amount'].append(amount)
+        return row
+
+    def freeze(self):
+        """The columns as NumPy arrays (copies; the buffer may keep growing)."""
+        chunk = {name: np.array(column) for name, column in self.bills.items()}
+        chunk.update(('item_' + name, np.array(column)) for name, column in self.items.items())
+        chunk['live'] = np.array(self.live, dtype=bool)
+        return chunk
+
+
+class ReportColumns:
+    def __init__(self, max_months=MAX_MONTHS):
+        self.max_months = max_months
+        self.clear()
+
+    def clear(self):
+        self._customers = _Codes()
+        self._items = _Codes()
+        # customer key -> (day, name) of their latest bill seen.
+        self._names = {}
+        self._hot = _Buffer()
+        self._rows = {}
+        self._archive = None
+        self._sealed = OrderedDict()
+
+    def add_archive(self, archive):
+        self._archive = archive
+
+    def add(self, bill):
+        bill_id = str(bill.get('id', ''))
+        old = self._rows.get(bill_id)
+        if old is not None:
+            self._hot.live[old] = 0
+        self._rows[bill_id] = self._hot.append(bill, self._customers, self._items, self._names)
+
+    def _month(self, month):
+        chunk = self._sealed.get(month)
+        if chunk is not None:
+            self._sealed.move_to_end(month)
+            return chunk
+        segment = self._archive.segment(month)
+        section = segment.section('reports')
+        chunk = self._unpack(section if section is not None else pack_segment(segment.iter_bills()))
+        self._sealed[month] = chunk
+        while len(self._sealed) > self.max_months:
+            self._sealed.popitem(last=False)
+        return chunk
+
+    def _unpack(self, section):
+        # Sections number customers and items on their own; map to our codes.
+        packed = np.load(io.BytesIO(bytes(section)), allow_pickle=False)
+        chunk = {name: packed[name] for name in packed.files if not name.endswith('_names')}
+        customer_keys = packed['customer_names'].tolist()
+        for key, (day, name) in zip(customer_keys, json.loads(str(packed['display_names']))):
+            if name and day >= self._names.get(key, (NO_DAY,))[0]:
+                self._names[key] = (day, name)
+        if customer_keys:
+            chunk['customer'] = self._customers.remap(customer_keys)[chunk['customer']]
+        if len(packed['item_names']):
+            chunk['item_item'] = self._items.remap(packed['item_names'].tolist())[chunk['item_item']]
+        if 'live' not in chunk:
+            chunk['live'] = np.ones(len(chunk['day']), dtype=bool)
+        return chunk
+
+    def snapshot(self, date_from=None, date_to=None):
+        """Chunks covering ``[date_from, date_to]``, consistent as of now.
+
+        Called with the cache lock held; the reports themselves are worked
+        out from the snapshot without it.
+        """
+        chunks = []
+        if self._archive is not None:
+            for month in self._archive.months():
+                if (date_from and month < date_from[:7]) or (date_to and month > date_to[:7]):
+                    continue
+                chunk = dict(self._month(month))
+                dead = self._archive.shadowed_docs(month)
+                if dead:
+                    chunk['live'] = chunk['live'].copy()
+                    chunk['live'][sorted(dead)] = False
+                chunks.append(chunk)
+        chunks.append(self._hot.freeze())
+        names = {key: name for key, (_, name) in self._names.items()}
+        return Snapshot(chunks, list(self._customers.names), names, list(self._items.names), date_from, date_to)
+
+
+class Snapshot:
+    """Bills and items in a date range, concatenated into flat arrays."""
+
+    def __init__(self, chunks, customer_keys, customer_names, item_names, date_from=None, date_to=None):
+        self.customer_keys = customer_keys
+        self.customer_names = customer_names
+        self.item_names = item_names
+        offsets = np.cumsum([0] + [len(chunk['day']) for chunk in chunks])
+        bills = {name: np.concatenate([chunk[name] for chunk in chunks])
+                 for name, _ in BILL_COLUMNS + (('live', None),)}
+        items = {name: np.concatenate([chunk['item_' + name] for chunk in chunks]) for name, _ in ITEM_COLUMNS}
+        items['bill'] = items['bill'].astype(np.int64) + np.repeat(
+            offsets[:-1], [len(chunk['item_bill']) for chunk in chunks])
+        keep = bills['live']
+        if date_from or date_to:
+            keep &= bills['day'] != NO_DAY
+            if date_from:
+                keep &= bills['day'] >= to_day(date_from)
+            if date_to:
+                keep &= bills['day'] <= to_day(date_to)
+        item_keep = keep[items['bill']]
+        self.bills = {name: column[keep] for name, column in bills.items()}
+        self.items = {name: column[item_keep] for name, column in items.items()}
+        # Index into self.bills of each kept item's bill.
+        self.items['bill'] = (np.cumsum(keep) - 1)[self.items['bill']]
+
+
+def _rupees(paise):
+    return round(int(paise) / 100, 2)
+
+
+def _grouped(keys, bills, minlength=0):
+    """``(keys present, counts, {column: paise sums})`` over bill rows grouped by ``keys``."""
+    if minlength:
+        inverse, present = keys, None
+    else:
+        present, inverse = np.unique(keys, return_inverse=True)
+    count = np.bincount(inverse, minlength=minlength)
+    sums = {name: np.bincount(inverse, weights=bills[name], minlength=minlength)
+            for name in ('subtotal', 'tax', 'discount', 'total')}
+    return present, count, sums
+
+
+def gst(snapshot, **options):
+    """Taxable value and tax by GST rate, with tax split equally into CGST and SGST."""
+    rates, count, sums = _grouped(snapshot.bills['rate'], snapshot.bills)
+    for index, rate in enumerate(rates):
+        tax = int(sums['tax'][index])
+        yield {'taxRate': int(rate) / 100, 'bills': int(count[index]), 'taxableValue': _rupees(sums['subtotal'][index]),
+               'cgst': _rupees(tax - tax // 2), 'sgst': _rupees(tax // 2), 'totalTax': _rupees(tax),
+               'discount': _rupees(sums['discount'][index]), 'grandTotal': _rupees(sums['total'][index])}
+
+
+def sales_by_day(snapshot, **options):
+    days, count, sums = _grouped(snapshot.bills['day'], snapshot.bills)
+    for index, day in enumerate(days):
+        yield {'date': from_day(day) if day != NO_DAY else '', 'bills': int(count[index]),
+               'subtotal': _rupees(sums['subtotal'][index]), 'tax': _rupees(sums['tax'][index]),
+               'grandTotal': _rupees(sums['total'][index])}
+
+
+def sales_by_hour(snapshot, **options):
+    timed = snapshot.bills['hour'] >= 0
+    bills = {name: column[timed] for name, column in snapshot.bills.items()}
+    _, count, sums = _grouped(bills['hour'].astype(np.int64), bills, minlength=24)
+    for hour in range(24):
+        yield {'hour': hour, 'bills': int(count[hour]), 'subtotal': _rupees(sums['subtotal'][hour]),
+               'tax': _rupees(sums['tax'][hour]), 'grandTotal': _rupees(sums['total'][hour])}
+
+
+def _top(totals, top):
+    present = np.flatnonzero(totals)
+    order = present[np.argsort(-totals[present], kind='stable')]
+    return order[:top] if top else order
+
+
+def top_items(snapshot, top=DEFAULT_TOP, **options):
+    items = snapshot.items
+    size = len(snapshot.item_names)
+    amount = np.bincount(items['item'], weights=items['amount'], minlength=size)
+    quantity = np.bincount(items['item'], weights=items['quantity'], minlength=size)
+    lines = np.bincount(items['item'], minlength=size)
+    for code in _top(lines.astype(bool) * (amount + 1), top):
+        yield {'item': snapshot.item_names[code], 'lines': int(lines[code]), 'quantity': round(float(quantity[code]), 3),
+               'revenue': _rupees(amount[code])}
+
+
+def customers(snapshot, top=DEFAULT_TOP, **options):
+    bills = snapshot.bills
+    size = len(snapshot.customer_keys)
+    total = np.bincount(bills['customer'], weights=bills['total'], minlength=size)
+    count = np.bincount(bills['customer'], minlength=size)
+    if '' in snapshot.customer_keys:
+        # Bills without a customer name or phone.
+        count[snapshot.customer_keys.index('')] = 0
+    for code in _top(count.astype(bool) * (total + 1), top):
+        key = snapshot.customer_keys[code]
+        yield {'customer': snapshot.customer_names.get(key, key), 'key': key, 'bills': int(count[code]),
+               'revenue': _rupees(total[code])}
+
+
+REPORTS = {
+    'gst': (gst, ['taxRate', 'bills', 'taxableValue', 'cgst', 'sgst', 'totalTax', 'discount', 'grandTotal']),
+    'sales-by-day': (sales_by_day, ['date', 'bills', 'subtotal', 'tax', 'grandTotal']),
+    'sales-by-hour': (sales_by_hour, ['hour', 'bills', 'subtotal', 'tax', 'grandTotal']),
+    'top-items': (top_items, ['item', 'lines', 'quantity', 'revenue']),
+    'customers': (customers, ['customer', 'key', 'bills', 'revenue']),
+}
+
+
+def pack_segment(bills):
+    """The ``reports`` section of a sealed segment holding ``bills``, in segment order."""
+    buffer = _Buffer()
+    customers, items, names = _Codes(), _Codes(), {}
+    for bill in bills:
+        buffer.append(bill, customers, items, names)
+    chunk = buffer.freeze()
+    out = io.BytesIO()
+    np.savez(out, customer_names=np.array(customers.names, dtype=str), item_names=np.array(items.names, dtype=str),
+             display_names=np.array(json.dumps([names.get(key, (NO_DAY, '')) for key in customers.names])), **chunk)
+    return out.getvalue()
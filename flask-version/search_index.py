@@ -0,0 +1,435 @@
+"""Inverted index for full-text search over bills.
+
+Every bill is a document numbered in arrival order. Each term maps to a
+posting list of document numbers, each with a weight: bill number 8,
+phone 6, customer name 4 and 1 per item description occurrence. A term
+seen only once, such as a bill number, is stored as a single packed int
+instead of a pair of arrays. A bill that is superseded gets a new
+number; its old postings are ignored until the next compaction.
+
+Query words are prefixes, expanded with bisect over terms bucketed by
+their first three characters; an exact match counts double. A bill has
+to match every word. Matching and ranking are done with set operations
+per weight class, so even words that match most of a million bills
+answer in milliseconds, and nothing scans the stored bills. Results are
+ordered by score, newest first on ties.
+
+Only the log store's hot month is indexed in memory. Each sealed month's
+postings are packed into its segment by ``pack_segment()`` and searched
+in place through the memory map by a SegmentIndex; the months' hits are
+merged with the hot ones.
+"""
+from array import array
+from bisect import bisect_left, insort
+import heapq
+import re
+import struct
+
+from history_index import query_terms
+from records import id_key
+from segments import bill_month
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# Longest run of terms a single query word may expand to.
+MAX_EXPANSIONS = 256
+FIELD_WEIGHTS = (('billNumber', 8), ('customerPhone', 6), ('customerName', 4))
+DESCRIPTION_WEIGHT = 1
+BUCKET = 3
+# Term and posting counts at the start of a packed segment section.
+PACKED_HEADER = struct.Struct('<II')
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def bill_terms(bill):
+    """Return ``{term: weight}`` for ``bill``."""
+    weights = {}
+    for field, weight in FIELD_WEIGHTS:
+        value = str(bill.get(field) or '').lower()
+        if field == 'customerPhone':
+            value = re.sub(r'\D', '', value)
+            words = [value] if value else []
+        else:
+            words = _WORD.findall(value)
+        for word in words:
+            weights[word] = weights.get(word, 0) + weight
+    for item in bill.get('items') or []:
+        if isinstance(item, dict):
+            for word in _WORD.findall(str(item.get('description') or '').lower()):
+                weights[word] = weights.get(word, 0) + DESCRIPTION_WEIGHT
+    return {term: min(weight, 127) for term, weight in weights.items()}
+
+
+def _newest(docs, raw, weight):
+    """Documents in ``docs`` with ``weight``, newest first."""
+    needle = bytes((weight,))
+    position = raw.rfind(needle)
+    while position >= 0:
+        yield docs[position]
+        position = raw.rfind(needle, 0, position)
+
+
+class SearchIndex:
+    def __init__(self, compact_min=10000):
+        self.compact_min = compact_min
+        self.clear()
+
+    def clear(self):
+        self._ids = []
+        self._docs = {}
+        self._dead = set()
+        self._postings = {}
+        self._buckets = {}
+        self._bucket_keys = []
+        self._archive = None
+        # month -> (segment, index) of the sealed months searched so far.
+        self._sealed = {}
+
+    def add_archive(self, archive):
+        self._archive = archive
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, bill):
+        bill_id = str(bill.get('id', ''))
+        old = self._docs.get(bill_id)
+        if old is not None:
+            self._ids[old] = None
+            self._dead.add(old)
+        elif self._archive is not None and bill_month(bill) in self._sealed:
+            segment, index = self._sealed[bill_month(bill)]
+            doc = segment.find(id_key(bill_id))
+            if doc is not None:
+                index._dead.add(doc)
+        doc = len(self._ids)
+        self._ids.append(bill_id)
+        self._docs[bill_id] = doc
+        postings = self._postings
+        for term, weight in bill_terms(bill).items():
+            posting = postings.get(term)
+            if posting is None:
+                postings[term] = doc << 8 | weight
+                self._add_term(term)
+            elif type(posting) is int:
+                postings[term] = (array('I', (posting >> 8, doc)), array('B', (posting & 0xFF, weight)))
+            else:
+                posting[0].append(doc)
+                posting[1].append(weight)
+        if len(self._dead) > self.compact_min and len(self._dead) > len(self._docs):
+            self.compact()
+
+    def _add_term(self, term):
+        key = term[:BUCKET]
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = []
+            insort(self._bucket_keys, key)
+        insort(bucket, term)
+
+    def compact(self):
+        """Drop the postings of superseded bills."""
+        dead = self._dead
+        for term, posting in list(self._postings.items()):
+            if type(posting) is int:
+                if posting >> 8 in dead:
+                    del self._postings[term]
+                    self._buckets[term[:BUCKET]].remove(term)
+                continue
+            kept = [(doc, weight) for doc, weight in zip(*posting) if doc not in dead]
+            if not kept:
+                del self._postings[term]
+                self._buckets[term[:BUCKET]].remove(term)
+            elif len(kept) < len(posting[0]):
+                self._postings[term] = (array('I', [doc for doc, _ in kept]),
+                                        array('B', [weight for _, weight in kept]))
+        self._dead = set()
+
+    # -- queries -------------------------------------------------------
+    #
+    # Query words expand to lists of ``(term, posting)``; a posting is a
+    # packed int or a ``(docs, weights)`` pair of arrays or memoryviews.
+
+    def _expand(self, word):
+        """Terms starting with ``word``, at most MAX_EXPANSIONS of them."""
+        terms = []
+        if len(word) >= BUCKET:
+            keys = [word[:BUCKET]]
+        else:
+            position = bisect_left(self._bucket_keys, word)
+            keys = []
+            while position < len(self._bucket_keys) and self._bucket_keys[position].startswith(word):
+                keys.append(self._bucket_keys[position])
+                position += 1
+        for key in keys:
+            bucket = self._buckets.get(key, ())
+            position = bisect_left(bucket, word)
+            while position < len(bucket) and bucket[position].startswith(word):
+                terms.append((bucket[position], self._postings[bucket[position]]))
+                if len(terms) >= MAX_EXPANSIONS:
+                    return terms
+                position += 1
+        return terms
+
+    def _live(self):
+        return len(self._docs)
+
+    def _bill_id(self, doc):
+        return self._ids[doc]
+
+    @staticmethod
+    def _size(terms):
+        return sum(1 if type(posting) is int else len(posting[0]) for _, posting in terms)
+
+    @staticmethod
+    def _score(word, terms, doc):
+        """``word``'s score for ``doc``: its best weight among the expansions."""
+        best = 0
+        for term, posting in terms:
+            if type(posting) is int:
+                weight = posting & 0xFF if posting >> 8 == doc else 0
+            else:
+                docs, weights = posting
+                position = bisect_left(docs, doc)
+                weight = weights[position] if position < len(docs) and docs[position] == doc else 0
+            if weight:
+                best = max(best, weight * 2 if term == word else weight)
+        return best
+
+    @staticmethod
+    def _stream(word, terms):
+        """Yield ``(score, doc)`` for every document matching ``word``, best first.
+
+        Each weight class of each posting list is read newest first with
+        ``bytes.rfind`` over its weights, so a caller that stops early only
+        touches as many documents as it consumed.
+        """
+        sources = {}
+        for term, posting in terms:
+            factor = 2 if term == word else 1
+            if type(posting) is int:
+                sources.setdefault((posting & 0xFF) * factor, []).append(iter((posting >> 8,)))
+                continue
+            docs, weights = posting
+            raw = weights.tobytes()
+            for weight in set(weights):
+                sources.setdefault(weight * factor, []).append(_newest(docs, raw, weight))
+        seen = set()
+        for score in sorted(sources, reverse=True):
+            for doc in heapq.merge(*sources[score], reverse=True):
+                if doc not in seen:
+                    seen.add(doc)
+                    yield score, doc
+
+    def _dead_in(self, posting):
+        if type(posting) is int:
+            return (posting >> 8) in self._dead
+        docs = posting[0]
+        if len(self._dead) * 16 > len(docs):
+            return len(self._dead.intersection(docs))
+        count = 0
+        for doc in self._dead:
+            position = bisect_left(docs, doc)
+            count += position < len(docs) and docs[position] == doc
+        return count
+
+    def _single(self, word, terms, wanted):
+        hits = []
+        for score, doc in self._stream(word, terms):
+            if doc not in self._dead:
+                hits.append((score, doc))
+                if len(hits) >= wanted:
+                    break
+        if len(terms) == 1:
+            return hits, self._size(terms) - self._dead_in(terms[0][1])
+        return hits, len(self._matching(terms) - self._dead)
+
+    @staticmethod
+    def _matching(terms):
+        docs = set()
+        for _, posting in terms:
+            if type(posting) is int:
+                docs.add(posting >> 8)
+            else:
+                docs.update(posting[0])
+        return docs
+
+    def _top(self, words, matched, wanted):
+        """The best ``wanted`` of ``matched`` by the threshold algorithm.
+
+        The words' streams are read in turn and every new document is
+        scored in full. Nothing still unread can beat the score and doc
+        of the streams' current positions, so once the page is at least
+        that good the rest is never looked at.
+        """
+        streams = [self._stream(word, terms) for _, word, terms in words]
+        fronts = [None] * len(streams)
+        best, seen = [], set()
+        while True:
+            for index, stream in enumerate(streams):
+                front = next(stream, None)
+                if front is None:
+                    return sorted(best, reverse=True)
+                fronts[index] = front
+                doc = front[1]
+                if doc in matched and doc not in seen:
+                    seen.add(doc)
+                    key = (sum(self._score(word, terms, doc) for _, word, terms in words), doc)
+                    if len(best) < wanted:
+                        heapq.heappush(best, key)
+                    elif key > best[0]:
+                        heapq.heapreplace(best, key)
+            bound = (sum(score for score, _ in fronts), min(doc for _, doc in fronts))
+            if len(best) >= wanted and best[0] >= bound:
+                return sorted(best, reverse=True)
+
+    def _query(self, words, wanted):
+        """Return ``(hits, total)`` for this index alone; hits are ``(score, doc)``."""
+        expanded = []
+        for word in words:
+            terms = self._expand(word)
+            if not terms:
+                return [], 0
+            expanded.append((self._size(terms), word, terms))
+        if len(expanded) == 1:
+            return self._single(expanded[0][1], expanded[0][2], wanted)
+        expanded.sort()
+        matched = None
+        for size, word, terms in expanded:
+            if len(terms) == 1 and size - self._dead_in(terms[0][1]) == self._live() and matched is not None:
+                continue  # in every bill, like the "bill" of "BILL-0001"
+            if matched is not None and len(matched) * len(terms) * 8 < size:
+                # Few bills left: probe the big posting lists instead of reading them.
+                matched = {doc for doc in matched if self._score(word, terms, doc)}
+            elif matched is None:
+                matched = self._matching(terms)
+            else:
+                matched &= self._matching(terms)
+            if not matched:
+                return [], 0
+        matched -= self._dead
+        total = len(matched)
+        if total <= wanted * 64:
+            hits = heapq.nlargest(wanted, ((sum(self._score(word, terms, doc) for _, word, terms in expanded), doc)
+                                           for doc in matched))
+        else:
+            hits = self._top(expanded, matched, wanted)
+        return hits, total
+
+    def _sealed_index(self, month):
+        found = self._sealed.get(month)
+        if found is None:
+            segment = self._archive.segment(month)
+            data = segment.section('search')
+            if data is not None:
+                index = SegmentIndex(segment, data)
+            else:
+                index = SearchIndex(compact_min=float('inf'))
+                for bill in segment.iter_bills():
+                    index.add(bill)
+            index._dead = self._archive.shadowed_docs(month)
+            found = self._sealed[month] = (segment, index)
+        return found[1]
+
+    def search(self, query, offset=0, limit=DEFAULT_LIMIT):
+        """Return ``(hits, total)``; hits are ``(bill_id, score)``, best first."""
+        words = query_terms(query or '')
+        if not words:
+            return [], 0
+        limit = max(1, min(limit, MAX_LIMIT))
+        offset = max(0, offset)
+        wanted = offset + limit
+        indexes = [self]
+        if self._archive is not None:
+            indexes += [self._sealed_index(month) for month in reversed(self._archive.months())]
+        hits, total = [], 0
+        for rank, index in enumerate(indexes):
+            found, count = index._query(words, wanted)
+            total += count
+            hits.extend((score, -rank, doc, index) for score, doc in found)
+        # Newer months win ties, and within one the higher (newer) doc.
+        hits = heapq.nlargest(wanted, hits, key=lambda hit: hit[:3])
+        return [(index._bill_id(doc), score) for score, _, doc, index in hits[offset:]], total
+
+
+class _Terms:
+    """Sorted UTF-8 terms of a packed section, as a sequence of bytes."""
+
+    def __init__(self, offsets, blob):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, position):
+        return bytes(self._blob[self._offsets[position]:self._offsets[position + 1]])
+
+
+class SegmentIndex(SearchIndex):
+    """Read-only search over the postings packed into a sealed segment.
+
+    Documents are the segment's docs; nothing is copied out of the
+    memory map but the terms a query expands to.
+    """
+
+    def __init__(self, segment, data):
+        self._segment = segment
+        self._dead = set()
+        term_count, posting_count = PACKED_HEADER.unpack_from(data)
+        offset = PACKED_HEADER.size
+        term_offsets = data[offset:offset + 4 * (term_count + 1)].cast('I')
+        offset += 4 * (term_count + 1)
+        self._posting_offsets = data[offset:offset + 4 * (term_count + 1)].cast('I')
+        offset += 4 * (term_count + 1)
+        self._docs = data[offset:offset + 4 * posting_count].cast('I')
+        offset += 4 * posting_count
+        self._weights = data[offset:offset + posting_count]
+        self._terms = _Terms(term_offsets, data[offset + posting_count:])
+
+    def add(self, bill):
+        raise TypeError('sealed segments are read-only')
+
+    def _expand(self, word):
+        prefix = word.encode('utf-8')
+        position = bisect_left(self._terms, prefix)
+        terms = []
+        while position < len(self._terms) and len(terms) < MAX_EXPANSIONS:
+            term = self._terms[position]
+            if not term.startswith(prefix):
+                break
+            start, end = self._posting_offsets[position], self._posting_offsets[position + 1]
+            terms.append((term.decode('utf-8'), (self._docs[start:end], self._weights[start:end])))
+            position += 1
+        return terms
+
+    def _live(self):
+        return len(self._segment) - len(self._dead)
+
+    def _bill_id(self, doc):
+        return self._segment.bill_id(doc)
+
+
+def pack_segment(bills):
+    """The ``search`` section of a sealed segment holding ``bills``."""
+    index = SearchIndex(compact_min=float('inf'))
+    for bill in bills:
+        index.add(bill)
+    blob = bytearray()
+    term_offsets, posting_offsets = array('I', [0]), array('I', [0])
+    docs, weights = array('I'), array('B')
+    terms = sorted(index._postings)
+    for term in terms:
+        blob += term.encode('utf-8')
+        term_offsets.append(len(blob))
+        posting = index._postings[term]
+        if type(posting) is int:
+            docs.append(posting >> 8)
+            weights.append(posting & 0xFF)
+        else:
+            docs.extend(posting[0])
+            weights.extend(posting[1])
+        posting_offsets.append(len(docs))
+    return (PACKED_HEADER.pack(len(terms), len(docs)) + term_offsets.tobytes() + posting_offsets.tobytes()
+            + docs.tobytes() + weights.tobytes() + bytes(blob))
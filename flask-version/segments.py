@@ -0,0 +1,212 @@
+"""Sealed, read-only month segments of the bill log.
+
+A segment holds the bills created in one month, sorted by ``(createdAt,
+id)`` and packed as log records into zlib-compressed blocks of about
+BLOCK_BYTES. A footer at the end of the file indexes it: where each block
+starts, which block and offset every bill's record sits at, the bill keys
+sorted for lookups behind a Bloom filter, the bill ids, and any extra sections (search postings,
+dashboard totals) the store was asked to add when it sealed the month.
+
+Segments are memory-mapped. Opening one reads only the trailer and the
+footer's directory; a block is decompressed when a bill in it is read, and
+the last few decompressed blocks are kept. Arrays in the footer are in the
+machine's byte order, so segments are not meant to be copied between
+machines of different endianness.
+"""
+from array import array
+from collections import OrderedDict
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+
+from history_index import UNDATED, sort_key
+from records import decode_record, encode_record, id_key
+from writer import atomic_write
+
+MAGIC = b'BILLSEG1'
+TRAILER = struct.Struct('<QI8s')
+KEY_ENTRY = struct.Struct('<16sI')
+BLOCK_BYTES = 64 * 1024
+CACHE_BLOCKS = 8
+# Bloom filter bits per bill and probes per key: about 1.2% false positives.
+BLOOM_BITS = 10
+BLOOM_PROBES = 4
+
+_MONTH = re.compile(r'\d{4}-\d{2}')
+
+
+def bill_month(bill):
+    """``YYYY-MM`` of the bill's createdAt (or billDate), or UNDATED."""
+    date = sort_key(bill)[0]
+    return date[:7] if _MONTH.match(date) else UNDATED
+
+
+def month_code(month):
+    """``month`` as an int that sorts like it; UNDATED (or junk) is 0."""
+    if not _MONTH.fullmatch(month or ''):
+        return 0
+    return int(month[:4]) * 100 + int(month[5:7])
+
+
+def _probes(key, bits):
+    # Keys are UUID bytes or MD5 digests, uniform enough to hash with.
+    first, second = int.from_bytes(key[:8], 'little'), int.from_bytes(key[8:], 'little') | 1
+    return [(first + probe * second) % bits for probe in range(BLOOM_PROBES)]
+
+
+def write_segment(path, month, bills, builders=None, codec='json'):
+    """Atomically write the segment for ``month`` holding ``bills``.
+
+    ``builders`` maps section names to functions that are given the bills
+    in segment order and return the section's bytes. Records are written
+    with ``codec`` (see records.py).
+    """
+    bills = sorted(bills, key=sort_key)
+    out = bytearray(MAGIC)
+    blocks = array('Q')
+    records = array('I')
+    keys = []
+    ids = bytearray()
+    id_offsets = array('I', [0])
+    raw = bytearray()
+
+    def flush():
+        blocks.append(len(out))
+        out.extend(zlib.compress(bytes(raw), 6))
+        raw.clear()
+
+    for doc, bill in enumerate(bills):
+        record = encode_record(bill, codec)
+        if raw and len(raw) + len(record) > BLOCK_BYTES:
+            flush()
+        records.extend((len(blocks), len(raw), len(record)))
+        raw.extend(record)
+        bill_id = str(bill.get('id', ''))
+        keys.append((id_key(bill_id), doc))
+        ids.extend(bill_id.encode('utf-8'))
+        id_offsets.append(len(ids))
+    if raw:
+        flush()
+    blocks.append(len(out))
+    keys.sort()
+    if any(a[0] == b[0] for a, b in zip(keys, keys[1:])):
+        raise ValueError('duplicate bill id in segment %s' % month)
+    bloom = bytearray(max(8, len(keys) * BLOOM_BITS // 8))
+    for key, _ in keys:
+        for bit in _probes(key, len(bloom) * 8):
+            bloom[bit >> 3] |= 1 << (bit & 7)
+    sections = {
+        'bloom': bytes(bloom),
+        'blocks': blocks.tobytes(),
+        'records': records.tobytes(),
+        'keys': b''.join(KEY_ENTRY.pack(key, doc) for key, doc in keys),
+        'idOffsets': id_offsets.tobytes(),
+        'ids': bytes(ids),
+    }
+    for name, build in (builders or {}).items():
+        sections[name] = build(bills)
+    directory = {'month': month, 'count': len(bills), 'sections': {}}
+    for name, data in sections.items():
+        out.extend(b'\0' * (-len(out) % 8))
+        directory['sections'][name] = [len(out), len(data)]
+        out.extend(data)
+    footer = json.dumps(directory, separators=(',', ':')).encode('utf-8')
+    footer_offset = len(out)
+    out.extend(footer)
+    out.extend(TRAILER.pack(footer_offset, len(footer), MAGIC))
+    atomic_write(path, bytes(out))
+
+
+class Segment:
+    def __init__(self, path, cache_blocks=CACHE_BLOCKS):
+        self.path = path
+        self.cache_blocks = cache_blocks
+        # Blocks decompressed by this process; reported by /metrics.
+        self.blocks_read = 0
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            self.file_id = (st.st_dev, st.st_ino)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        if len(view) < len(MAGIC) + TRAILER.size or view[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a bill segment' % path)
+        offset, length, magic = TRAILER.unpack_from(view, len(view) - TRAILER.size)
+        if magic != MAGIC:
+            raise ValueError('%s has no segment footer' % path)
+        directory = json.loads(bytes(view[offset:offset + length]))
+        self.month = directory['month']
+        self.count = directory['count']
+        self.size = len(view)
+        self._view = view
+        self._sections = directory['sections']
+        self._blocks = self.section('blocks').cast('Q')
+        self._records = self.section('records').cast('I')
+        self._keys = self.section('keys')
+        self._bloom = self.section('bloom')
+        self._id_offsets = self.section('idOffsets').cast('I')
+        self._ids = self.section('ids')
+        self._lock = threading.Lock()
+        self._decoded = OrderedDict()
+
+    def __len__(self):
+        return self.count
+
+    def section(self, name):
+        """The bytes of section ``name`` as a memoryview, or None."""
+        if name not in self._sections:
+            return None
+        offset, length = self._sections[name]
+        return self._view[offset:offset + length]
+
+    def bill_id(self, doc):
+        return bytes(self._ids[self._id_offsets[doc]:self._id_offsets[doc + 1]]).decode('utf-8')
+
+    def find(self, key):
+        """Doc number of the bill with index key ``key``, or None."""
+        bloom = self._bloom
+        for bit in _probes(key, len(bloom) * 8):
+            if not bloom[bit >> 3] & 1 << (bit & 7):
+                return None
+        keys, size = self._keys, KEY_ENTRY.size
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if bytes(keys[middle * size:middle * size + 16]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count:
+            found, doc = KEY_ENTRY.unpack_from(keys, low * size)
+            if found == key:
+                return doc
+        return None
+
+    def _block(self, index):
+        with self._lock:
+            raw = self._decoded.get(index)
+            if raw is not None:
+                self._decoded.move_to_end(index)
+                return raw
+        raw = zlib.decompress(self._view[self._blocks[index]:self._blocks[index + 1]])
+        with self._lock:
+            self.blocks_read += 1
+            self._decoded[index] = raw
+            while len(self._decoded) > self.cache_blocks:
+                self._decoded.popitem(last=False)
+        return raw
+
+    def read(self, doc):
+        block, start, length = self._records[doc * 3:doc * 3 + 3]
+        return decode_record(self._block(block)[start:start + length])
+
+    def iter_bills(self):
+        """Every bill in doc order, decompressing one block at a time."""
+        for index in range(len(self._blocks) - 1):
+            raw = zlib.decompress(self._view[self._blocks[index]:self._blocks[index + 1]])
+            self.blocks_read += 1
+            for line in raw.splitlines(keepends=True):
+                yield decode_record(line)
@@ -0,0 +1,346 @@
+"""SQLite bill storage.
+
+Drop-in alternative to :class:`store.LogStore`. Bills and their line items
+are normalised into tables so lookups by date, bill number or phone use an
+index instead of a full parse. Each thread keeps its own connection and the
+database runs in WAL mode, so readers never wait on a writer.
+
+Run as a script to migrate an existing data.json::
+
+    python sqlite_store.py flask-version/data.json flask-version/data/bills.db
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from writer import GroupCommit
+
+# Numbers have no declared type, so SQLite keeps ints, floats and strings
+# as they were given and a bill reads back exactly as it was written.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS business (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL,
+    epoch INTEGER NOT NULL,
+    modified REAL NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO meta (id, version, epoch) VALUES (1, 0, 0);
+CREATE TABLE IF NOT EXISTS bills (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    rev INTEGER NOT NULL DEFAULT 0,
+    billNumber TEXT,
+    customerName TEXT,
+    customerPhone TEXT,
+    billDate TEXT,
+    createdAt TEXT,
+    subtotal,
+    taxRate,
+    discount,
+    grandTotal,
+    signature TEXT,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS bill_items (
+    bill_seq INTEGER NOT NULL REFERENCES bills(seq) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    description TEXT,
+    quantity,
+    price,
+    extra TEXT,
+    PRIMARY KEY (bill_seq, position)
+);
+CREATE INDEX IF NOT EXISTS bills_created_at ON bills(createdAt);
+CREATE INDEX IF NOT EXISTS bills_bill_number ON bills(billNumber);
+CREATE INDEX IF NOT EXISTS bills_customer_phone ON bills(customerPhone);
+CREATE INDEX IF NOT EXISTS bills_rev ON bills(rev);
+"""
+
+BILL_COLUMNS = ('id', 'billNumber', 'customerName', 'customerPhone', 'billDate',
+                'createdAt', 'subtotal', 'taxRate', 'discount', 'grandTotal', 'signature')
+ITEM_COLUMNS = ('description', 'quantity', 'price')
+DEFAULT_BATCH_SIZE = 1000
+MAX_PARAMS = 500
+
+
+def _split(record, columns):
+    values = [record.get(column) for column in columns]
+    # A NULL column reads back as an absent key, so explicit nulls go with
+    # the other keys into extra.
+    extra = {k: v for k, v in record.items() if (k not in columns or v is None) and k != 'items'}
+    return values, json.dumps(extra, separators=(',', ':')) if extra else None
+
+
+def _join(columns, values, extra):
+    record = {}
+    if extra:
+        record.update(json.loads(extra))
+    for column, value in zip(columns, values):
+        if value is not None:
+            record[column] = value
+    return record
+
+
+class SQLiteStore:
+    def __init__(self, path, legacy_file=None, batch_size=DEFAULT_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        # Time spent in commits, reported by /metrics.
+        self.commits = 0
+        self.commit_seconds = 0.0
+        self._local = threading.local()
+        self._committer = GroupCommit(self._commit)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fresh = not os.path.exists(path)
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        if 'modified' not in [row[1] for row in conn.execute('PRAGMA table_info(meta)')]:
+            conn.execute('ALTER TABLE meta ADD COLUMN modified REAL NOT NULL DEFAULT 0')
+        if fresh and legacy_file and os.path.exists(legacy_file):
+            self.import_json(legacy_file)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # -- bills ---------------------------------------------------------
+
+    def refresh(self):
+        """Nothing to do; every query sees the latest committed data."""
+
+    def stamp(self):
+        """Token that changes whenever any connection writes the store."""
+        return self._conn().execute('SELECT epoch, version FROM meta').fetchone()
+
+    def modified(self):
+        """When any connection last wrote the store, in seconds since the epoch."""
+        return self._conn().execute('SELECT modified FROM meta').fetchone()[0]
+
+    def changes_since(self, cursor):
+        """Return ``(cursor, bills)`` written after ``cursor``.
+
+        ``bills`` is None when the bills were rewritten since ``cursor`` (or
+        ``cursor`` is None) and the caller has to reload everything.
+        """
+        current = self.stamp()
+        if cursor is None or cursor[0] != current[0]:
+            return current, None
+        sql, params = self._select('WHERE rev > ? AND rev <= ? ORDER BY seq', (cursor[1], current[1]))
+        return current, self._rows_to_bills(self._conn().execute(sql, params).fetchall())
+
+    def count(self):
+        return self._conn().execute('SELECT COUNT(*) FROM bills').fetchone()[0]
+
+    def data_bytes(self):
+        conn = self._conn()
+        return conn.execute('PRAGMA page_count').fetchone()[0] * conn.execute('PRAGMA page_size').fetchone()[0]
+
+    # Every bill is hot here: there are no sealed months.
+
+    def hot_bytes(self):
+        return self.data_bytes()
+
+    def iter_hot(self):
+        return self.iter_bills()
+
+    def months(self):
+        return []
+
+    def segment(self, month):
+        return None
+
+    def needs_seal(self, month=None):
+        return False
+
+    def seal(self, month=None):
+        return []
+
+    def _rows_to_bills(self, rows):
+        conn = self._conn()
+        items = {}
+        seqs = [row[0] for row in rows]
+        for start in range(0, len(seqs), MAX_PARAMS):
+            chunk = seqs[start:start + MAX_PARAMS]
+            for item in conn.execute(
+                    'SELECT bill_seq, description, quantity, price, extra FROM bill_items '
+                    'WHERE bill_seq IN (%s) ORDER BY bill_seq, position' % ', '.join('?' * len(chunk)),
+                    chunk):
+                items.setdefault(item[0], []).append(_join(ITEM_COLUMNS, item[1:-1], item[-1]))
+        bills = []
+        for row in rows:
+            bill = _join(BILL_COLUMNS, row[1:-1], row[-1])
+            bill['items'] = items.get(row[0], [])
+            bills.append(bill)
+        return bills
+
+    def _select(self, where='', params=()):
+        return 'SELECT seq, %s, extra FROM bills %s' % (', '.join(BILL_COLUMNS), where), params
+
+    def iter_bills(self, date_from=None, date_to=None):
+        """Every bill, or those dated ``date_from`` to ``date_to`` (inclusive ISO dates)."""
+        day = "substr(COALESCE(NULLIF(createdAt, ''), NULLIF(billDate, ''), ''), 1, 10)"
+        where, params = [], []
+        if date_from:
+            where.append(day + ' >= ?')
+            params.append(date_from)
+        if date_to:
+            where.append(day + ' <= ?')
+            params.append(date_to)
+        sql, params = self._select(('WHERE %s ' % ' AND '.join(where) if where else '') + 'ORDER BY seq',
+                                   params)
+        rows = self._conn().execute(sql, params)
+        while True:
+            batch = rows.fetchmany(self.batch_size)
+            if not batch:
+                break
+            yield from self._rows_to_bills(batch)
+
+    def get_bill(self, bill_id, month=None):
+        sql, params = self._select('WHERE id = ?', (bill_id,))
+        bills = self._rows_to_bills(self._conn().execute(sql, params).fetchall())
+        return bills[0] if bills else None
+
+    def _bump(self, conn, rewrite=False):
+        conn.execute('UPDATE meta SET version = version + 1, epoch = epoch + ?, modified = ?',
+                     (int(rewrite), time.time()))
+        return conn.execute('SELECT version FROM meta').fetchone()[0]
+
+    def _insert(self, conn, bills):
+        rev = self._bump(conn)
+        for bill in bills:
+            values, extra = _split(bill, BILL_COLUMNS)
+            row = conn.execute('SELECT seq FROM bills WHERE id = ?', (bill.get('id'),)).fetchone()
+            if row is None:
+                seq = conn.execute(
+                    'INSERT INTO bills (%s, extra, rev) VALUES (%s)' % (
+                        ', '.join(BILL_COLUMNS), ', '.join('?' * (len(BILL_COLUMNS) + 2))),
+                    values + [extra, rev]).lastrowid
+            else:
+                seq = row[0]
+                conn.execute(
+                    'UPDATE bills SET %s, extra = ?, rev = ? WHERE seq = ?' % ', '.join(
+                        '%s = ?' % column for column in BILL_COLUMNS),
+                    values + [extra, rev, seq])
+                conn.execute('DELETE FROM bill_items WHERE bill_seq = ?', (seq,))
+            items = []
+            for position, item in enumerate(bill.get('items') or []):
+                item_values, item_extra = _split(item, ITEM_COLUMNS)
+                items.append([seq, position] + item_values + [item_extra])
+            conn.executemany(
+                'INSERT INTO bill_items (bill_seq, position, description, quantity, price, extra) '
+                'VALUES (?, ?, ?, ?, ?, ?)', items)
+
+    def append_bill(self, bill):
+        self.append_bills([bill])
+
+    def append_bills(self, bills):
+        """Insert ``bills``; an existing id is replaced.
+
+        Concurrent callers in one worker share a single transaction.
+        """
+        if bills:
+            self._committer.submit(bills)
+
+    def _commit(self, bills):
+        started = time.perf_counter()
+        conn = self._conn()
+        with _transaction(conn):
+            self._insert(conn, bills)
+        self.commits += 1
+        self.commit_seconds += time.perf_counter() - started
+
+    # -- business ------------------------------------------------------
+
+    def get_business(self):
+        row = self._conn().execute('SELECT data FROM business WHERE id = 1').fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def set_business(self, business):
+        conn = self._conn()
+        with _transaction(conn):
+            self._bump(conn)
+            conn.execute('INSERT OR REPLACE INTO business (id, data) VALUES (1, ?)',
+                         (json.dumps(business),))
+
+    # -- load_data / save_data contract --------------------------------
+
+    def load(self):
+        return {"business": self.get_business(), "bills": list(self.iter_bills())}
+
+    def save(self, data):
+        conn = self._conn()
+        bills = data.get('bills', [])
+        known = [row[0] for row in conn.execute('SELECT id FROM bills ORDER BY seq')]
+        with _transaction(conn):
+            self._bump(conn)
+            conn.execute('INSERT OR REPLACE INTO business (id, data) VALUES (1, ?)',
+                         (json.dumps(data.get('business', {})),))
+            if known == [bill.get('id') for bill in bills[:len(known)]]:
+                self._insert(conn, bills[len(known):])
+            else:
+                conn.execute('DELETE FROM bills')
+                self._bump(conn, rewrite=True)
+                self._insert(conn, bills)
+
+    def import_json(self, path):
+        """Bulk-load a legacy data.json, committing every ``batch_size`` bills."""
+        with open(path, 'r') as f:
+            data = json.load(f)
+        conn = self._conn()
+        bills = data.get('bills', [])
+        with _transaction(conn):
+            self._bump(conn)
+            conn.execute('INSERT OR REPLACE INTO business (id, data) VALUES (1, ?)',
+                         (json.dumps(data.get('business', {})),))
+        for start in range(0, len(bills), self.batch_size):
+            with _transaction(conn):
+                self._insert(conn, bills[start:start + self.batch_size])
+        return len(bills)
+
+
+class _transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import a data.json file into SQLite.')
+    parser.add_argument('source', help='path to the legacy data.json')
+    parser.add_argument('database', help='SQLite database to create or extend')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+    started = time.perf_counter()
+    count = SQLiteStore(args.database, batch_size=args.batch_size).import_json(args.source)
+    print('Imported %d bills in %.2fs' % (count, time.perf_counter() - started))
+
+
+if __name__ == '__main__':
+    main()
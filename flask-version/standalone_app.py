@@ -1,33 +1,60 @@
-from flask import Flask, render_template_string, request, jsonify, redirect, url_for
+from flask import Flask, render_template, request, jsonify, redirect, url_for, abort
 import os
-import json
-from werkzeug.utils import secure_filename
 from datetime import datetime
 import uuid
+from store import open_store
+from cache import StoreCache
+from history_index import HistoryIndex
+import stats as bill_stats
+from uploads import UploadStore
+import template_registry
+from bill_numbers import BillNumbers, DEFAULT_PREFIX
 import base64
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+app.config['UPLOAD_THUMB_SIZES'] = (128,)
+app.config['STORE_CACHE_MAX_BYTES'] = 256 * 1024 * 1024
 DATA_FILE = 'data.json'
-
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+DATA_DIR = 'data'
+
+uploads = UploadStore(app.config['UPLOAD_FOLDER'], sizes=app.config['UPLOAD_THUMB_SIZES'])
+
+# Bills are kept under DATA_DIR, in an append-only log by default or in
+# SQLite with BILL_STORE=sqlite; an existing DATA_FILE is imported on first
+# start. Sealed months carry their dashboard totals.
+store = open_store(os.environ.get('BILL_STORE', 'log'), DATA_DIR, legacy_file=DATA_FILE,
+                   sections={'stats': bill_stats.pack_segment})
+# Parsed bills stay in memory until another write changes the store; the
+# pages read running totals and a history index kept in step with it
+# rather than every bill.
+cache = StoreCache(store, max_bytes=app.config['STORE_CACHE_MAX_BYTES'])
+history_index = HistoryIndex()
+dashboard_stats = bill_stats.BillStats()
+cache.subscribe(history_index)
+cache.subscribe(dashboard_stats)
+bill_numbers = BillNumbers(DATA_DIR)
 
 def load_data():
-    if not os.path.exists(DATA_FILE):
-        return {"business": {}, "bills": []}
-    with open(DATA_FILE, 'r') as f:
-        return json.load(f)
+    return cache.load()
 
 def save_data(data):
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
+    store.save(data)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+@app.template_global()
+def thumbnail_url(url, size=128):
+    prefix = '/static/uploads/'
+    if not url or not url.startswith(prefix):
+        return url
+    thumb = uploads.thumbnail(url[len(prefix):], size)
+    return prefix + thumb if thumb else url
+
 # Templates as strings
 INDEX_HTML = """
 <!DOCTYPE html>
@@ -72,7 +99,7 @@ INDEX_HTML = """
         <div class="bg-white rounded-2xl shadow-lg border border-slate-100 p-6 mb-8">
             <div class="flex items-center gap-4">
                 {% if business.logo %}
-                <img src="{{ business.logo }}" alt="Logo" class="w-16 h-16 object-contain rounded-xl">
+                <img src="{{ thumbnail_url(business.logo) }}" alt="Logo" class="w-16 h-16 object-contain rounded-xl">
                 {% else %}
                 <div class="w-16 h-16 bg-gradient-to-br from-amber-500 to-orange-500 rounded-xl flex items-center justify-center text-white text-2xl font-bold">
                     {{ business.shopName[0] }}
@@ -86,20 +113,20 @@ INDEX_HTML = """
         </div>
         {% endif %}
 
-        {% if bills %}
+        {% if stats.count %}
         <div class="grid grid-cols-1 sm:grid-cols-3 gap-4 mb-8">
             <div class="bg-white rounded-2xl shadow-lg border border-slate-100 p-5">
                 <div class="w-10 h-10 bg-amber-100 rounded-xl flex items-center justify-center mb-3 text-amber-600">
                     <svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"><path d="M4 2v20l2-1 2 1 2-1 2 1 2-1 2 1 2-1 2 1V2l-2 1-2-1-2 1-2-1-2 1-2-1-2 1-2-1Z"/><path d="M16 8h-6a2 2 0 1 0 0 4h4a2 2 0 1 1 0 4H8"/><path d="M12 17.5V6.5"/></svg>
                 </div>
-                <p class="text-2xl font-bold text-slate-800">{{ bills|length }}</p>
+                <p class="text-2xl font-bold text-slate-800">{{ stats.count }}</p>
                 <p class="text-sm text-slate-500">Total Invoices</p>
             </div>
             <div class="bg-white rounded-2xl shadow-lg border border-slate-100 p-5">
                 <div class="w-10 h-10 bg-green-100 rounded-xl flex items-center justify-center mb-3 text-green-600">
                     <svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"><polyline points="22 7 13.5 15.5 8.5 10.5 2 17"/><polyline points="16 7 22 7 22 13"/></svg>
                 </div>
-                <p class="text-2xl font-bold text-slate-800">₹{{ bills|sum(attribute='grandTotal')|round(2) }}</p>
+                <p class="text-2xl font-bold text-slate-800">₹{{ stats.revenue|round(2) }}</p>
                 <p class="text-sm text-slate-500">Total Revenue</p>
             </div>
         </div>
@@ -153,7 +180,7 @@ SETTINGS_HTML = """
                     <div class="flex items-center gap-4">
                         <div id="logo-preview-container" class="w-20 h-20 border-2 border-dashed border-slate-200 rounded-xl flex items-center justify-center bg-slate-50 overflow-hidden">
                             {% if business.logo %}
-                            <img id="logo-preview" src="{{ business.logo }}" class="w-full h-full object-contain">
+                            <img id="logo-preview" src="{{ thumbnail_url(business.logo) }}" class="w-full h-full object-contain">
                             {% else %}
                             <svg id="logo-placeholder" xmlns="http://www.w3.org/2000/svg" width="24" height="24" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round" class="text-slate-400"><rect width="18" height="18" x="3" y="3" rx="2" ry="2"/><circle cx="9" cy="9" r="2"/><path d="m21 15-3.086-3.086a2 2 0 0 0-2.828 0L6 21"/></svg>
                             {% endif %}
@@ -360,7 +387,6 @@ CREATE_HTML = """
 
         async function saveBill() {
             const data = {
-                billNumber: 'BILL-' + Date.now().toString().slice(-6),
                 customerName: document.getElementById('customerName').value,
                 customerPhone: document.getElementById('customerPhone').value,
                 items,
@@ -401,15 +427,18 @@ HISTORY_HTML = """
                 <tr class="bg-slate-50 text-slate-500 text-sm">
                     <th class="px-6 py-4">Bill No.</th><th class="px-6 py-4">Customer</th><th class="px-6 py-4">Date</th><th class="px-6 py-4">Total</th>
                 </tr>
-                {% for bill in bills|reverse %}
+                {% for bill in bills %}
                 <tr class="border-b">
                     <td class="px-6 py-4 font-semibold">{{ bill.billNumber }}</td>
                     <td class="px-6 py-4">{{ bill.customerName }}</td>
-                    <td class="px-6 py-4">{{ bill.billDate[:10] }}</td>
+                    <td class="px-6 py-4">{{ (bill.billDate or bill.createdAt or '')[:10] }}</td>
                     <td class="px-6 py-4 font-bold text-amber-600">₹{{ "%.2f"|format(bill.grandTotal) }}</td>
                 </tr>
                 {% endfor %}
             </table>
+            {% if next_cursor %}
+            <div class="p-4 text-center border-t"><a href="{{ url_for('history', cursor=next_cursor) }}" class="text-sm font-semibold text-amber-600">Older bills &rarr;</a></div>
+            {% endif %}
             {% else %}
             <div class="p-12 text-center">No bills found</div>
             {% endif %}
@@ -419,55 +448,71 @@ HISTORY_HTML = """
 </html>
 """
 
+# The pages above are compiled once, with bytecode cached under DATA_DIR.
+template_registry.install(app, strings={
+    'index.html': INDEX_HTML,
+    'settings.html': SETTINGS_HTML,
+    'create.html': CREATE_HTML,
+    'history.html': HISTORY_HTML,
+}, cache_dir=os.path.join(DATA_DIR, 'jinja-cache'))
+
 @app.route('/')
 def index():
-    data = load_data()
-    return render_template_string(INDEX_HTML, business=data['business'], bills=data['bills'])
+    business = cache.get_business()
+    with cache.lock:
+        stats = {'count': dashboard_stats.count, 'revenue': dashboard_stats.revenue}
+    return render_template('index.html', business=business, stats=stats)
 
 @app.route('/settings', methods=['GET', 'POST'])
 def settings():
-    data = load_data()
+    current = cache.get_business()
     if request.method == 'POST':
         business = {
             "shopName": request.form.get('shopName'),
             "shopAddress": request.form.get('shopAddress'),
-            "logo": data['business'].get('logo', '')
+            "logo": current.get('logo', '')
         }
         logo = request.files.get('logo')
         if logo and allowed_file(logo.filename):
-            filename = secure_filename(logo.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            logo.save(filepath)
-            business['logo'] = '/static/uploads/' + filename
-        data['business'] = business
-        save_data(data)
+            try:
+                business['logo'] = '/static/uploads/' + uploads.save(logo.stream)
+            except ValueError:
+                pass
+        store.set_business(business)
         return redirect(url_for('index'))
-    return render_template_string(SETTINGS_HTML, business=data['business'])
+    return render_template('settings.html', business=current)
 
 @app.route('/create', methods=['GET', 'POST'])
 def create():
-    data = load_data()
     if request.method == 'POST':
         bill_data = request.json
         bill_data['id'] = str(uuid.uuid4())
-        data['bills'].append(bill_data)
-        save_data(data)
+        business = cache.get_business()
+        bill_data['billNumber'] = bill_numbers.allocate(business.get('billPrefix') or DEFAULT_PREFIX,
+                                                        datetime.now().year)[0]
+        store.append_bill(bill_data)
         return jsonify({'success': True})
-    return render_template_string(CREATE_HTML, business=data['business'])
+    return render_template('create.html', business=cache.get_business())
 
 @app.route('/history')
 def history():
-    data = load_data()
-    return render_template_string(HISTORY_HTML, bills=data['bills'])
+    with cache.lock:
+        cache.sync()
+        try:
+            keys, next_cursor = history_index.page(cursor=request.args.get('cursor'), keys=True)
+        except ValueError:
+            abort(400)
+        bills = [cache.get_bill(bill_id, created[:7]) for created, bill_id in keys]
+    return render_template('history.html', bills=[bill for bill in bills if bill], next_cursor=next_cursor)
 
 @app.route('/api/upload-signature', methods=['POST'])
 def upload_signature():
     file = request.files.get('signature')
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        return jsonify({'filepath': '/static/uploads/' + filename})
+        try:
+            return jsonify({'filepath': '/static/uploads/' + uploads.save(file.stream)})
+        except ValueError:
+            pass
     return jsonify({'error': 'Invalid file'}), 400
 
 if __name__ == '__main__':
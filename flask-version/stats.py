@@ -0,0 +1,139 @@
+"""Running dashboard aggregates.
+
+BillStats subscribes to the store cache and folds each new bill into the
+totals in O(1): bill count, revenue, and per-day, per-month and
+per-customer counts and revenue. Amounts are accumulated in integer paise
+so the running sums never drift from a fresh recomputation.
+
+Sealed months of the log store carry their totals in a ``stats`` segment
+section, written by ``pack_segment()``, so they are added without reading
+a bill.
+"""
+import heapq
+import json
+import re
+
+from records import id_key
+from segments import bill_month
+
+
+def _paise(value):
+    try:
+        return int(round(float(value or 0) * 100))
+    except (TypeError, ValueError):
+        return 0
+
+
+def customer_key(bill):
+    digits = re.sub(r'\D', '', bill.get('customerPhone') or '')
+    return digits or (bill.get('customerName') or '').strip().lower()
+
+
+class BillStats:
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.count = 0
+        self.revenue_paise = 0
+        self.by_day = {}
+        self.by_month = {}
+        self.by_customer = {}
+        self._contributions = {}
+        self._archive = None
+
+    def add_archive(self, archive):
+        self._archive = archive
+        for month in archive.months():
+            segment = archive.segment(month)
+            section = segment.section('stats')
+            if section is None:
+                for bill in segment.iter_bills():
+                    self._apply(_contribution(bill), 1)
+            else:
+                self._merge(json.loads(bytes(section)))
+
+    def add(self, bill):
+        bill_id = bill.get('id')
+        previous = self._contributions.pop(bill_id, None)
+        if previous is None and self._archive is not None:
+            previous = self._sealed(bill)
+        if previous is not None:
+            self._apply(previous, -1)
+        contribution = _contribution(bill)
+        self._contributions[bill_id] = contribution
+        self._apply(contribution, 1)
+
+    def _sealed(self, bill):
+        """Contribution of the sealed copy of ``bill``, if its month has one."""
+        segment = self._archive.segment(bill_month(bill))
+        doc = None if segment is None else segment.find(id_key(bill.get('id')))
+        return None if doc is None else _contribution(segment.read(doc))
+
+    def _merge(self, totals):
+        self.count += totals['count']
+        self.revenue_paise += totals['revenuePaise']
+        for table, name in ((self.by_day, 'byDay'), (self.by_month, 'byMonth'),
+                            (self.by_customer, 'byCustomer')):
+            for key, (count, paise) in totals[name].items():
+                entry = table.setdefault(key, [0, 0])
+                entry[0] += count
+                entry[1] += paise
+                if entry[0] == 0:
+                    del table[key]
+
+    def _apply(self, contribution, sign):
+        day, month, customer, paise = contribution
+        self.count += sign
+        self.revenue_paise += sign * paise
+        for table, key in ((self.by_day, day), (self.by_month, month), (self.by_customer, customer)):
+            entry = table.setdefault(key, [0, 0])
+            entry[0] += sign
+            entry[1] += sign * paise
+            if entry[0] == 0:
+                del table[key]
+
+    @property
+    def revenue(self):
+        return self.revenue_paise / 100
+
+    def snapshot(self, days=30, top_customers=0):
+        def rows(table, keys):
+            return [{'key': key, 'count': table[key][0], 'revenue': table[key][1] / 100} for key in keys]
+
+        result = {
+            'count': self.count,
+            'revenue': self.revenue,
+            'days': rows(self.by_day, sorted(self.by_day)[-days:] if days else []),
+            'months': rows(self.by_month, sorted(self.by_month)),
+        }
+        if top_customers:
+            top = heapq.nlargest(top_customers, self.by_customer, key=lambda k: self.by_customer[k][1])
+            result['customers'] = rows(self.by_customer, top)
+        return result
+
+    def totals(self):
+        """Everything needed to compare two BillStats for equality."""
+        return (self.count, self.revenue_paise, self.by_day, self.by_month, self.by_customer)
+
+
+def _contribution(bill):
+    day = (bill.get('createdAt') or bill.get('billDate') or '')[:10]
+    return (day, day[:7], customer_key(bill), _paise(bill.get('grandTotal')))
+
+
+def rebuild(bills):
+    stats = BillStats()
+    for bill in bills:
+        stats.add(bill)
+    return stats
+
+
+def pack_segment(bills):
+    """The ``stats`` section of a sealed segment holding ``bills``."""
+    stats = BillStats()
+    for bill in bills:
+        stats._apply(_contribution(bill), 1)
+    return json.dumps({'count': stats.count, 'revenuePaise': stats.revenue_paise, 'byDay': stats.by_day,
+                       'byMonth': stats.by_month, 'byCustomer': stats.by_customer},
+                      separators=(',', ':')).encode('utf-8')
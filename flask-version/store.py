@@ -0,0 +1,584 @@
+"""Append-only bill storage.
+
+Bills live in ``bills.log`` as one checksummed record per line, JSON or
+packed (see records.py). A fixed-width ``bills.idx`` maps each bill id to
+the offset and length of its latest record, so adding or fetching a single
+bill never touches the rest of the log. Business settings are kept on their own in ``business.json``.
+
+Writers from any number of threads and processes serialise on an flock'd
+``LOCK`` file and fsync before returning; whole-file rewrites go through a
+temp file and an atomic rename, so readers never see a half-written file.
+
+Bills are partitioned by the month they were created in. The log holds the
+current month; ``seal()`` moves earlier months into compressed, read-only
+segments under ``segments/`` (see segments.py), so opening the store only
+indexes the hot month and older months are decoded when something reads
+them. A bill written again after its month was sealed goes to the log and
+shadows its sealed copy until the next seal folds it back in.
+"""
+from array import array
+import json
+import os
+import struct
+import threading
+import time
+
+from records import CODECS, decode_record, encode_record, id_key
+from segments import UNDATED, Segment, bill_month, month_code, write_segment
+from writer import FileLock, GroupCommit, atomic_write, atomic_write_json, fsync_dir
+
+INDEX_HEADER = struct.Struct('<8sQ')
+INDEX_MAGIC = b'BILLIDX2'
+# Bill key, offset and length of its record, month_code() of the bill.
+INDEX_RECORD = struct.Struct('<16sQII')
+COMPACT_MIN_BYTES = 1024 * 1024
+
+
+def _overlaps(month, date_from, date_to):
+    if month == UNDATED:
+        return True
+    return (date_from is None or month >= date_from[:7]) and (date_to is None or month <= date_to[:7])
+
+
+class LogStore:
+    def __init__(self, directory, legacy_file=None, compact_ratio=0.5, sections=None, codec='json'):
+        self.directory = directory
+        self.log_path = os.path.join(directory, 'bills.log')
+        self.index_path = os.path.join(directory, 'bills.idx')
+        self.business_path = os.path.join(directory, 'business.json')
+        self.segment_dir = os.path.join(directory, 'segments')
+        self.compact_ratio = compact_ratio
+        # Extra sections written into every segment, as {name: build(bills)}.
+        self.sections = dict(sections or {})
+        # Codec new records are written with; records.py reads them all.
+        if codec not in CODECS:
+            raise ValueError('unknown record codec %r' % codec)
+        self.codec = codec
+        # Bytes of log and index read and written by this process, and the
+        # time spent in commits; reported by /metrics.
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.commits = 0
+        self.commit_seconds = 0.0
+        self.seals = 0
+        os.makedirs(directory, exist_ok=True)
+        self._segments = {}
+        self._lock = FileLock(os.path.join(directory, 'LOCK'))
+        self._mutex = threading.RLock()
+        self._committer = GroupCommit(self._commit)
+        with self._lock:
+            if not os.path.exists(self.log_path):
+                if legacy_file and os.path.exists(legacy_file):
+                    self._import_legacy(legacy_file)
+                else:
+                    open(self.log_path, 'ab').close()
+            self._open()
+            self._repair()
+            self.maybe_seal()
+
+    # -- index ---------------------------------------------------------
+    #
+    # Readers never write: they index new log records in memory only.
+    # Whoever holds the file lock truncates a torn tail and brings
+    # bills.idx (whose header records how much of the log it covers) up
+    # to date before appending.
+
+    def _reset(self):
+        self._keys = []
+        self._offsets = array('Q')
+        self._lengths = array('I')
+        self._months = array('I')
+        self._positions = {}
+        # Hot bills per month_code(), and keys of hot bills that shadow a
+        # sealed copy.
+        self._month_counts = {}
+        self._shadowing = set()
+        self._end = 0
+        self._log_id = None
+        self._index_stale = False
+
+    def _open(self):
+        self._load_segments()
+        self._reset()
+        self._log_id = self._stat_id()
+        log_size = os.path.getsize(self.log_path)
+        raw = b''
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as f:
+                raw = f.read()
+        self.bytes_read += len(raw)
+        covered = 0
+        if len(raw) >= INDEX_HEADER.size:
+            magic, covered = INDEX_HEADER.unpack_from(raw)
+            if magic != INDEX_MAGIC or covered > log_size:
+                covered = 0
+        if covered:
+            body = raw[INDEX_HEADER.size:]
+            body = body[:len(body) - len(body) % INDEX_RECORD.size]
+            for key, offset, length, month in INDEX_RECORD.iter_unpack(body):
+                if offset + length > covered:
+                    break
+                self._track(key, offset, length, month)
+            if not self._check_last():
+                self._reset()
+                self._log_id = self._stat_id()
+                covered = 0
+        self._index_stale = covered == 0
+        self._end = covered
+        self._scan()
+
+    def _check_last(self):
+        if not self._keys:
+            return True
+        with open(self.log_path, 'rb') as f:
+            bill = self._read(f, self._offsets, self._lengths, len(self._keys) - 1)
+        return bill is not None and id_key(bill.get('id')) == self._keys[-1]
+
+    def _stat_id(self):
+        st = os.stat(self.log_path)
+        return (st.st_dev, st.st_ino)
+
+    def _track(self, key, offset, length, month):
+        position = self._positions.get(key)
+        if position is None:
+            position = len(self._keys)
+            self._positions[key] = position
+            self._keys.append(key)
+            self._offsets.append(offset)
+            self._lengths.append(length)
+            self._months.append(month)
+        else:
+            self._offsets[position] = offset
+            self._lengths[position] = length
+            old = self._months[position]
+            self._month_counts[old] -= 1
+            if not self._month_counts[old]:
+                del self._month_counts[old]
+            self._months[position] = month
+        self._month_counts[month] = self._month_counts.get(month, 0) + 1
+        segment = self._segments.get(month)
+        if segment is not None and segment.find(key) is not None:
+            self._shadowing.add(key)
+        else:
+            self._shadowing.discard(key)
+        return position
+
+    def _scan(self, repair=False):
+        """Index in memory any complete records past ``self._end``.
+
+        A torn final record (crash mid-append) is truncated away when
+        ``repair`` is set, which callers only do while holding the lock.
+        """
+        with open(self.log_path, 'rb') as f:
+            f.seek(self._end)
+            tail = f.read()
+        self.bytes_read += len(tail)
+        for line in tail.splitlines(keepends=True):
+            bill = decode_record(line)
+            if bill is None:
+                if repair:
+                    with open(self.log_path, 'r+b') as f:
+                        f.truncate(self._end)
+                        os.fsync(f.fileno())
+                break
+            self._track(id_key(bill.get('id')), self._end, len(line), month_code(bill_month(bill)))
+            self._end += len(line)
+
+    def _repair(self):
+        if self._stat_id() != self._log_id:
+            self._open()
+        self._scan(repair=True)
+        if self._index_stale:
+            self._rewrite_index()
+            return
+        with open(self.index_path, 'rb') as f:
+            _, covered = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+        if covered < self._end:
+            keys = set()
+            with open(self.log_path, 'rb') as f:
+                f.seek(covered)
+                for line in f.read(self._end - covered).splitlines():
+                    keys.add(id_key(decode_record(line + b'\n').get('id')))
+            self._persist(sorted(self._positions[key] for key in keys))
+
+    def _rewrite_index(self):
+        body = b''.join(INDEX_RECORD.pack(*entry) for entry
+                        in zip(self._keys, self._offsets, self._lengths, self._months))
+        atomic_write(self.index_path, INDEX_HEADER.pack(INDEX_MAGIC, self._end) + body)
+        self._index_stale = False
+
+    def _persist(self, positions):
+        """Write index entries at ``positions`` and advance the header."""
+        with open(self.index_path, 'r+b') as f:
+            known = (f.seek(0, os.SEEK_END) - INDEX_HEADER.size) // INDEX_RECORD.size
+            appended = bytearray()
+            for position in positions:
+                packed = INDEX_RECORD.pack(self._keys[position], self._offsets[position],
+                                           self._lengths[position], self._months[position])
+                if position >= known:
+                    appended += packed
+                else:
+                    f.seek(INDEX_HEADER.size + position * INDEX_RECORD.size)
+                    f.write(packed)
+            if appended:
+                f.seek(INDEX_HEADER.size + known * INDEX_RECORD.size)
+                f.write(appended)
+            f.seek(0)
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, self._end))
+        self.bytes_written += INDEX_HEADER.size + len(positions) * INDEX_RECORD.size
+
+    def refresh(self):
+        """Pick up records appended or compacted by another process."""
+        with self._mutex:
+            if self._stat_id() != self._log_id:
+                self._open()
+            elif os.path.getsize(self.log_path) > self._end:
+                self._scan()
+
+    def stamp(self):
+        """Cheap token that changes whenever any process writes the store."""
+        log = os.stat(self.log_path)
+        try:
+            business = os.stat(self.business_path)
+            business = (business.st_ino, business.st_mtime_ns, business.st_size)
+        except FileNotFoundError:
+            business = None
+        return (log.st_ino, log.st_size, log.st_mtime_ns, business)
+
+    def modified(self):
+        """When any process last wrote the store, in seconds since the epoch."""
+        modified = os.stat(self.log_path).st_mtime
+        try:
+            return max(modified, os.stat(self.business_path).st_mtime)
+        except FileNotFoundError:
+            return modified
+
+    def changes_since(self, cursor):
+        """Return ``(cursor, bills)`` written after ``cursor``.
+
+        ``bills`` is None when the log was rewritten since ``cursor`` (or
+        ``cursor`` is None) and the caller has to reload everything.
+        """
+        self.refresh()
+        with self._mutex:
+            current = (self._log_id, self._end)
+            if cursor is None or cursor[0] != self._log_id or cursor[1] > self._end:
+                return current, None
+            with open(self.log_path, 'rb') as f:
+                f.seek(cursor[1])
+                tail = f.read(self._end - cursor[1])
+            self.bytes_read += len(tail)
+        return current, [decode_record(line) for line in tail.splitlines(keepends=True)]
+
+    # -- bills ---------------------------------------------------------
+
+    def count(self):
+        sealed = sum(len(segment) for segment in self._segments.values())
+        return len(self._keys) + sealed - len(self._shadowing)
+
+    def dead_bytes(self):
+        return self._end - self.hot_bytes()
+
+    def hot_bytes(self):
+        return sum(self._lengths)
+
+    def data_bytes(self):
+        return self.hot_bytes() + sum(segment.size for segment in self._segments.values())
+
+    @staticmethod
+    def _read(f, offsets, lengths, position):
+        f.seek(offsets[position])
+        return decode_record(f.read(lengths[position]))
+
+    def iter_hot(self):
+        """Bills in the log, in the order they were first written."""
+        with self._mutex:
+            f = open(self.log_path, 'rb')
+            offsets, lengths, count = self._offsets, self._lengths, len(self._keys)
+        with f:
+            for position in range(count):
+                self.bytes_read += lengths[position]
+                yield self._read(f, offsets, lengths, position)
+
+    def iter_bills(self, date_from=None, date_to=None):
+        """Every bill: sealed months oldest first, then the log.
+
+        ``date_from``/``date_to`` (inclusive ISO dates) skip sealed months
+        that lie wholly outside them; callers still filter by date.
+        """
+        with self._mutex:
+            segments = [segment for segment in self._segments.values()
+                        if _overlaps(segment.month, date_from, date_to)]
+        for segment in segments:
+            yield from self._unshadowed(segment)
+        yield from self.iter_hot()
+
+    def _unshadowed(self, segment):
+        with self._mutex:
+            shadowing = set(self._shadowing)
+        for bill in segment.iter_bills():
+            if not shadowing or id_key(bill.get('id')) not in shadowing:
+                yield bill
+
+    def get_bill(self, bill_id, month=None):
+        """The bill with ``bill_id``, or None; ``month``, if known, is looked in first."""
+        key = id_key(bill_id)
+        with self._mutex:
+            position = self._positions.get(key)
+            if position is not None:
+                self.bytes_read += self._lengths[position]
+                with open(self.log_path, 'rb') as f:
+                    return self._read(f, self._offsets, self._lengths, position)
+            segments = list(self._segments.values())
+        hinted = self.segment(month) if month else None
+        if hinted is not None:
+            segments.remove(hinted)
+            segments.append(hinted)
+        # Newest first: reads are mostly for recent bills.
+        for segment in reversed(segments):
+            doc = segment.find(key)
+            if doc is not None:
+                return segment.read(doc)
+        return None
+
+    def append_bill(self, bill):
+        self.append_bills([bill])
+
+    def append_bills(self, bills):
+        """Append ``bills``; a bill whose id already exists supersedes it.
+
+        Concurrent callers are group-committed: one locked, fsynced write
+        covers every bill queued while the previous write was in flight.
+        """
+        if bills:
+            self._committer.submit(bills)
+
+    def _commit(self, bills):
+        started = time.perf_counter()
+        records = [encode_record(bill, self.codec) for bill in bills]
+        with self._lock, self._mutex:
+            self._repair()
+            data = b''.join(records)
+            with open(self.log_path, 'ab') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self.bytes_written += len(data)
+            positions = []
+            for bill, record in zip(bills, records):
+                positions.append(self._track(id_key(bill.get('id')), self._end, len(record),
+                                             month_code(bill_month(bill))))
+                self._end += len(record)
+            self._persist(sorted(set(positions)))
+            self.maybe_compact()
+            self.commits += 1
+            self.commit_seconds += time.perf_counter() - started
+
+    def maybe_compact(self):
+        dead = self.dead_bytes()
+        if self._end >= COMPACT_MIN_BYTES and dead > self._end * self.compact_ratio:
+            self.compact()
+
+    def compact(self, bills=None):
+        """Rewrite the log with only live records, or the whole store with ``bills``."""
+        with self._lock, self._mutex:
+            self._repair()
+            if bills is None:
+                self._rewrite(list(self.iter_hot()))
+                return
+            # Every bill goes to the log first, so the segments removed
+            # next are shadowed until they are gone; then reseal.
+            self._rewrite(bills)
+            for segment in self._segments.values():
+                os.remove(segment.path)
+            if self._segments:
+                fsync_dir(self.segment_dir)
+                self._open()
+            self.maybe_seal()
+
+    def _rewrite(self, bills):
+        log_tmp = '%s.%d.tmp' % (self.log_path, os.getpid())
+        index_tmp = '%s.%d.tmp' % (self.index_path, os.getpid())
+        seen = set()
+        with open(log_tmp, 'wb') as log, open(index_tmp, 'wb') as index:
+            index.write(INDEX_HEADER.pack(INDEX_MAGIC, 0))
+            offset = 0
+            for bill in bills:
+                record = encode_record(bill, self.codec)
+                key = id_key(bill.get('id'))
+                if key in seen:
+                    raise ValueError('duplicate bill id %r' % bill.get('id'))
+                seen.add(key)
+                log.write(record)
+                index.write(INDEX_RECORD.pack(key, offset, len(record), month_code(bill_month(bill))))
+                offset += len(record)
+            index.seek(0)
+            index.write(INDEX_HEADER.pack(INDEX_MAGIC, offset))
+            self.bytes_written += offset + INDEX_HEADER.size + len(seen) * INDEX_RECORD.size
+            for f in (log, index):
+                f.flush()
+                os.fsync(f.fileno())
+        # A crash between the two renames leaves an index that fails
+        # _check_last() against the new log, so it is rebuilt on open.
+        os.replace(log_tmp, self.log_path)
+        os.replace(index_tmp, self.index_path)
+        fsync_dir(self.directory)
+        self._open()
+
+    # -- sealed months -------------------------------------------------
+    #
+    # Segments are only ever replaced under the file lock and before the
+    # log is rewritten, and readers reload them whenever the log changes
+    # inode, so a reader sees either the old or the new month layout.
+
+    def _load_segments(self):
+        segments = {}
+        names = os.listdir(self.segment_dir) if os.path.isdir(self.segment_dir) else []
+        for name in names:
+            if not name.endswith('.seg'):
+                continue
+            path = os.path.join(self.segment_dir, name)
+            code = month_code(name[:-4])
+            try:
+                st = os.stat(path)
+                old = self._segments.get(code)
+                if old is not None and old.file_id == (st.st_dev, st.st_ino):
+                    segments[code] = old
+                else:
+                    segments[code] = Segment(path)
+            except FileNotFoundError:
+                continue
+        self._segments = dict(sorted(segments.items()))
+
+    def months(self):
+        """Sealed months, oldest first (UNDATED before the rest)."""
+        return [segment.month for segment in self._segments.values()]
+
+    def segment(self, month):
+        return self._segments.get(month_code(month))
+
+    def iter_month(self, month):
+        """Bills of sealed ``month`` not shadowed by the log, by ``(createdAt, id)``."""
+        segment = self.segment(month)
+        return iter(()) if segment is None else self._unshadowed(segment)
+
+    def shadowed_docs(self, month):
+        """Docs of sealed ``month`` whose bill was written again since."""
+        segment = self.segment(month)
+        with self._mutex:
+            keys = list(self._shadowing)
+        docs = (segment.find(key) for key in keys) if segment is not None else ()
+        return {doc for doc in docs if doc is not None}
+
+    def needs_seal(self, month=None):
+        """Whether the log holds bills from before ``month`` (default: this month)."""
+        counts = self._month_counts
+        return bool(counts) and min(counts) < month_code(month or time.strftime('%Y-%m'))
+
+    def maybe_seal(self):
+        if self.needs_seal():
+            self.seal()
+
+    def seal(self, month=None):
+        """Move bills created before ``month`` from the log into segments.
+
+        ``month`` defaults to the current one. A month that already has a
+        segment gets it rewritten with the bills that were added or written
+        again. Returns the months sealed.
+        """
+        before = month_code(month or time.strftime('%Y-%m'))
+        with self._lock, self._mutex:
+            self._repair()
+            sealing, kept = {}, []
+            for bill in self.iter_hot():
+                name = bill_month(bill)
+                if month_code(name) < before:
+                    sealing.setdefault(name, []).append(bill)
+                else:
+                    kept.append(bill)
+            if not sealing:
+                return []
+            os.makedirs(self.segment_dir, exist_ok=True)
+            for name, bills in sealing.items():
+                segment = self.segment(name)
+                if segment is not None:
+                    fresh = {id_key(bill.get('id')) for bill in bills}
+                    bills = [bill for bill in segment.iter_bills()
+                             if id_key(bill.get('id')) not in fresh] + bills
+                path = os.path.join(self.segment_dir, name + '.seg')
+                write_segment(path, name, bills, self.sections, self.codec)
+                self.bytes_written += os.path.getsize(path)
+            # Until the log is rewritten its copies shadow the new segments.
+            self._rewrite(kept)
+            self.seals += 1
+            return sorted(sealing, key=month_code)
+
+    # -- business ------------------------------------------------------
+
+    def get_business(self):
+        if not os.path.exists(self.business_path):
+            return {}
+        with open(self.business_path, 'r') as f:
+            return json.load(f)
+
+    def set_business(self, business):
+        with self._lock:
+            atomic_write_json(self.business_path, business)
+
+    # -- load_data / save_data contract --------------------------------
+
+    def load(self):
+        self.refresh()
+        return {"business": self.get_business(), "bills": list(self.iter_bills())}
+
+    def save(self, data):
+        """Persist ``data``, appending when only new bills were added.
+
+        Existing bills are treated as immutable here; a changed or removed
+        bill triggers a full rewrite.
+        """
+        with self._lock, self._mutex:
+            business = data.get('business', {})
+            if business != self.get_business():
+                self.set_business(business)
+            self._repair()
+            bills = data.get('bills', [])
+            known = self.count()
+            if len(bills) >= known and all(
+                    id_key(bill.get('id')) == key for bill, key in zip(bills, self._iter_keys())):
+                if len(bills) > known:
+                    self._commit(bills[known:])
+            else:
+                self.compact(bills)
+
+    def _iter_keys(self):
+        """Keys of the bills in the order iter_bills() yields them."""
+        for segment in self._segments.values():
+            for doc in range(len(segment)):
+                key = id_key(segment.bill_id(doc))
+                if key not in self._shadowing:
+                    yield key
+        yield from self._keys
+
+    def _import_legacy(self, legacy_file):
+        with open(legacy_file, 'r') as f:
+            data = json.load(f)
+        atomic_write_json(self.business_path, data.get('business', {}))
+        open(self.log_path, 'ab').close()
+        self._open()
+        self.compact(data.get('bills', []))
+
+
+def open_store(backend, directory, legacy_file=None, sections=None, codec='json'):
+    """Return the bill store selected by ``backend`` ('log' or 'sqlite').
+
+    ``sections`` are the extra sections the log store writes into sealed
+    segments and ``codec`` the format of its records ('json' or 'packed');
+    SQLite has no segments, keeps bills in columns and ignores both.
+    """
+    if backend == 'sqlite':
+        from sqlite_store import SQLiteStore
+        return SQLiteStore(os.path.join(directory, 'bills.db'), legacy_file=legacy_file)
+    if backend == 'log':
+        return LogStore(directory, legacy_file=legacy_file, sections=sections, codec=codec)
+    raise ValueError('unknown store backend %r' % backend)
@@ -0,0 +1,38 @@
+"""One Jinja loader for app.py and standalone_app.py.
+
+``install()`` gives a Flask app a loader that serves templates embedded as
+strings (standalone_app.py's pages) ahead of the files in its template
+folder. Templates are then compiled once and kept in the environment's
+cache instead of being compiled again on every ``render_template_string``
+call. Compiled bytecode is also written to ``cache_dir``, so a cold worker
+skips the parse and compile steps as well.
+"""
+import os
+
+from jinja2 import ChoiceLoader, DictLoader, FileSystemBytecodeCache
+
+
+def install(app, strings=None, cache_dir=None, precompile=True):
+    """Configure ``app``'s Jinja environment.
+
+    ``strings`` maps template names to source and shadows template files of
+    the same name.
+    """
+    env = app.jinja_env
+    env.loader = ChoiceLoader([DictLoader(dict(strings or {})), app.create_global_jinja_loader()])
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    if env.cache is not None:
+        env.cache.clear()
+    if precompile:
+        compile_all(env)
+    return env
+
+
+def compile_all(env):
+    """Load every template so that none is compiled on a request."""
+    names = env.list_templates(filter_func=lambda name: name.endswith('.html'))
+    for name in names:
+        env.get_template(name)
+    return names
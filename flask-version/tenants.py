@@ -0,0 +1,236 @@
+"""Businesses (tenants) served by one deployment, each from its own shard.
+
+A request names its tenant either with a URL prefix (``/t/<tenant>/...``)
+or with a subdomain of ``domain`` (``<tenant>.bills.example.com``); a
+request that names none is served by the default shard, the single business
+of a deployment that predates tenants.
+
+The shard map says where a tenant's shard lives. It is a JSON file::
+
+    {"roots": ["/srv/bills-a", "/srv/bills-b"],
+     "tenants": {"acme": "/srv/bills-b", "globex": "https://node2.example.com/t/globex"}}
+
+A tenant mapped to a directory is kept there; one mapped to a URL lives on
+another node, and its requests are redirected there. Tenants that are not
+listed live in ``<root>/<tenant>`` of whichever root holds their directory.
+New tenants are placed on a root by rendezvous hashing, so adding a root
+moves no existing tenant. The file is read again when it changes.
+
+Shards are opened on a tenant's first request and the least recently used
+idle ones are closed beyond ``max_open``. Each tenant may have at most
+``max_active`` requests in flight per process, so a busy shop cannot take
+every thread of a worker from the quiet ones; the default shard, which
+has a worker to itself unless tenants are in use, has no such limit.
+"""
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import re
+import threading
+
+from werkzeug.exceptions import NotFound
+
+DEFAULT_TENANT = ''
+NAME_RE = re.compile(r'^[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?$')
+
+
+def is_tenant(name):
+    return bool(name and NAME_RE.match(name))
+
+
+def is_remote(location):
+    return location.startswith(('http://', 'https://'))
+
+
+class ShardMap:
+    def __init__(self, path=None, roots=()):
+        self.path = path
+        self._default_roots = [os.path.abspath(root) for root in roots]
+        self._stamp = None
+        self.roots = list(self._default_roots)
+        self.tenants = {}
+        self._lock = threading.Lock()
+
+    def _reload(self):
+        if not self.path:
+            return
+        try:
+            st = os.stat(self.path)
+            stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            stamp = None
+        with self._lock:
+            if stamp == self._stamp:
+                return
+            data = {}
+            if stamp is not None:
+                with open(self.path) as f:
+                    data = json.load(f)
+            self.roots = [os.path.abspath(root) for root in data.get('roots', ())] or list(self._default_roots)
+            self.tenants = dict(data.get('tenants', {}))
+            self._stamp = stamp
+
+    def place(self, name):
+        """Root directory a new tenant ``name`` goes to."""
+        self._reload()
+        if not self.roots:
+            raise LookupError('the shard map has no roots')
+        return max(self.roots, key=lambda root: hashlib.md5(
+            ('%s\0%s' % (root, name)).encode('utf-8')).digest())
+
+    def locate(self, name):
+        """Directory or base URL of tenant ``name``'s shard, or None if there is none."""
+        self._reload()
+        location = self.tenants.get(name)
+        if location:
+            return location if is_remote(location) else os.path.abspath(location)
+        for root in self.roots:
+            directory = os.path.join(root, name)
+            if os.path.isdir(directory):
+                return directory
+        return None
+
+    def create(self, name):
+        """Make the directory of new local tenant ``name``; return it."""
+        if not is_tenant(name):
+            raise ValueError('invalid tenant name %r' % name)
+        directory = self.locate(name)
+        if directory is None:
+            directory = os.path.join(self.place(name), name)
+        elif is_remote(directory):
+            raise ValueError('tenant %s lives on %s' % (name, directory))
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+
+class TenantMiddleware:
+    """WSGI middleware putting the request's tenant in ``environ['bills.tenant']``.
+
+    A ``/t/<tenant>`` prefix is moved from PATH_INFO to SCRIPT_NAME, so the
+    app routes as usual and ``url_for`` keeps the prefix. A prefix or
+    subdomain that is not a valid tenant name is a 404.
+    """
+
+    def __init__(self, app, prefix='/t/', domain=None):
+        self.app = app
+        self.prefix = prefix
+        self.domain = domain.lower().lstrip('.') if domain else None
+
+    def __call__(self, environ, start_response):
+        tenant = DEFAULT_TENANT
+        path = environ.get('PATH_INFO', '')
+        if self.prefix and path.startswith(self.prefix):
+            tenant, _, rest = path[len(self.prefix):].partition('/')
+            if not is_tenant(tenant):
+                return NotFound()(environ, start_response)
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + self.prefix + tenant
+            environ['PATH_INFO'] = '/' + rest
+        elif self.domain:
+            host = environ.get('HTTP_HOST', '').rsplit(':', 1)[0].lower()
+            if host.endswith('.' + self.domain):
+                tenant = host[:-len(self.domain) - 1]
+                if not is_tenant(tenant):
+                    return NotFound()(environ, start_response)
+        environ['bills.tenant'] = tenant
+        return self.app(environ, start_response)
+
+
+class Busy(Exception):
+    """The tenant already has ``max_active`` requests in flight here."""
+
+
+class ShardPool:
+    def __init__(self, open_shard, max_open=32, max_active=8):
+        # open_shard(name) returns the shard, which may have a close() method.
+        self.open_shard = open_shard
+        self.max_open = max_open
+        self.max_active = max_active
+        self.opened = 0
+        self.rejected = 0
+        self._shards = OrderedDict()
+        self._active = {}
+        self._lock = threading.Lock()
+        self._opening = {}
+
+    def get(self, name):
+        """The shard of tenant ``name``, opening it if need be.
+
+        The shard may be closed once it is idle; callers that keep using it
+        hold it with ``acquire()`` instead.
+        """
+        return self._take(name, hold=False, limited=False)
+
+    def acquire(self, name, limited=True):
+        """Count a request for ``name`` as in flight and return its shard.
+
+        A shard in flight is never evicted. Raises Busy when the tenant is
+        at ``max_active``, unless ``limited`` is false.
+        """
+        return self._take(name, hold=True, limited=limited)
+
+    def _take(self, name, hold, limited):
+        with self._lock:
+            shard = self._found(name, hold, limited)
+            if shard is not None:
+                return shard
+            opening = self._opening.setdefault(name, threading.Lock())
+        # Opening reads the shard's files; other tenants don't wait for it.
+        with opening:
+            with self._lock:
+                shard = self._found(name, hold, limited)
+            if shard is not None:
+                return shard
+            shard = self.open_shard(name)
+            closed = []
+            try:
+                with self._lock:
+                    self._shards[name] = shard
+                    self.opened += 1
+                    closed = self._evict(name)
+                    if hold:
+                        self._hold(name, limited)
+            finally:
+                for old in closed:
+                    if hasattr(old, 'close'):
+                        old.close()
+        return shard
+
+    def _found(self, name, hold, limited):
+        # Called with the lock held, so the shard cannot be evicted before
+        # it is counted in flight.
+        shard = self._shards.get(name)
+        if shard is not None:
+            self._shards.move_to_end(name)
+            if hold:
+                self._hold(name, limited)
+        return shard
+
+    def _evict(self, keep):
+        closed = []
+        for name in list(self._shards):
+            if len(self._shards) <= self.max_open:
+                break
+            if name != keep and not self._active.get(name):
+                closed.append(self._shards.pop(name))
+        return closed
+
+    def _hold(self, name, limited):
+        active = self._active.get(name, 0)
+        if limited and active >= self.max_active:
+            self.rejected += 1
+            raise Busy(name)
+        self._active[name] = active + 1
+
+    def release(self, name):
+        with self._lock:
+            active = self._active.get(name, 0) - 1
+            if active > 0:
+                self._active[name] = active
+            else:
+                self._active.pop(name, None)
+
+    def shards(self):
+        """The shards open now."""
+        with self._lock:
+            return list(self._shards.values())
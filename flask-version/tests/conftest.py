@@ -0,0 +1,83 @@
+"""Fixtures shared by the tests.
+
+app.py keeps its data under ``flask-version/`` of the working directory, so
+it is imported from a scratch directory; each test that uses ``app_module``
+then gets its shards, uploads and tenants under its own ``tmp_path``.
+"""
+import datetime
+import os
+import sys
+import uuid
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def make_bill():
+    """Return a function making a bill with one item, created at ``created``."""
+    def make(number=1, created=None, **fields):
+        created = created or datetime.datetime.now().replace(microsecond=0)
+        if isinstance(created, datetime.datetime):
+            created = created.isoformat()
+        bill = {
+            'id': str(uuid.uuid4()),
+            'billNumber': 'BILL-%06d' % number,
+            'customerName': 'Customer %d' % (number % 7),
+            'customerPhone': '98765%05d' % (number % 7),
+            'items': [{'description': 'Item %d' % number, 'quantity': 2, 'price': 10.5, 'total': 21.0}],
+            'subtotal': 21.0,
+            'taxRate': 18,
+            'taxAmount': 3.78,
+            'discount': 0,
+            'grandTotal': 24.78 + number,
+            'billDate': created[:10],
+            'createdAt': created,
+            'signature': '',
+        }
+        bill.update(fields)
+        return bill
+    return make
+
+
+@pytest.fixture(scope='session')
+def _app_session(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp('app')
+    os.makedirs(workdir / 'flask-version')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import app
+    except BaseException:
+        os.chdir(cwd)
+        raise
+    # Jobs stay queued; no worker threads outlive a test's shards.
+    app.job_queue.start = lambda: None
+    yield app
+    os.chdir(cwd)
+
+
+@pytest.fixture
+def app_module(_app_session, tmp_path, monkeypatch):
+    """app.py with a fresh default shard and tenant root under ``tmp_path``."""
+    app = _app_session
+    data_dir = str(tmp_path / 'data')
+    monkeypatch.setattr(app, 'DATA_DIR', data_dir)
+    monkeypatch.setattr(app, 'DATA_FILE', str(tmp_path / 'data.json'))
+    monkeypatch.setitem(app.app.config, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    monkeypatch.setitem(app.app.config, 'AUDIT_LOG', os.path.join(data_dir, 'audit.log'))
+    monkeypatch.setattr(app, 'shard_map', app.ShardMap(roots=[str(tmp_path / 'tenants')]))
+    pool = app.ShardPool(app.open_shard, max_open=app.app.config['TENANT_MAX_OPEN'],
+                         max_active=app.app.config['TENANT_MAX_ACTIVE'])
+    monkeypatch.setattr(app, 'shards', pool)
+    yield app
+    for shard in pool.shards():
+        shard.close()
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
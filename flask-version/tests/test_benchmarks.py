@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from benchmarks import load, suite, synth
+import stats
+
+
+def test_synthetic_bills_are_reproducible():
+    assert list(synth.make_bills(20, seed=3)) == list(synth.make_bills(20, seed=3))
+    assert list(synth.make_bills(20, seed=3)) != list(synth.make_bills(20, seed=4))
+
+
+def test_build_store_seals_past_months(tmp_path):
+    store = synth.build_store(str(tmp_path), 300)
+    assert store.count() == 300
+    assert store.months()
+    assert not store.needs_seal()
+    assert stats.rebuild(store.iter_bills()).count == 300
+
+
+def test_client_load_drives_every_route(app_module, client, monkeypatch):
+    pool = ThreadPoolExecutor(1)
+    monkeypatch.setattr(app_module, 'thumb_pool', lambda: pool)
+    app_module.shards.get('').store.set_business(synth.BUSINESS)
+    for route in load.ROUTES:
+        samples, errors, elapsed = load.client_load(client, route, 3)
+        assert (len(samples), errors) == (3, 0), route
+        assert elapsed >= sum(samples)
+    pool.shutdown()
+
+
+def test_percentiles_and_compare(capsys):
+    assert load.percentiles([0.001 * n for n in range(1, 101)])['p50_ms'] == pytest.approx(51.0)
+    row = {'size': '1k', 'backend': 'log', 'mode': 'client', 'route': '/', 'p50_ms': 2.0, 'p95_ms': 3.0,
+           'throughput_rps': 100.0}
+    slower = dict(row, p95_ms=3.6)
+    assert suite.compare([slower], {'results': [row]}, 15) == [slower]
+    assert suite.compare([row], {'results': [row]}, 15) == []
+    assert '+20.0%' in capsys.readouterr().out
@@ -0,0 +1,61 @@
+import atexit
+import json
+import threading
+
+from bill_numbers import BillNumbers
+
+
+def test_numbers_are_unique_across_allocators(tmp_path):
+    allocators = [BillNumbers(str(tmp_path), block_size=5) for _ in range(3)]
+    numbers = []
+
+    def allocate(allocator):
+        for _ in range(40):
+            numbers.extend(allocator.allocate('B-', 2026))
+
+    threads = [threading.Thread(target=allocate, args=(allocator,)) for allocator in allocators * 2]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(numbers) == len(set(numbers)) == 240
+    assert all(number.startswith('B-2026-') for number in numbers)
+    for allocator in allocators:
+        allocator.release()
+
+
+def test_a_run_is_contiguous_even_past_the_block(tmp_path):
+    allocator = BillNumbers(str(tmp_path), block_size=4)
+    assert allocator.allocate('B-') == ['B-000001']
+    assert allocator.allocate('B-', count=6) == ['B-%06d' % number for number in range(2, 8)]
+    assert allocator.allocate('B-', count=2) == ['B-000008', 'B-000009']
+    # Other prefixes and years have sequences of their own.
+    assert allocator.allocate('C-', 2025) == ['C-2025-000001']
+    allocator.release()
+
+
+def test_unused_numbers_are_given_back(tmp_path):
+    first = BillNumbers(str(tmp_path), block_size=10)
+    first.allocate('B-', count=3)
+    first.release()
+    assert BillNumbers(str(tmp_path)).allocate('B-') == ['B-000004']
+
+
+def test_numbers_leased_after_a_block_are_not_reused(tmp_path):
+    first = BillNumbers(str(tmp_path), block_size=10)
+    second = BillNumbers(str(tmp_path), block_size=10)
+    first.allocate('B-')
+    second.allocate('B-')
+    first.release()
+    with open(first.path) as f:
+        assert json.load(f) == {'B-|': 21}
+    second.release()
+    assert BillNumbers(str(tmp_path)).allocate('B-') == ['B-000012']
+
+
+def test_release_unregisters_from_atexit(tmp_path, monkeypatch):
+    unregistered = []
+    monkeypatch.setattr(atexit, 'unregister', unregistered.append)
+    allocator = BillNumbers(str(tmp_path))
+    allocator.release()
+    assert unregistered == [allocator.release]
@@ -0,0 +1,80 @@
+from decimal import Decimal
+
+import pytest
+
+import billing
+
+
+def bill(items, tax_rate=18, discount=0, grand_total=None, **fields):
+    record = dict({'customerName': 'Asha', 'items': items, 'taxRate': tax_rate, 'discount': discount}, **fields)
+    if grand_total is not None:
+        record['grandTotal'] = grand_total
+    return record
+
+
+def test_totals_are_exact_and_rounded_half_up():
+    result = billing.evaluate(bill([{'quantity': 3, 'price': '0.1'}, {'quantity': 1, 'price': 0.125}],
+                                   tax_rate=5, discount=0.5))
+    assert result['errors'] == []
+    assert result['lineTotals'] == [Decimal('0.30'), Decimal('0.13')]
+    assert result['subtotal'] == Decimal('0.43')
+    assert result['taxAmount'] == Decimal('0.02')
+    assert result['grandTotal'] == Decimal('0.00')
+    assert result['mismatch'] is False
+
+
+@pytest.mark.parametrize('record, error', [
+    ([], 'bill must be a JSON object'),
+    (bill([], customerName=' '), 'customerName is required'),
+    (bill([]), 'items must be a non-empty list'),
+    (bill(['tea']), 'items[0] must be an object'),
+    (bill([{'quantity': -1, 'price': 1}]), 'items[0].quantity must be a number between 0 and 1000000'),
+    (bill([{'quantity': 1, 'price': 'free'}]), 'items[0].price must be a number between 0 and 1000000000'),
+    (bill([{'quantity': 1, 'price': 1}], tax_rate=101), 'taxRate must be a number between 0 and 100'),
+    (bill([{'quantity': 1, 'price': 1}], discount=float('nan')), 'discount must be a number between 0 and %s'
+     % billing.MAX_AMOUNT),
+    (bill([{'quantity': 1e30, 'price': 1}]), 'items[0].quantity must be a number between 0 and 1000000'),
+    (bill([{'quantity': 1, 'price': '1e999999999'}]), 'items[0].price must be a number between 0 and 1000000000'),
+    (bill([{'quantity': 1, 'price': 1}], discount='1e999999999'), 'discount must be a number between 0 and %s'
+     % billing.MAX_AMOUNT),
+    (bill([{'quantity': 10 ** 6, 'price': 10 ** 9}]), 'total must not exceed %s' % billing.MAX_AMOUNT),
+    (bill([{'quantity': 1, 'price': 1}], grand_total='1e999999999'), 'grandTotal is out of range'),
+])
+def test_shape_errors(record, error):
+    assert error in billing.evaluate(record)['errors']
+
+
+def test_client_totals_within_a_paisa_are_accepted():
+    items = [{'quantity': 2, 'price': 10.5}]
+    assert not billing.evaluate(bill(items, grand_total=24.79))['mismatch']
+    assert billing.evaluate(bill(items, grand_total=24.8))['mismatch']
+
+
+def test_client_totals_computed_the_browser_way_are_accepted():
+    # The browser rounds only the grand total: 30 lines of 3.331665 make
+    # 117.94 with tax, where rounded line totals make 117.88.
+    items = [{'quantity': 0.333, 'price': 10.005}] * 30
+    result = billing.evaluate(bill(items, grand_total=117.94))
+    assert result['grandTotal'] == Decimal('117.88')
+    assert result['mismatch'] is False
+    assert billing.client_total([Decimal('0.333') * Decimal('10.005')] * 30, Decimal(18), Decimal(0)) == \
+        Decimal('117.94')
+
+
+def test_apply_totals_and_policy():
+    record = bill([{'quantity': 2, 'price': 10.5}], grand_total=30)
+    result = billing.evaluate(record)
+    assert billing.problems(result, 'flag') == []
+    assert billing.problems(result, 'reject') == ['grandTotal 30 does not match computed total 24.78']
+    billing.apply_totals(record, result)
+    assert (record['grandTotal'], record['clientGrandTotal'], record['totalsMismatch']) == (24.78, 30.0, True)
+    assert record['items'][0]['total'] == 21.0
+
+
+def test_revalidate_reports_only_bad_bills():
+    good = bill([{'quantity': 1, 'price': 5}])
+    billing.apply_totals(good, billing.evaluate(good))
+    bad = bill([{'quantity': 1, 'price': 5}], grand_total=50)
+    broken = bill([])
+    reported = [record for record, _ in billing.revalidate([good, bad, broken] * 3, batch_size=2)]
+    assert reported == [bad, broken] * 3
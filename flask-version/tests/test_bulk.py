@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from benchmarks import synth
+
+
+def record(number, **fields):
+    bill = {'customerName': 'C%d' % number, 'taxRate': 10, 'discount': 0,
+            'items': [{'description': 'Tea', 'quantity': 2, 'price': 5}], 'grandTotal': 11}
+    bill.update(fields)
+    return bill
+
+
+@pytest.fixture
+def store(app_module):
+    shard = app_module.shards.get('')
+    shard.store.set_business({'name': 'Shop', 'billPrefix': 'B-', 'billNumberReset': 'never'})
+    return shard.store
+
+
+def test_json_array(client, store):
+    records = [record(0), record(1, items='none'), record(2, grandTotal=99), record(3)]
+    body = client.post('/api/bills/bulk', json=records).get_json()
+
+    assert (body['created'], body['failed']) == (3, 1)
+    results = body['results']
+    assert [row['ok'] for row in results] == [True, False, True, True]
+    assert results[1]['errors']
+    assert results[2]['totalsMismatch'] is True
+    # One contiguous run of numbers, in the order of the records.
+    assert [row.get('billNumber') for row in results] == ['B-000001', None, 'B-000002', 'B-000003']
+
+    stored = {bill['id']: bill for bill in store.iter_bills()}
+    assert len(stored) == 3
+    flagged = stored[results[2]['id']]
+    assert (flagged['grandTotal'], flagged['clientGrandTotal'], flagged['totalsMismatch']) == (11.0, 99, True)
+    assert stored[results[0]['id']]['items'][0]['total'] == 10.0
+
+
+def test_ndjson(client, store):
+    lines = [json.dumps(record(0)), '', '{"broken', json.dumps(record(1))]
+    body = client.post('/api/bills/bulk', data='\n'.join(lines) + '\n',
+                       content_type='application/x-ndjson').get_json()
+    assert (body['created'], body['failed']) == (2, 1)
+    assert body['results'][1] == {'index': 1, 'ok': False, 'errors': ['invalid JSON line']}
+    assert store.count() == 2
+
+
+def test_reject_policy(client, store, app_module, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'BILL_TOTAL_POLICY', 'reject')
+    body = client.post('/api/bills/bulk', json=[record(0, grandTotal=99), record(1)]).get_json()
+    assert (body['created'], body['failed']) == (1, 1)
+    assert 'does not match' in body['results'][0]['errors'][0]
+
+
+def test_body_must_be_a_list(client, store):
+    assert client.post('/api/bills/bulk', json={'bills': []}).status_code == 400
+    assert client.post('/api/bills/bulk', json=[]).get_json()['created'] == 0
+
+
+def test_amounts_too_large_fail_only_their_record(client, store):
+    huge = record(0, items=[{'quantity': '1e999999999', 'price': 1}])
+    body = client.post('/api/bills/bulk', json=[huge, record(1)]).get_json()
+    assert [row['ok'] for row in body['results']] == [False, True]
+    assert client.post('/create', json=record(2, items=[{'quantity': 1e17, 'price': 1000}])).status_code == 400
+
+
+def test_records_without_a_date_are_dated_when_created(app_module, client, store):
+    store.set_business(dict(synth.BUSINESS, billPrefix='B-'))
+    body = client.post('/api/bills/bulk', json=[record(0), record(1, billDate=None)]).get_json()
+    stored = [store.get_bill(row['id']) for row in body['results']]
+    assert all(bill['billDate'] == bill['createdAt'] for bill in stored)
+    # Bills stored without one still list.
+    undated = dict(stored[0], id='undated')
+    del undated['billDate']
+    store.append_bill(undated)
+    assert client.get('/history').status_code == 200
@@ -0,0 +1,110 @@
+import pytest
+
+from cache import StoreCache
+from store import LogStore
+
+
+class Recorder:
+    def __init__(self):
+        self.cleared = 0
+        self.added = []
+
+    def clear(self):
+        self.cleared += 1
+        self.added = []
+
+    def add(self, bill):
+        self.added.append(bill['id'])
+
+
+def test_unchanged_store_is_served_from_memory(tmp_path, make_bill):
+    store = LogStore(str(tmp_path))
+    bill = make_bill()
+    store.append_bill(bill)
+    cache = StoreCache(store)
+
+    assert cache.get_bill(bill['id']) == bill
+    assert cache.load() == {'business': {}, 'bills': [bill]}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_appends_by_another_writer_are_read_incrementally(tmp_path, make_bill):
+    store = LogStore(str(tmp_path))
+    first, second = make_bill(1), make_bill(2)
+    store.append_bill(first)
+    cache = StoreCache(store)
+    listener = Recorder()
+    cache.subscribe(listener)
+    cache.sync()
+
+    LogStore(str(tmp_path)).append_bill(second)
+    changed = dict(first, customerName='Renamed')
+    LogStore(str(tmp_path)).append_bill(changed)
+    assert cache.get_bill(second['id']) == second
+    assert cache.load()['bills'] == [changed, second]
+    assert listener.cleared == 1
+    assert listener.added == [first['id'], second['id'], first['id']]
+
+
+def test_rewrite_reloads_everything(tmp_path, make_bill):
+    store = LogStore(str(tmp_path))
+    bills = [make_bill(number) for number in range(3)]
+    store.append_bills(bills)
+    cache = StoreCache(store)
+    listener = Recorder()
+    cache.subscribe(listener)
+    cache.sync()
+
+    LogStore(str(tmp_path)).compact(bills[1:])
+    assert cache.load()['bills'] == bills[1:]
+    assert cache.get_bill(bills[0]['id']) is None
+    assert listener.cleared == 2
+    assert listener.added == [bill['id'] for bill in bills[1:]]
+
+
+def test_business_changes_are_seen(tmp_path):
+    store = LogStore(str(tmp_path))
+    cache = StoreCache(store)
+    assert cache.get_business() == {}
+    LogStore(str(tmp_path)).set_business({'name': 'Shop'})
+    assert cache.get_business() == {'name': 'Shop'}
+
+
+def test_over_the_cap_bills_are_read_from_the_store(tmp_path, make_bill):
+    store = LogStore(str(tmp_path))
+    bill = make_bill()
+    store.append_bill(bill)
+    cache = StoreCache(store, max_bytes=1)
+
+    assert cache.get_bill(bill['id']) == bill
+    assert cache.stats()['holdsBills'] is False
+
+
+class Flaky(Recorder):
+    fail = False
+
+    def add(self, bill):
+        if self.fail:
+            raise RuntimeError('listener failed')
+        super().add(bill)
+
+
+def test_a_failing_listener_makes_the_next_sync_start_over(tmp_path, make_bill):
+    store = LogStore(str(tmp_path))
+    cache = StoreCache(store)
+    first, flaky, last = Recorder(), Flaky(), Recorder()
+    for listener in (first, flaky, last):
+        cache.subscribe(listener)
+    bills = [make_bill(number) for number in range(3)]
+    store.append_bill(bills[0])
+    cache.sync()
+
+    flaky.fail = True
+    store.append_bills(bills[1:])
+    with pytest.raises(RuntimeError):
+        cache.sync()
+    flaky.fail = False
+    cache.sync()
+    ids = [bill['id'] for bill in bills]
+    assert first.added == flaky.added == last.added == ids
+    assert [bill['id'] for bill in cache.load()['bills']] == ids
@@ -0,0 +1,51 @@
+import threading
+
+from store import LogStore
+
+BUSINESS = {'name': 'Shop', 'billPrefix': 'INV-'}
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_parallel_writers_lose_no_bills(tmp_path, make_bill):
+    # One store per thread, as separate workers would have; each takes the
+    # file lock on its own.
+    written = {}
+
+    def write(index):
+        store = LogStore(str(tmp_path))
+        bills = [make_bill(index * 100 + number) for number in range(20)]
+        for bill in bills:
+            store.append_bill(bill)
+        written[index] = bills
+
+    run_threads(8, write)
+    stored = {bill['id']: bill for bill in LogStore(str(tmp_path)).iter_bills()}
+    assert len(stored) == 160
+    for bills in written.values():
+        assert all(stored[bill['id']] == bill for bill in bills)
+
+
+def test_parallel_creates_get_distinct_numbers(client, app_module):
+    app_module.shards.get('').store.set_business(BUSINESS)
+    responses = []
+
+    def create(index):
+        bill = {'customerName': 'C%d' % index, 'taxRate': 0, 'discount': 0,
+                'items': [{'description': 'Tea', 'quantity': 1, 'price': 10}], 'grandTotal': 10}
+        responses.append(client.post('/create', json=bill).get_json())
+
+    # No more than a tenant may have in flight at once.
+    run_threads(app_module.app.config['TENANT_MAX_ACTIVE'], create)
+    assert all(response['success'] for response in responses)
+    numbers = sorted(response['billNumber'] for response in responses)
+    assert len(set(numbers)) == len(responses)
+    assert numbers[0].startswith('INV-')
+    stored = list(app_module.shards.get('').store.iter_bills())
+    assert sorted(bill['billNumber'] for bill in stored) == numbers
@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import time
+
+import pytest
+
+from benchmarks import synth
+
+
+@pytest.fixture
+def store(app_module):
+    store = app_module.shards.get('').store
+    store.set_business(synth.BUSINESS)
+    return store
+
+
+@pytest.mark.parametrize('path', ['/', '/history', '/api/bills', '/api/stats'])
+def test_unchanged_pages_are_304(client, store, make_bill, path):
+    store.append_bill(make_bill())
+    first = client.get(path)
+    assert first.status_code == 200
+    assert first.headers['ETag'].startswith('W/')
+    assert first.cache_control.no_cache
+
+    again = client.get(path, headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    assert again.get_data() == b''
+
+    store.append_bill(make_bill(2))
+    changed = client.get(path, headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != first.headers['ETag']
+
+
+def test_if_modified_since(client, store, make_bill):
+    store.append_bill(make_bill())
+    # Last-Modified is only sent once the second of the last write is over.
+    past = time.time() - 10
+    os.utime(store.log_path, (past, past))
+    os.utime(store.business_path, (past, past))
+    first = client.get('/api/bills')
+    assert first.last_modified is not None
+    assert client.get('/api/bills', headers={'If-Modified-Since': first.headers['Last-Modified']}).status_code == 304
+    store.append_bill(make_bill(2))
+    assert client.get('/api/bills', headers={'If-Modified-Since': first.headers['Last-Modified']}).status_code == 200
+
+
+def test_errors_are_not_cached(client, store):
+    response = client.get('/api/bills?cursor=bad')
+    assert response.status_code == 400
+    assert 'ETag' not in response.headers
+
+
+def test_pages_with_an_unfinished_thumbnail_are_not_revalidated(app_module, client, store):
+    uploads = app_module.shards.get('').uploads
+    pool = ThreadPoolExecutor(1)
+    uploads._shared_pool = lambda: pool
+    # Thumbnails wait until the test lets them be made.
+    uploads.schedule = lambda name: None
+    name = uploads.save(io.BytesIO(synth.signature_png(1)))
+    store.set_business(dict(synth.BUSINESS, logo='/static/uploads/' + name))
+
+    waiting = client.get('/')
+    assert 'ETag' not in waiting.headers and 'Last-Modified' not in waiting.headers
+    assert '/static/uploads/%s"' % name in waiting.get_data(as_text=True)
+
+    del uploads.schedule
+    uploads.make_thumbnails(name)
+    pool.shutdown()
+    ready = client.get('/')
+    assert ready.headers['ETag']
+    assert uploads.thumbnail_name(name, 128) in ready.get_data(as_text=True)
@@ -0,0 +1,64 @@
+import datetime
+
+from cache import StoreCache
+from customers import CustomerDirectory, pack_segment
+from store import LogStore
+
+
+def test_suggestions_by_name_and_phone(make_bill):
+    directory = CustomerDirectory()
+    for number, (name, phone) in enumerate([('Asha Rao', '98450 11111'), ('Ashok Kumar', '98450 22222'),
+                                            ('Ravi Rao', ''), ('Asha Rao', '98450 11111')]):
+        directory.add(make_bill(number, customerName=name, customerPhone=phone))
+
+    assert len(directory) == 3
+    assert [c['name'] for c in directory.suggest('ash')] == ['Asha Rao', 'Ashok Kumar']
+    assert [c['name'] for c in directory.suggest('rao')] == ['Asha Rao', 'Ravi Rao']
+    assert [c['name'] for c in directory.suggest('ash rao')] == ['Asha Rao']
+    assert [c['phone'] for c in directory.suggest('9845022')] == ['98450 22222']
+    assert directory.suggest('asha')[0]['bills'] == 2
+    assert directory.suggest('ash', limit=1) == directory.suggest('ash')[:1]
+    assert directory.suggest('  ') == []
+
+
+def test_latest_bill_names_the_customer(make_bill):
+    directory = CustomerDirectory()
+    directory.add(make_bill(1, customerName='A Rao', customerPhone='1', created='2026-01-01T10:00:00'))
+    directory.add(make_bill(2, customerName='Asha Rao', customerPhone='1', created='2026-02-01T10:00:00'))
+    directory.add(make_bill(3, customerName='Old Name', customerPhone='1', created='2025-12-01T10:00:00'))
+    assert [c['name'] for c in directory.suggest('rao')] == ['Asha Rao']
+    assert directory.suggest('old') == []
+
+
+def test_rewritten_bills_move_to_their_new_customer(make_bill):
+    directory = CustomerDirectory()
+    bill = make_bill(1, customerName='Asha', customerPhone='1')
+    directory.add(bill)
+    directory.add(dict(bill, customerName='Ravi', customerPhone='2'))
+    assert directory.suggest('asha') == []
+    assert directory.suggest('ravi')[0]['bills'] == 1
+    assert len(directory) == 1
+
+
+def test_sealed_customers_come_from_their_sections(tmp_path, make_bill):
+    last_month = datetime.datetime.now().replace(day=1, hour=9) - datetime.timedelta(days=1)
+    old = make_bill(1, customerName='Asha Rao', customerPhone='1', created=last_month)
+    store = LogStore(str(tmp_path), sections={'customers': pack_segment})
+    store.append_bills([old, make_bill(2, customerName='Ravi', customerPhone='2', created=last_month)])
+    store.seal()
+    store.append_bill(make_bill(3, customerName='Asha Rao', customerPhone='1'))
+    store.append_bill(dict(old, customerName='Meera', customerPhone='3'))
+
+    directory = CustomerDirectory()
+    cache = StoreCache(store)
+    cache.subscribe(directory)
+    cache.sync()
+    assert [(c['name'], c['bills']) for c in directory.suggest('r')] == [('Asha Rao', 1), ('Ravi', 1)]
+    assert directory.suggest('meera')[0]['bills'] == 1
+
+
+def test_suggest_route(app_module, client, make_bill):
+    app_module.shards.get('').store.append_bill(make_bill(1, customerName='Asha Rao'))
+    body = client.get('/api/customers/suggest?prefix=as').get_json()
+    assert body['prefix'] == 'as'
+    assert [c['name'] for c in body['customers']] == ['Asha Rao']
@@ -0,0 +1,45 @@
+import csv
+import datetime
+import gzip
+import io
+import json
+
+import pytest
+
+
+@pytest.fixture
+def bills(app_module, make_bill):
+    start = datetime.datetime.now().replace(day=1, hour=8, minute=0, second=0, microsecond=0)
+    bills = [make_bill(number, created=start + datetime.timedelta(hours=number)) for number in range(30)]
+    bills[0]['items'].append({'description': 'Ünïcode, "quoted"', 'quantity': 3, 'price': 1.25})
+    bills[1]['items'] = []
+    app_module.shards.get('').store.append_bills(bills)
+    return bills
+
+
+def test_csv_has_a_row_per_item(client, bills):
+    response = client.get('/export/bills.csv')
+    assert response.mimetype == 'text/csv'
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert len(rows) == 31
+    extra = rows[1]
+    assert (extra['id'], extra['itemIndex'], extra['description'], extra['lineTotal']) == (
+        bills[0]['id'], '1', 'Ünïcode, "quoted"', '3.75')
+    # A bill without items still has its row.
+    assert rows[2]['id'] == bills[1]['id'] and rows[2]['description'] == ''
+
+
+def test_jsonl_bills_in_a_date_range_gzipped(client, bills):
+    day = bills[20]['createdAt'][:10]
+    response = client.get('/export/bills.jsonl', query_string={'rows': 'bills', 'gzip': '1',
+                                                               'from': day, 'to': day})
+    assert response.mimetype == 'application/gzip'
+    rows = [json.loads(line) for line in gzip.decompress(response.get_data()).splitlines()]
+    assert [row['id'] for row in rows] == [bill['id'] for bill in bills if bill['createdAt'][:10] == day]
+    assert all('itemCount' in row for row in rows)
+
+
+def test_bad_arguments(client, bills):
+    assert client.get('/export/bills.xml').status_code == 404
+    assert client.get('/export/bills.csv?rows=lines').status_code == 400
+    assert client.get('/export/bills.csv?from=soon').status_code == 400
@@ -0,0 +1,75 @@
+import datetime
+import html
+import re
+
+import pytest
+
+
+@pytest.fixture
+def bills(app_module, make_bill):
+    # Created this month, a minute apart, so none are sealed.
+    start = datetime.datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    bills = [make_bill(number, created=start + datetime.timedelta(minutes=number)) for number in range(120)]
+    shard = app_module.shards.get('')
+    shard.store.set_business({'name': 'Shop'})
+    shard.store.append_bills(bills)
+    return bills
+
+
+def all_pages(client, **args):
+    ids, cursor = [], None
+    while True:
+        page = client.get('/api/bills', query_string=dict(args, cursor=cursor) if cursor else args).get_json()
+        ids.extend(bill['id'] for bill in page['bills'])
+        cursor = page['nextCursor']
+        if cursor is None:
+            return ids
+
+
+def newest_first(bills):
+    return [bill['id'] for bill in sorted(bills, key=lambda bill: (bill['createdAt'], bill['id']), reverse=True)]
+
+
+def test_pages_cover_every_bill_newest_first(client, bills):
+    first = client.get('/api/bills').get_json()
+    assert len(first['bills']) == 50
+    assert first['nextCursor']
+    assert all_pages(client, limit=30) == newest_first(bills)
+
+
+def test_limit_is_capped(client, bills):
+    assert len(client.get('/api/bills?limit=1000').get_json()['bills']) == 120
+    assert len(client.get('/api/bills?limit=0').get_json()['bills']) == 1
+
+
+@pytest.mark.parametrize('cursor', ['not-a-cursor', 'bm9wZQ==', '%%%'])
+def test_invalid_cursor_is_a_400(client, bills, cursor):
+    assert client.get('/api/bills', query_string={'cursor': cursor}).status_code == 400
+    assert client.get('/history', query_string={'cursor': cursor}).status_code == 400
+
+
+def test_invalid_date_is_a_400(client, bills):
+    assert client.get('/api/bills?from=yesterday').status_code == 400
+
+
+def test_filters(client, bills):
+    customer = [bill for bill in bills if bill['customerName'] == 'Customer 3']
+    assert all_pages(client, q='customer 3', limit=7) == newest_first(customer)
+    by_phone = all_pages(client, q=customer[0]['customerPhone'])
+    assert by_phone == newest_first(customer)
+
+    cheap = [bill for bill in bills if 30 <= bill['grandTotal'] <= 60]
+    assert all_pages(client, min=30, max=60) == newest_first(cheap)
+
+    day = bills[0]['createdAt'][:10]
+    assert all_pages(client, **{'from': day, 'to': day}) == newest_first(
+        [bill for bill in bills if bill['createdAt'][:10] == day])
+
+
+def test_history_page_links_the_next_page_with_its_filters(client, bills):
+    response = client.get('/history?q=customer&min=1&endpoint=x&_method=POST&limit=10')
+    assert response.status_code == 200
+    link = html.unescape(re.search(r'href="([^"]*cursor=[^"]*)"', response.get_data(as_text=True)).group(1))
+    assert 'q=customer' in link and 'min=1' in link
+    assert 'endpoint' not in link and '_method' not in link
+    assert client.get(link).status_code == 200
@@ -0,0 +1,96 @@
+import time
+
+import pytest
+
+from jobs import JobQueue
+
+
+def wait_for(queue, job_id, states=('done', 'failed'), timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job['state'] in states:
+            return job
+        time.sleep(0.01)
+    raise AssertionError('job %s still %s' % (job_id, job['state']))
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.db'), workers=2, max_attempts=3, backoff=0.01, poll=0.01, nice=0)
+    yield queue
+    queue.stop(timeout=5)
+
+
+def test_jobs_run_and_keep_their_result(queue):
+    queue.handler('add')(lambda payload: payload['a'] + payload['b'])
+    job_id = queue.enqueue('add', {'a': 2, 'b': 3})
+    job = wait_for(queue, job_id)
+    assert (job['state'], job['result'], job['attempts']) == ('done', 5, 1)
+    assert queue.completed == 1
+
+
+def test_failing_jobs_are_retried_then_failed(queue):
+    calls = []
+
+    @queue.handler('flaky')
+    def flaky(payload):
+        calls.append(payload)
+        if len(calls) < payload['succeed_on']:
+            raise RuntimeError('try again')
+        return 'ok'
+
+    assert wait_for(queue, queue.enqueue('flaky', {'succeed_on': 2}))['result'] == 'ok'
+    failed = wait_for(queue, queue.enqueue('flaky', {'succeed_on': 100}))
+    assert (failed['state'], failed['attempts']) == ('failed', 3)
+    assert 'RuntimeError: try again' in failed['error']
+    assert (queue.retried, queue.failed) == (3, 1)
+
+
+def test_unknown_kinds_are_refused(queue):
+    with pytest.raises(KeyError):
+        queue.enqueue('nope')
+
+
+def test_jobs_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    first = JobQueue(path, workers=0)
+    first.handler('echo')(lambda payload: payload)
+    job_id = first.enqueue('echo', 'hello')
+
+    second = JobQueue(path, workers=1, poll=0.01, nice=0)
+    second.handler('echo')(lambda payload: payload)
+    second.start()
+    try:
+        assert wait_for(second, job_id)['result'] == 'hello'
+    finally:
+        second.stop(timeout=5)
+
+
+def test_a_busy_lane_does_not_hold_up_the_others(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.db'), workers=0)
+    queue.handler('work')(lambda payload: payload)
+    busy = queue.enqueue_many([('work', n) for n in range(3)], lane='busy')
+    quiet = queue.enqueue('work', 'quiet', lane='quiet')
+    claimed = [queue._claim()[0][0] for _ in range(3)]
+    assert claimed == [busy[0], quiet, busy[1]]
+
+
+def test_expired_leases_are_run_again(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.db'), workers=0, lease=0)
+    queue.handler('work')(lambda payload: payload)
+    job_id = queue.enqueue('work', 1)
+    assert queue._claim()[0][0] == job_id
+    time.sleep(0.01)
+    job = queue._claim()[0]
+    assert (job[0], job[3]) == (job_id, 1)
+
+
+def test_create_queues_its_jobs(app_module, client):
+    app_module.shards.get('').store.set_business({'name': 'Shop'})
+    created = client.post('/create', json={'customerName': 'Asha', 'items': [{'quantity': 1, 'price': 5}]})
+    job_ids = created.get_json()['jobs']
+    assert job_ids
+    for job_id in job_ids:
+        assert client.get('/api/jobs/%s' % job_id).get_json()['state'] == 'queued'
+    assert client.get('/api/jobs/missing').status_code == 404
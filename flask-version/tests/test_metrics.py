@@ -0,0 +1,62 @@
+import os
+import time
+
+from metrics import CONTENT_TYPE, Registry
+from profiler import Sampler
+
+
+def test_histogram_and_collectors_render_as_prometheus_text():
+    registry = Registry()
+    seconds = registry.histogram('req_seconds', 'Request time.', ('route',), buckets=(0.1, 1.0))
+    seconds.observe(0.05, '/')
+    seconds.observe(0.5, '/')
+    seconds.observe(5, '/')
+    registry.counter('hits_total', 'Hits.', lambda: 3)
+    registry.gauge('jobs', 'Jobs.', lambda: [(('queued',), 2), (('done "x"',), None)], ('state',))
+
+    assert registry.render().splitlines() == [
+        '# HELP req_seconds Request time.',
+        '# TYPE req_seconds histogram',
+        'req_seconds_bucket{route="/",le="0.1"} 1',
+        'req_seconds_bucket{route="/",le="1.0"} 2',
+        'req_seconds_bucket{route="/",le="+Inf"} 3',
+        'req_seconds_sum{route="/"} 5.55',
+        'req_seconds_count{route="/"} 3',
+        '# HELP hits_total Hits.',
+        '# TYPE hits_total counter',
+        'hits_total 3',
+        '# HELP jobs Jobs.',
+        '# TYPE jobs gauge',
+        'jobs{state="queued"} 2',
+    ]
+
+
+def test_metrics_page_counts_requests(app_module, client):
+    # Requests are timed until their response is closed.
+    client.get('/api/stats').close()
+    response = client.get('/metrics')
+    assert response.content_type == CONTENT_TYPE
+    text = response.get_data(as_text=True)
+    assert 'bill_http_request_duration_seconds_count{route="/api/stats",method="GET",status="200"}' in text
+    assert 'bill_store_bills 0' in text
+
+
+def test_profiled_request_writes_a_profile(app_module, client, tmp_path, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'PROFILE_TOKEN', 'secret')
+    monkeypatch.setitem(app_module.app.config, 'PROFILE_DIR', str(tmp_path / 'profiles'))
+    assert 'X-Profile' not in client.get('/api/stats', headers={'X-Profile': 'wrong'}).headers
+    response = client.get('/api/stats', headers={'X-Profile': 'secret'})
+    response.close()
+    assert os.listdir(str(tmp_path / 'profiles')) == [response.headers['X-Profile']]
+
+
+def test_sampler_collapses_stacks():
+    def busy():
+        end = time.perf_counter() + 0.05
+        while time.perf_counter() < end:
+            pass
+
+    sampler = Sampler(interval=0.001).start()
+    busy()
+    sampler.stop()
+    assert 'busy' in sampler.collapsed()
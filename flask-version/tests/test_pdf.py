@@ -0,0 +1,100 @@
+from concurrent.futures import ThreadPoolExecutor
+import re
+import zlib
+
+import pytest
+
+from benchmarks import synth
+import pdf
+from render_cache import RenderCache, content_key
+
+
+def page_count(data):
+    return len(re.findall(rb'/Type /Page\b', data))
+
+
+def test_invoice_renders_with_images(make_bill):
+    signature = synth.signature_png(1)
+    data = pdf.render_invoice(make_bill(), {'name': 'Shop', 'address': 'Main Road'}, signature, signature)
+    assert data.startswith(b'%PDF-') and data.rstrip().endswith(b'%%EOF')
+    assert page_count(data) == 1
+    assert data.count(b'/Subtype /Image') == 2
+
+
+def test_long_invoices_run_over_pages(make_bill):
+    items = [{'description': 'Item %d' % number, 'quantity': 1, 'price': 2} for number in range(120)]
+    data = pdf.render_invoice(make_bill(items=items), {'name': 'Shop'})
+    assert page_count(data) > 1
+
+
+def page_text(data):
+    text = b''
+    for match in re.finditer(rb'/FlateDecode /Length (\d+) >>\nstream\n', data):
+        text += zlib.decompress(data[match.end():match.end() + int(match.group(1))])
+    return text
+
+
+def test_western_text_uses_the_fonts_encoding(make_bill):
+    bill = make_bill(customerName='Zoë “Café” Müller — €5')
+    text = page_text(pdf.render_invoice(bill, {'shopName': 'Shop'}))
+    assert b'(Zo\xeb \x93Caf\xe9\x94 M\xfcller \x97 \x805) Tj' in text
+
+
+@pytest.mark.parametrize('fields', [{'customerName': 'अनिल कुमार'},
+                                    {'items': [{'description': 'இட்லி', 'quantity': 1, 'price': 30}]}])
+def test_text_the_fonts_cannot_show_is_an_error(make_bill, fields):
+    with pytest.raises(pdf.UnsupportedText):
+        pdf.render_invoice(make_bill(**fields), {'shopName': 'Shop'})
+
+
+def test_pdf_route_refuses_text_it_cannot_show(app_module, client, make_bill, tmp_path, monkeypatch):
+    pool = ThreadPoolExecutor(1)
+    monkeypatch.setattr(app_module, 'pdf_pool', lambda: pool)
+    monkeypatch.setattr(app_module, 'pdf_cache', RenderCache(str(tmp_path / 'pdf'), '.pdf'))
+    bill = make_bill(customerName='अनिल कुमार')
+    shard = app_module.shards.get('')
+    shard.store.set_business({'shopName': 'Shop'})
+    shard.store.append_bill(bill)
+    response = client.get('/bills/%s.pdf' % bill['id'])
+    assert response.status_code == 422
+    assert 'cannot show' in response.get_json()['error']
+    pool.shutdown()
+
+
+def test_png_pixels():
+    width, height, channels, pixels = pdf.png_pixels(synth.signature_png(2, width=30, height=10))
+    assert (width, height, channels, len(pixels)) == (30, 10, 1, 300)
+    assert pdf.png_pixels(b'not a png') is None
+
+
+def test_render_cache_keys_and_eviction(tmp_path):
+    assert content_key({'a': 1, 'b': 2}) == content_key({'b': 2, 'a': 1})
+    assert content_key(b'ab', b'c') != content_key(b'a', b'bc')
+    cache = RenderCache(str(tmp_path), '.pdf', max_bytes=250)
+    assert cache.get('ab' * 32) is None
+    paths = [cache.put(('%02d' % number) * 32, b'x' * 100) for number in range(3)]
+    assert cache.get(('02') * 32) == paths[2]
+    # Past max_bytes the oldest entries go.
+    assert cache.get('00' * 32) is None
+
+
+def test_pdf_route_renders_once(app_module, client, make_bill, tmp_path, monkeypatch):
+    pool = ThreadPoolExecutor(1)
+    monkeypatch.setattr(app_module, 'pdf_pool', lambda: pool)
+    monkeypatch.setattr(app_module, 'pdf_cache', RenderCache(str(tmp_path / 'pdf'), '.pdf'))
+    renders = []
+    monkeypatch.setattr(pdf, 'render_invoice', lambda *args: renders.append(args) or b'%PDF-1.4 test')
+    bill = make_bill()
+    shard = app_module.shards.get('')
+    shard.store.set_business({'name': 'Shop'})
+    shard.store.append_bill(bill)
+
+    for _ in range(2):
+        response = client.get('/bills/%s.pdf' % bill['id'])
+        assert response.status_code == 200
+        assert response.mimetype == 'application/pdf'
+        assert response.get_data() == b'%PDF-1.4 test'
+        response.close()
+    assert len(renders) == 1
+    assert client.get('/bills/missing.pdf').status_code == 404
+    pool.shutdown()
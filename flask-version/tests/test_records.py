@@ -0,0 +1,129 @@
+import datetime
+import json
+import math
+import zlib
+
+import pytest
+from flask.json.provider import DefaultJSONProvider
+
+from json_provider import FastJSONProvider
+from records import PACKED_VERSION, Bill, decode_record, encode_record
+from store import LogStore
+
+ODD_BILLS = [
+    {'id': 'a', 'customerName': 'Line\nbreak\rand \x1b escape', 'items': []},
+    {'id': 'b', 'customerName': None, 'discount': None, 'notes': 'extra key', 'items': [
+        {'description': 'Tea', 'quantity': 1, 'price': 5, 'total': 5},
+        {'description': None, 'quantity': 2},
+        {'description': 'Gift', 'price': 0, 'wrapped': True},
+    ]},
+    {'id': 'c', 'items': 'not a list'},
+    {'id': 'd', 'items': [['a', 'list'], {'description': 'x'}]},
+    {'id': 'e'},
+    {'id': 'f', 'grandTotal': 1.1, 'taxRate': 18, 'signature': 'data:image/png;base64,' + 'A' * 500,
+     'items': [{'description': 'Ünïcode ₹', 'quantity': 0.333, 'price': 10.005, 'total': 3.33}]},
+]
+
+
+@pytest.mark.parametrize('codec', ['json', 'packed'])
+@pytest.mark.parametrize('bill', ODD_BILLS, ids=lambda bill: bill['id'])
+def test_records_round_trip(codec, bill):
+    record = encode_record(bill, codec)
+    assert record.endswith(b'\n') and record.count(b'\n') == 1 and b'\r' not in record
+    assert decode_record(record) == bill
+    assert Bill.from_dict(bill).to_dict() == bill
+
+
+def test_packed_records_are_smaller(make_bill):
+    bill = make_bill()
+    assert len(encode_record(bill, 'packed')) < len(encode_record(bill, 'json'))
+
+
+def test_packed_records_are_versioned_json(make_bill):
+    bill = make_bill()
+    payload = encode_record(bill, 'packed')[9:-1]
+    packed = json.loads(payload)
+    assert packed[0] == PACKED_VERSION and packed[1][0] == bill['id']
+    other = json.dumps([PACKED_VERSION + 1] + packed[1:]).encode()
+    assert decode_record(b'%08x' % zlib.crc32(other) + b'p' + other + b'\n') is None
+
+
+@pytest.mark.parametrize('codec', ['json', 'packed'])
+def test_torn_and_corrupt_records_are_none(codec, make_bill):
+    record = encode_record(make_bill(), codec)
+    assert decode_record(record[:-1]) is None
+    assert decode_record(record[:len(record) // 2]) is None
+    assert decode_record(record[:8] + b'?' + record[9:]) is None
+    flipped = bytearray(record)
+    flipped[20] ^= 1
+    assert decode_record(bytes(flipped)) is None
+    assert decode_record(b'\n') is None
+
+
+def test_a_log_may_mix_codecs(tmp_path, make_bill):
+    bills = [make_bill(number) for number in range(6)]
+    store = LogStore(str(tmp_path), codec='packed')
+    store.append_bills(bills[:3])
+    store.codec = 'json'
+    store.append_bills(bills[3:])
+    assert list(LogStore(str(tmp_path)).iter_bills()) == bills
+    with pytest.raises(ValueError):
+        LogStore(str(tmp_path), codec='xml')
+
+
+@pytest.fixture
+def store(app_module, make_bill):
+    store = app_module.shards.get('').store
+    store.set_business({'name': 'Shop'})
+    store.append_bills([make_bill(number) for number in range(5)])
+    return store
+
+
+def test_convert_and_export_commands(app_module, store, tmp_path):
+    bills = list(store.iter_bills())
+    runner = app_module.app.test_cli_runner()
+    result = runner.invoke(args=['convert-bills', 'packed'])
+    assert result.exit_code == 0 and result.output.startswith('5 bills written as packed')
+    with open(store.log_path, 'rb') as f:
+        assert all(line[8:9] == b'p' for line in f if line.strip())
+    assert list(LogStore(store.directory).iter_bills()) == bills
+    assert runner.invoke(args=['convert-bills', 'xml']).exit_code != 0
+
+    path = str(tmp_path / 'out.json')
+    assert runner.invoke(args=['export-json', path]).exit_code == 0
+    with open(path) as f:
+        data = json.load(f)
+    assert data['bills'] == bills and data['business'] == {'name': 'Shop'}
+
+
+@pytest.fixture
+def providers(app_module):
+    return FastJSONProvider(app_module.app), DefaultJSONProvider(app_module.app)
+
+
+@pytest.mark.parametrize('obj', [
+    {'b': 1, 'a': [1.5, None, True, 'x']},
+    {'name': 'Ünïcode ₹', 'nested': {'z': 1, 'y': 2}},
+    {'when': datetime.datetime(2026, 1, 2, 3, 4, 5), 'day': datetime.date(2026, 1, 2)},
+    {'big': 2 ** 70},
+    [],
+])
+def test_fast_json_matches_flask(providers, obj):
+    fast, default = providers
+    assert fast.dumps(obj, separators=(',', ':')) == default.dumps(obj, separators=(',', ':'))
+    assert fast.dumps(obj) == default.dumps(obj)
+    assert fast.loads(fast.dumps(obj)) == default.loads(default.dumps(obj))
+    assert fast.dumps(obj, indent=2) == default.dumps(obj, indent=2)
+
+
+def test_responses_match_flask(app_module, providers):
+    fast, default = providers
+    obj = {'b': 'Ünïcode ₹', 'a': datetime.date(2026, 1, 2)}
+    with app_module.app.app_context():
+        assert fast.response(obj).get_data() == default.response(obj).get_data()
+
+
+def test_fast_json_writes_nan_as_null(providers):
+    fast, _ = providers
+    assert fast.dumps({'x': math.nan, 'y': math.inf}, separators=(',', ':')) == '{"x":null,"y":null}'
+    assert math.isnan(fast.loads('{"x": NaN}')['x'])
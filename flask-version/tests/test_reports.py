@@ -0,0 +1,195 @@
+import csv
+import datetime
+import io
+from collections import defaultdict
+
+import pytest
+
+import reports
+from benchmarks import synth
+from cache import StoreCache
+from store import LogStore
+
+pytestmark = pytest.mark.skipif(reports.np is None, reason='reports need NumPy')
+
+THIS_MONTH = datetime.datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+LAST_MONTH = (THIS_MONTH - datetime.timedelta(days=1)).replace(day=1)
+MENU = [('Tea', 10), ('Coffee', 25.5), ('Samosa', 12.25), ('Dosa', 60)]
+
+
+@pytest.fixture
+def bills(make_bill):
+    bills = []
+    for number in range(90):
+        month = [LAST_MONTH, THIS_MONTH][number % 2]
+        created = month + datetime.timedelta(days=number % 5, hours=8 + number % 11, minutes=number)
+        items = []
+        for line in range(1 + number % 3):
+            description, price = MENU[(number + line) % len(MENU)]
+            quantity = 1 + (number * line) % 4
+            items.append({'description': description, 'quantity': quantity, 'price': price,
+                          'total': round(quantity * price, 2)})
+        subtotal = round(sum(item['total'] for item in items), 2)
+        rate = [5, 12, 18][number % 3]
+        tax = round(subtotal * rate / 100, 2)
+        discount = number % 4
+        bill = make_bill(number, created=created, items=items, subtotal=subtotal, taxRate=rate, taxAmount=tax,
+                         discount=discount, grandTotal=round(subtotal + tax - discount, 2))
+        if number % 10 == 0:
+            bill.update(customerName='', customerPhone='')
+        bills.append(bill)
+    return bills
+
+
+def paise(value):
+    return int(round(float(value or 0) * 100))
+
+
+def expected(bills, name, date_from=None, date_to=None, top=reports.DEFAULT_TOP):
+    """Report rows worked out bill by bill, as the report should give them."""
+    kept = [bill for bill in bills
+            if (not date_from or bill['createdAt'][:10] >= date_from)
+            and (not date_to or bill['createdAt'][:10] <= date_to)]
+    groups = defaultdict(lambda: [0, 0, 0, 0, 0])
+    if name in ('gst', 'sales-by-day', 'sales-by-hour'):
+        for bill in kept:
+            key = {'gst': bill['taxRate'], 'sales-by-day': bill['createdAt'][:10],
+                   'sales-by-hour': int(bill['createdAt'][11:13])}[name]
+            row = groups[key]
+            row[0] += 1
+            for index, field in enumerate(('subtotal', 'taxAmount', 'discount', 'grandTotal'), 1):
+                row[index] += paise(bill[field])
+        if name == 'sales-by-hour':
+            # Every hour has a row, billed or not.
+            groups.update((hour, groups[hour]) for hour in range(24))
+    if name == 'gst':
+        return [{'taxRate': rate, 'bills': count, 'taxableValue': subtotal / 100, 'cgst': (tax - tax // 2) / 100,
+                 'sgst': tax // 2 / 100, 'totalTax': tax / 100, 'discount': discount / 100, 'grandTotal': total / 100}
+                for rate, (count, subtotal, tax, discount, total) in sorted(groups.items())]
+    if name in ('sales-by-day', 'sales-by-hour'):
+        field = 'date' if name == 'sales-by-day' else 'hour'
+        return [{field: key, 'bills': count, 'subtotal': subtotal / 100, 'tax': tax / 100, 'grandTotal': total / 100}
+                for key, (count, subtotal, tax, _, total) in sorted(groups.items())]
+    if name == 'top-items':
+        for bill in kept:
+            for item in bill['items']:
+                row = groups[item['description']]
+                row[0] += 1
+                row[1] += item['quantity']
+                row[2] += paise(item['total'])
+        rows = [{'item': item, 'lines': lines, 'quantity': quantity, 'revenue': amount / 100}
+                for item, (lines, quantity, amount, _, _) in groups.items()]
+        return sorted(rows, key=lambda row: -row['revenue'])[:top]
+    names = {}
+    for bill in sorted(kept, key=lambda bill: bill['createdAt']):
+        key = reports.customer_key(bill)
+        if key:
+            groups[key][0] += 1
+            groups[key][1] += paise(bill['grandTotal'])
+            names[key] = bill['customerName']
+    rows = [{'customer': names[key], 'key': key, 'bills': count, 'revenue': total / 100}
+            for key, (count, total, _, _, _) in groups.items()]
+    return sorted(rows, key=lambda row: -row['revenue'])[:top]
+
+
+def report(columns, name, date_from=None, date_to=None, **options):
+    build, _ = reports.REPORTS[name]
+    return list(build(columns.snapshot(date_from, date_to), **options))
+
+
+def synced(store):
+    columns = reports.ReportColumns()
+    cache = StoreCache(store)
+    cache.subscribe(columns)
+    cache.sync()
+    return columns
+
+
+@pytest.mark.parametrize('name', sorted(reports.REPORTS))
+def test_reports_match_a_bill_by_bill_count(tmp_path, bills, name):
+    store = LogStore(str(tmp_path))
+    store.append_bills(bills)
+    columns = synced(store)
+    assert report(columns, name) == expected(bills, name)
+    day_from = (THIS_MONTH + datetime.timedelta(days=1)).date().isoformat()
+    day_to = (THIS_MONTH + datetime.timedelta(days=3)).date().isoformat()
+    assert report(columns, name, day_from, day_to) == expected(bills, name, day_from, day_to)
+    assert report(columns, name, top=2)[:2] == expected(bills, name, top=2)[:2]
+
+
+@pytest.mark.parametrize('name', sorted(reports.REPORTS))
+def test_sealed_months_give_the_same_reports(tmp_path, bills, name):
+    store = LogStore(str(tmp_path), sections={'reports': reports.pack_segment})
+    store.append_bills(bills)
+    assert store.seal() == [LAST_MONTH.strftime('%Y-%m')]
+    # A sealed bill written again counts once, with its new values.
+    old = bills[1]
+    bills[1] = dict(old, taxRate=28, taxAmount=99.5, grandTotal=500, customerName='Moved', customerPhone='1')
+    store.append_bill(bills[1])
+
+    columns = synced(store)
+    assert report(columns, name) == expected(bills, name)
+    day = LAST_MONTH.date().isoformat()
+    assert report(columns, name, day, day) == expected(bills, name, day, day)
+    # Without the section the sealed month is packed from its bills.
+    assert report(synced(LogStore(str(tmp_path))), name) == expected(bills, name)
+
+
+def test_rewritten_hot_bills_count_once(tmp_path, make_bill):
+    store = LogStore(str(tmp_path))
+    columns = synced(store)
+    bill = make_bill(1, customerName='Asha', customerPhone='')
+    columns.add(bill)
+    columns.add(dict(bill, grandTotal=100))
+    assert report(columns, 'customers') == [{'customer': 'Asha', 'key': 'asha', 'bills': 1, 'revenue': 100.0}]
+
+
+def test_bills_too_large_for_the_columns_are_left_out(tmp_path, make_bill):
+    huge = make_bill(1, items=[{'description': 'Gold', 'quantity': 1e17, 'price': 1000, 'total': 1e20}],
+                     subtotal=1e20, grandTotal=1e20)
+    fine = make_bill(2, customerName='Asha', customerPhone='')
+    store = LogStore(str(tmp_path))
+    store.append_bills([huge, make_bill(3, grandTotal=float('inf')), fine])
+    columns = synced(store)
+    assert columns._hot.unfit == 2
+    assert len({len(column) for column in list(columns._hot.bills.values()) + [columns._hot.live]}) == 1
+    assert report(columns, 'customers') == [{'customer': 'Asha', 'key': 'asha', 'bills': 1, 'revenue': 26.78}]
+    assert report(columns, 'top-items') == expected([fine], 'top-items')
+    # Sealed months keep the row dead.
+    section = reports.ReportColumns()._unpack(reports.pack_segment([huge, fine]))
+    assert section['live'].tolist() == [False, True]
+
+
+@pytest.fixture
+def shard(app_module, bills):
+    shard = app_module.shards.get('')
+    shard.store.append_bills(bills)
+    return shard
+
+
+def test_report_route_formats(client, shard, bills):
+    body = client.get('/reports/gst?format=json').get_json()
+    assert body == {'report': 'gst', 'from': None, 'to': None, 'rows': expected(bills, 'gst')}
+
+    response = client.get('/reports/customers?top=3&from=%s' % THIS_MONTH.date().isoformat())
+    assert response.mimetype == 'text/csv'
+    assert 'attachment; filename=customers_%s_end.csv' % THIS_MONTH.date().isoformat() == \
+        response.headers['Content-Disposition']
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    want = expected(bills, 'customers', THIS_MONTH.date().isoformat(), top=3)
+    assert [(row['key'], row['revenue']) for row in rows] == [(row['key'], str(row['revenue'])) for row in want]
+
+
+def test_report_route_errors(client, shard):
+    assert client.get('/reports/nope').status_code == 404
+    assert client.get('/reports/gst?format=xml').status_code == 400
+    assert client.get('/reports/gst?from=yesterday').status_code == 400
+
+
+def test_report_routes_survive_bills_too_large_for_the_columns(app_module, client, make_bill):
+    store = app_module.shards.get('').store
+    store.set_business(synth.BUSINESS)
+    store.append_bill(make_bill(1, items=[{'description': 'Gold', 'quantity': 1e17, 'price': 1000, 'total': 1e20}],
+                                subtotal=1e20, grandTotal=1e20))
+    assert client.get('/').status_code == 200
+    assert client.get('/reports/gst?format=json').get_json()['rows'] == []
@@ -0,0 +1,89 @@
+import datetime
+
+from cache import StoreCache
+from search_index import SearchIndex, pack_segment
+from store import LogStore
+
+
+def bill(make_bill, number, name, *descriptions, **fields):
+    items = [{'description': description, 'quantity': 1, 'price': 1} for description in descriptions]
+    return make_bill(number, customerName=name, items=items, **fields)
+
+
+def ids(hits):
+    return [bill_id for bill_id, _ in hits]
+
+
+def test_words_are_prefixes_that_must_all_match(make_bill):
+    index = SearchIndex()
+    bills = [bill(make_bill, 1, 'Asha Rao', 'Masala tea'), bill(make_bill, 2, 'Ravi Kumar', 'Green tea'),
+             bill(make_bill, 3, 'Asha Iyer', 'Coffee')]
+    for record in bills:
+        index.add(record)
+
+    assert set(ids(index.search('tea')[0])) == {bills[0]['id'], bills[1]['id']}
+    assert ids(index.search('ash tea')[0]) == [bills[0]['id']]
+    assert index.search('asha coffee tea') == ([], 0)
+    assert index.search('') == ([], 0)
+    assert ids(index.search(bills[2]['customerPhone'])[0])[0] == bills[2]['id']
+
+
+def test_ranking_by_field_then_newest(make_bill):
+    index = SearchIndex()
+    in_item = bill(make_bill, 1, 'Someone', 'Kumar brand rice')
+    in_name = bill(make_bill, 2, 'Ravi Kumar', 'Rice')
+    newer = bill(make_bill, 3, 'Anil Kumar', 'Dal')
+    for record in (in_item, in_name, newer):
+        index.add(record)
+    assert ids(index.search('kumar')[0]) == [newer['id'], in_name['id'], in_item['id']]
+    hits, total = index.search('kumar', offset=1, limit=1)
+    assert (ids(hits), total) == ([in_name['id']], 3)
+
+
+def test_superseded_bills_are_found_once_and_compacted(make_bill):
+    index = SearchIndex(compact_min=0)
+    record = bill(make_bill, 1, 'Asha', 'Tea')
+    index.add(record)
+    index.add(dict(record, customerName='Meera'))
+    assert index.search('asha') == ([], 0)
+    assert ids(index.search('meera')[0]) == [record['id']]
+    assert len(index) == 1
+
+
+def test_sealed_months_are_searched_in_their_segments(tmp_path, make_bill):
+    last_month = datetime.datetime.now().replace(day=1, hour=9) - datetime.timedelta(days=1)
+    old = [bill(make_bill, number, name, 'Tea', created=last_month)
+           for number, name in enumerate(['Asha Zeta', 'Asha', 'Ravi'])]
+    store = LogStore(str(tmp_path), sections={'search': pack_segment})
+    store.append_bills(old)
+    store.seal()
+    hot = bill(make_bill, 9, 'Asha New', 'Tea')
+    store.append_bill(hot)
+    store.append_bill(dict(old[0], customerName='Meera'))
+
+    index = SearchIndex()
+    cache = StoreCache(store)
+    cache.subscribe(index)
+    cache.sync()
+    hits, total = index.search('tea')
+    assert total == 4
+    assert sorted(ids(hits)) == sorted(record['id'] for record in old + [hot])
+    # The sealed copy of a bill written again is no longer found.
+    assert ids(index.search('zeta')[0]) == []
+    assert ids(index.search('meera')[0]) == [old[0]['id']]
+
+    # Also when it is written again after its month was searched.
+    store.append_bill(dict(old[1], customerName='Kiran'))
+    cache.sync()
+    assert sorted(ids(index.search('asha')[0])) == [hot['id']]
+    assert ids(index.search('kiran')[0]) == [old[1]['id']]
+
+
+def test_search_route(app_module, client, make_bill):
+    records = [bill(make_bill, number, 'Asha', 'Tea') for number in range(5)]
+    app_module.shards.get('').store.append_bills(records)
+    first = client.get('/api/search?q=tea&limit=3').get_json()
+    assert (first['total'], len(first['results']), first['nextOffset']) == (5, 3, 3)
+    second = client.get('/api/search?q=tea&limit=3&offset=3').get_json()
+    assert second['nextOffset'] is None
+    assert {row['id'] for row in first['results'] + second['results']} == {record['id'] for record in records}
@@ -0,0 +1,120 @@
+import datetime
+import os
+
+import pytest
+
+from records import id_key
+from segments import UNDATED, Segment, bill_month, write_segment
+from store import LogStore
+
+THIS_MONTH = datetime.datetime.now().replace(day=1, hour=9, minute=0, second=0, microsecond=0)
+LAST_MONTH = (THIS_MONTH - datetime.timedelta(days=1)).replace(day=1)
+EARLIER = (LAST_MONTH - datetime.timedelta(days=1)).replace(day=1)
+
+
+@pytest.fixture
+def bills(make_bill):
+    bills = [make_bill(number, created=month + datetime.timedelta(minutes=number))
+             for number, month in enumerate([EARLIER, LAST_MONTH, THIS_MONTH] * 40)]
+    bills.append(make_bill(999, createdAt=None, billDate=None))
+    return bills
+
+
+def key(bill):
+    return (bill['createdAt'] or '', bill['id'])
+
+
+def test_segment_reads_and_lookups(tmp_path, make_bill):
+    # Big enough for several compressed blocks.
+    bills = [make_bill(number, created=LAST_MONTH + datetime.timedelta(minutes=number),
+                       customerName='x' * 2000) for number in range(100)]
+    path = str(tmp_path / 'month.seg')
+    write_segment(path, LAST_MONTH.strftime('%Y-%m'), bills[::-1], {'extra': lambda bills: b'%d' % len(bills)})
+    segment = Segment(path)
+
+    assert len(segment) == 100
+    assert list(segment.iter_bills()) == bills
+    assert bytes(segment.section('extra')) == b'100'
+    assert segment.section('missing') is None
+    for doc in (0, 57, 99):
+        assert segment.find(id_key(bills[doc]['id'])) == doc
+        assert segment.read(doc) == bills[doc]
+        assert segment.bill_id(doc) == bills[doc]['id']
+    assert segment.find(id_key('not-there')) is None
+    with pytest.raises(ValueError):
+        write_segment(str(tmp_path / 'dup.seg'), 'x', [bills[0], bills[0]])
+
+
+def test_seal_moves_past_months_out_of_the_log(tmp_path, bills):
+    store = LogStore(str(tmp_path))
+    store.append_bills(bills)
+    assert store.needs_seal()
+    hot_before = store.hot_bytes()
+
+    sealed = store.seal()
+    assert sealed == [UNDATED, EARLIER.strftime('%Y-%m'), LAST_MONTH.strftime('%Y-%m')]
+    assert store.months() == sealed
+    assert not store.needs_seal() and store.seal() == []
+    assert store.hot_bytes() < hot_before
+    assert sorted(os.listdir(store.segment_dir)) == sorted(month + '.seg' for month in sealed)
+
+    reopened = LogStore(str(tmp_path))
+    assert reopened.count() == len(bills)
+    assert sorted(reopened.iter_bills(), key=key) == sorted(bills, key=key)
+    for bill in bills[::7]:
+        assert reopened.get_bill(bill['id']) == bill
+        assert reopened.get_bill(bill['id'], bill_month(bill)) == bill
+
+
+def test_date_ranges_skip_sealed_months(tmp_path, bills):
+    store = LogStore(str(tmp_path))
+    store.append_bills(bills)
+    store.seal()
+    day = THIS_MONTH.date().isoformat()
+    months = {bill_month(bill) for bill in store.iter_bills(date_from=day)}
+    assert months == {UNDATED, THIS_MONTH.strftime('%Y-%m')}
+
+
+def test_rewritten_sealed_bills_shadow_their_sealed_copy(tmp_path, bills):
+    store = LogStore(str(tmp_path))
+    store.append_bills(bills)
+    store.seal()
+    month = LAST_MONTH.strftime('%Y-%m')
+    old = next(bill for bill in bills if bill_month(bill) == month)
+    changed = dict(old, customerName='Changed')
+    store.append_bill(changed)
+
+    assert store.count() == len(bills)
+    assert store.get_bill(old['id']) == changed
+    assert [bill for bill in store.iter_bills() if bill['id'] == old['id']] == [changed]
+    assert old['id'] not in {bill['id'] for bill in store.iter_month(month)}
+    assert store.shadowed_docs(month) == {store.segment(month).find(id_key(old['id']))}
+    assert store.shadowed_docs(EARLIER.strftime('%Y-%m')) == set()
+
+    # Sealing again folds the new copy into the month's segment.
+    assert store.needs_seal()
+    assert store.seal() == [month]
+    assert store.shadowed_docs(month) == set()
+    reopened = LogStore(str(tmp_path))
+    assert reopened.count() == len(bills)
+    assert reopened.get_bill(old['id']) == changed
+    assert reopened.segment(month).read(reopened.segment(month).find(id_key(old['id']))) == changed
+
+
+def test_history_pages_span_sealed_months(app_module, client, bills):
+    shard = app_module.shards.get('')
+    shard.store.append_bills(bills)
+    shard.store.seal()
+    ids, cursor = [], None
+    while True:
+        page = client.get('/api/bills', query_string={'limit': 25, 'cursor': cursor} if cursor
+                          else {'limit': 25}).get_json()
+        ids.extend(bill['id'] for bill in page['bills'])
+        cursor = page['nextCursor']
+        if cursor is None:
+            break
+    assert ids == [bill['id'] for bill in sorted(bills, key=key, reverse=True)]
+    day = LAST_MONTH.date().isoformat()
+    page = client.get('/api/bills', query_string={'from': day, 'to': day}).get_json()
+    assert [bill['id'] for bill in page['bills']] == [
+        bill['id'] for bill in sorted(bills, key=key, reverse=True) if key(bill)[0][:10] == day]
@@ -0,0 +1,27 @@
+from sqlite_store import SQLiteStore
+
+
+def test_bills_round_trip_with_their_number_types(tmp_path, make_bill):
+    bills = [make_bill(1, taxRate=18, discount=0, grandTotal=100),
+             make_bill(2, taxRate=12.5, discount='5', extraField={'note': 'kept'})]
+    bills[0]['items'][0].update(quantity=3, price=2)
+    store = SQLiteStore(str(tmp_path / 'bills.db'))
+    store.append_bills(bills)
+    store.close()
+
+    reopened = SQLiteStore(str(tmp_path / 'bills.db'))
+    assert list(reopened.iter_bills()) == bills
+    stored = reopened.get_bill(bills[0]['id'])
+    assert type(stored['grandTotal']) is int
+    assert type(stored['items'][0]['quantity']) is int
+
+
+
+def test_explicit_nulls_survive(tmp_path, make_bill):
+    bill = make_bill(1, customerPhone=None, discount=None, note=None)
+    bill['items'][0]['price'] = None
+    bill['items'].append({'description': 'Tea'})
+    store = SQLiteStore(str(tmp_path / 'bills.db'))
+    store.append_bill(bill)
+    assert store.get_bill(bill['id']) == bill
+    assert list(store.iter_bills()) == [bill]
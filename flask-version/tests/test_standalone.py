@@ -0,0 +1,54 @@
+import datetime
+import re
+
+import pytest
+
+from benchmarks import synth
+from cache import StoreCache
+from history_index import HistoryIndex
+import stats as bill_stats
+from store import LogStore
+
+LAST_MONTH = (datetime.datetime.now().replace(day=1, hour=9) - datetime.timedelta(days=1)).replace(day=1)
+
+
+@pytest.fixture
+def standalone(_app_session, tmp_path, monkeypatch):
+    import standalone_app
+    store = LogStore(str(tmp_path / 'data'), sections={'stats': bill_stats.pack_segment})
+    cache = StoreCache(store)
+    history_index, dashboard_stats = HistoryIndex(), bill_stats.BillStats()
+    cache.subscribe(history_index)
+    cache.subscribe(dashboard_stats)
+    for name, value in (('store', store), ('cache', cache), ('history_index', history_index),
+                        ('dashboard_stats', dashboard_stats)):
+        monkeypatch.setattr(standalone_app, name, value)
+    store.set_business(synth.BUSINESS)
+    return standalone_app
+
+
+def test_pages_do_not_load_the_archive(standalone, make_bill, monkeypatch):
+    store = standalone.store
+    old = [make_bill(number, created=LAST_MONTH + datetime.timedelta(minutes=number)) for number in range(60)]
+    new = [make_bill(100 + number) for number in range(3)]
+    store.append_bills(old + new)
+    assert store.seal()
+
+    def load():
+        raise AssertionError('read every bill')
+    monkeypatch.setattr(store, 'load', load)
+    client = standalone.app.test_client()
+
+    page = client.get('/').get_data(as_text=True)
+    assert '>63</p>' in page
+    assert '₹%s' % round(sum(bill['grandTotal'] for bill in old + new), 2) in page
+
+    numbers, path = [], '/history'
+    while path:
+        page = client.get(path).get_data(as_text=True)
+        numbers.extend(re.findall(r'BILL-\d+', page))
+        older = re.search(r'href="(/history\?cursor=[^"]+)"', page)
+        path = older and older.group(1).replace('&amp;', '&')
+    newest_first = sorted(old + new, key=lambda bill: (bill['createdAt'], bill['id']), reverse=True)
+    assert numbers == [bill['billNumber'] for bill in newest_first]
+    assert client.get('/history?cursor=bad').status_code == 400
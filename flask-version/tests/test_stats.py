@@ -0,0 +1,83 @@
+import datetime
+
+import pytest
+
+from cache import StoreCache
+import stats
+from store import LogStore
+
+
+@pytest.fixture
+def dated_bills(make_bill):
+    """Bills of two earlier months and of this month."""
+    now = datetime.datetime.now().replace(day=1, hour=9, minute=0, second=0, microsecond=0)
+    months = [(now - datetime.timedelta(days=62)).replace(day=1), (now - datetime.timedelta(days=1)).replace(day=1),
+              now]
+    return [make_bill(number, created=month + datetime.timedelta(hours=number))
+            for number, month in enumerate(months * 6)]
+
+
+def running(store):
+    cache = StoreCache(store)
+    totals = stats.BillStats()
+    cache.subscribe(totals)
+    cache.sync()
+    return cache, totals
+
+
+def test_running_totals_match_a_rebuild(tmp_path, dated_bills, make_bill):
+    store = LogStore(str(tmp_path), sections={'stats': stats.pack_segment})
+    cache, totals = running(store)
+    store.append_bills(dated_bills[:10])
+    cache.sync()
+    store.append_bills(dated_bills[10:])
+    cache.sync()
+    assert totals.count == len(dated_bills)
+    assert totals.revenue_paise == sum(round(bill['grandTotal'] * 100) for bill in dated_bills)
+    assert totals.totals() == stats.rebuild(store.iter_bills()).totals()
+
+
+def test_sealed_months_and_rewritten_bills(tmp_path, dated_bills):
+    store = LogStore(str(tmp_path), sections={'stats': stats.pack_segment})
+    store.append_bills(dated_bills)
+    assert len(store.seal()) == 2
+    cache, totals = running(store)
+    assert totals.totals() == stats.rebuild(store.iter_bills()).totals()
+
+    # A sealed bill written again replaces its sealed contribution.
+    changed = dict(dated_bills[0], grandTotal=1000, customerName='Someone Else', customerPhone='')
+    store.append_bill(changed)
+    cache.sync()
+    assert totals.count == len(dated_bills)
+    assert totals.totals() == stats.rebuild(store.iter_bills()).totals()
+    assert running(store)[1].totals() == totals.totals()
+
+
+def test_snapshot(tmp_path, make_bill):
+    today = datetime.datetime.now().replace(microsecond=0)
+    store = LogStore(str(tmp_path))
+    store.append_bills([make_bill(1, created=today, grandTotal=10, customerPhone='1'),
+                        make_bill(2, created=today, grandTotal=25.5, customerPhone='2'),
+                        make_bill(3, created=today, grandTotal=4.5, customerPhone='1')])
+    snapshot = running(store)[1].snapshot(top_customers=1)
+    assert (snapshot['count'], snapshot['revenue']) == (3, 40.0)
+    assert snapshot['days'] == [{'key': today.date().isoformat(), 'count': 3, 'revenue': 40.0}]
+    assert snapshot['customers'] == [{'key': '2', 'count': 1, 'revenue': 25.5}]
+
+
+def test_rebuild_stats_command(app_module, dated_bills):
+    shard = app_module.shards.get('')
+    shard.store.append_bills(dated_bills)
+    shard.store.seal()
+    runner = app_module.app.test_cli_runner()
+
+    result = runner.invoke(args=['rebuild-stats'])
+    assert result.exit_code == 0, result.output
+    assert 'matches running totals' in result.output
+
+    shard.cache.sync()
+    shard.dashboard_stats.revenue_paise += 1
+    shard.cache.sync()
+    result = runner.invoke(args=['rebuild-stats'])
+    assert result.exit_code == 1
+    assert 'do not match' in result.output
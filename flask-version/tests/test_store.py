@@ -0,0 +1,99 @@
+import json
+import os
+
+from store import LogStore
+
+
+def test_bills_round_trip_and_reopen(tmp_path, make_bill):
+    bills = [make_bill(number) for number in range(5)]
+    store = LogStore(str(tmp_path))
+    store.append_bills(bills[:2])
+    store.append_bill(bills[2])
+    store.append_bills(bills[3:])
+
+    reopened = LogStore(str(tmp_path))
+    assert list(reopened.iter_bills()) == bills
+    assert reopened.count() == 5
+    assert reopened.get_bill(bills[3]['id']) == bills[3]
+    assert reopened.get_bill('no-such-bill') is None
+
+
+def test_rewritten_bill_supersedes_and_compacts(tmp_path, make_bill):
+    bills = [make_bill(number) for number in range(3)]
+    store = LogStore(str(tmp_path))
+    store.append_bills(bills)
+    changed = dict(bills[1], customerName='Renamed')
+    store.append_bill(changed)
+
+    assert store.count() == 3
+    assert store.get_bill(changed['id'])['customerName'] == 'Renamed'
+    assert store.dead_bytes() > 0
+    store.compact()
+    assert store.dead_bytes() == 0
+    assert list(LogStore(str(tmp_path)).iter_bills()) == [bills[0], changed, bills[2]]
+
+
+def test_torn_tail_is_truncated_on_open(tmp_path, make_bill):
+    bills = [make_bill(number) for number in range(3)]
+    store = LogStore(str(tmp_path))
+    store.append_bills(bills)
+    size = os.path.getsize(store.log_path)
+    # A crash in the middle of appending a record.
+    with open(store.log_path, 'ab') as f:
+        f.write(b'0badc0de {"id": "half-writ')
+
+    recovered = LogStore(str(tmp_path))
+    assert os.path.getsize(recovered.log_path) == size
+    assert list(recovered.iter_bills()) == bills
+    extra = make_bill(3)
+    recovered.append_bill(extra)
+    assert list(LogStore(str(tmp_path)).iter_bills()) == bills + [extra]
+
+
+def test_corrupt_record_ends_the_log(tmp_path, make_bill):
+    bills = [make_bill(number) for number in range(3)]
+    store = LogStore(str(tmp_path))
+    store.append_bills(bills)
+    with open(store.log_path, 'rb') as f:
+        data = bytearray(f.read())
+    # Flip a byte of the last record's payload; its checksum no longer matches.
+    data[-5] ^= 0x01
+    with open(store.log_path, 'wb') as f:
+        f.write(data)
+    os.remove(store.index_path)
+
+    assert list(LogStore(str(tmp_path)).iter_bills()) == bills[:2]
+
+
+def test_lost_or_stale_index_is_rebuilt(tmp_path, make_bill):
+    bills = [make_bill(number) for number in range(4)]
+    store = LogStore(str(tmp_path))
+    store.append_bills(bills)
+    os.remove(store.index_path)
+    assert list(LogStore(str(tmp_path)).iter_bills()) == bills
+
+    with open(store.index_path, 'r+b') as f:
+        f.write(b'garbage!')
+    reopened = LogStore(str(tmp_path))
+    assert [reopened.get_bill(bill['id']) for bill in bills] == bills
+
+
+def test_reader_sees_bills_appended_by_another_writer(tmp_path, make_bill):
+    reader = LogStore(str(tmp_path))
+    writer = LogStore(str(tmp_path))
+    stamp = reader.stamp()
+    bill = make_bill()
+    writer.append_bill(bill)
+
+    assert reader.stamp() != stamp
+    reader.refresh()
+    assert list(reader.iter_bills()) == [bill]
+
+
+def test_legacy_data_json_is_imported(tmp_path, make_bill):
+    bills = [make_bill(number) for number in range(2)]
+    legacy = tmp_path / 'data.json'
+    legacy.write_text(json.dumps({'business': {'name': 'Shop'}, 'bills': bills}, indent=4))
+
+    store = LogStore(str(tmp_path / 'store'), legacy_file=str(legacy))
+    assert store.load() == {'business': {'name': 'Shop'}, 'bills': bills}
@@ -0,0 +1,41 @@
+import os
+
+from flask import Flask, render_template
+
+import template_registry
+
+
+def make_app(tmp_path):
+    folder = tmp_path / 'templates'
+    folder.mkdir()
+    (folder / 'page.html').write_text('file {{ name }}')
+    (folder / 'other.html').write_text('other {{ name }}')
+    return Flask(__name__, template_folder=str(folder))
+
+
+def test_strings_shadow_files_and_compile_once(tmp_path):
+    app = make_app(tmp_path)
+    env = template_registry.install(app, strings={'page.html': 'string {{ name }}'}, precompile=False)
+    compiled = []
+    compile_source = env.compile
+    env.compile = lambda *args, **kwargs: compiled.append(args) or compile_source(*args, **kwargs)
+
+    with app.app_context():
+        assert render_template('page.html', name='a') == 'string a'
+        assert render_template('page.html', name='b') == 'string b'
+        assert render_template('other.html', name='c') == 'other c'
+    assert len(compiled) == 2
+
+
+def test_bytecode_is_cached_on_disk(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    env = template_registry.install(make_app(tmp_path), cache_dir=cache_dir)
+    assert sorted(template_registry.compile_all(env)) == ['other.html', 'page.html']
+    assert len(os.listdir(cache_dir)) == 2
+
+    # A fresh environment loads the bytecode instead of compiling.
+    app = Flask(__name__, template_folder=str(tmp_path / 'templates'))
+    env = template_registry.install(app, cache_dir=cache_dir, precompile=False)
+    env.compile = None
+    with app.app_context():
+        assert render_template('page.html', name='x') == 'file x'
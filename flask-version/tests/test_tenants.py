@@ -0,0 +1,186 @@
+import json
+import os
+
+import pytest
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from tenants import Busy, ShardMap, ShardPool, TenantMiddleware, is_tenant
+
+
+def echo(environ, start_response):
+    body = json.dumps([environ['bills.tenant'], environ.get('SCRIPT_NAME', ''), environ['PATH_INFO']])
+    return Response(body)(environ, start_response)
+
+
+def routed(path, host='localhost', domain='bills.example.com'):
+    response = Client(TenantMiddleware(echo, domain=domain)).get(path, headers={'Host': host})
+    return response.status_code, response.get_json(force=True) if response.status_code == 200 else None
+
+
+def test_middleware_finds_the_tenant():
+    assert routed('/history') == (200, ['', '', '/history'])
+    assert routed('/t/acme/history') == (200, ['acme', '/t/acme', '/history'])
+    assert routed('/t/acme') == (200, ['acme', '/t/acme', '/'])
+    assert routed('/history', host='acme.bills.example.com') == (200, ['acme', '', '/history'])
+    assert routed('/', host='bills.example.com:8000') == (200, ['', '', '/'])
+
+
+@pytest.mark.parametrize('path, host', [
+    ('/t/', 'localhost'),
+    ('/t//create', 'localhost'),
+    ('/t/Acme/', 'localhost'),
+    ('/t/-acme/', 'localhost'),
+    ('/t/a_b/', 'localhost'),
+    ('/', 'a.b.bills.example.com'),
+    ('/', '.bills.example.com'),
+])
+def test_invalid_tenants_are_404(path, host):
+    assert routed(path, host=host)[0] == 404
+
+
+def test_tenant_names():
+    assert is_tenant('acme') and is_tenant('a-1') and is_tenant('x' * 63)
+    assert not any(map(is_tenant, ['', 'x' * 64, 'acme-', 'ac.me', 'ACME', None]))
+
+
+def test_shard_map_places_locates_and_reloads(tmp_path):
+    roots = [str(tmp_path / 'a'), str(tmp_path / 'b')]
+    shard_map = ShardMap(roots=roots)
+    directory = shard_map.create('acme')
+    assert os.path.isdir(directory)
+    assert os.path.dirname(directory) == shard_map.place('acme')
+    assert shard_map.locate('acme') == directory
+    assert shard_map.locate('globex') is None
+    with pytest.raises(ValueError):
+        shard_map.create('Not Valid')
+
+    path = tmp_path / 'map.json'
+    listed = ShardMap(str(path), roots=roots)
+    assert listed.locate('acme') == directory
+    path.write_text(json.dumps({'tenants': {'globex': 'https://node2.example.com/t/globex'}}))
+    assert listed.locate('globex') == 'https://node2.example.com/t/globex'
+    with pytest.raises(ValueError):
+        listed.create('globex')
+
+
+class FakeShard:
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_pool_evicts_idle_shards_and_limits_requests():
+    pool = ShardPool(FakeShard, max_open=2, max_active=2)
+    a = pool.acquire('a')
+    assert pool.get('a') is a
+    b = pool.get('b')
+    pool.get('c')
+    # 'b' was the least recently used shard not serving a request.
+    assert b.closed and not a.closed
+    assert [shard.name for shard in pool.shards()] == ['a', 'c']
+
+    pool.acquire('a')
+    with pytest.raises(Busy):
+        pool.acquire('a')
+    assert pool.rejected == 1
+    pool.release('a')
+    pool.acquire('a')
+    assert pool.opened == 3
+
+
+@pytest.fixture
+def tenants(app_module):
+    for name in ('acme', 'globex'):
+        app_module.shard_map.create(name)
+    app_module.shards.get('').store.set_business({'name': 'Default'})
+    return app_module
+
+
+def post_bill(client, prefix, name):
+    bill = {'customerName': name, 'items': [{'description': 'Tea', 'quantity': 1, 'price': 5}]}
+    return client.post(prefix + '/api/bills/bulk', json=[bill]).get_json()['results'][0]
+
+
+def customers(client, prefix):
+    return [bill['customerName'] for bill in client.get(prefix + '/api/bills').get_json()['bills']]
+
+
+def test_tenants_have_separate_bills(tenants, client):
+    asha = post_bill(client, '/t/acme', 'Asha')
+    ravi = post_bill(client, '/t/globex', 'Ravi')
+    post_bill(client, '', 'Meera')
+
+    assert customers(client, '/t/acme') == ['Asha']
+    assert customers(client, '/t/globex') == ['Ravi']
+    assert customers(client, '') == ['Meera']
+    # Each tenant numbers its own bills.
+    assert asha['billNumber'] == ravi['billNumber']
+    assert client.get('/t/acme/api/search?q=asha').get_json()['total'] == 1
+    assert client.get('/t/globex/api/search?q=asha').get_json()['total'] == 0
+    assert client.get('/t/globex/bills/%s.pdf' % asha['id']).status_code == 404
+
+
+def test_unknown_and_remote_tenants(tenants, client, tmp_path, monkeypatch):
+    assert client.get('/t/nobody/api/bills').status_code == 404
+    assert client.get('/t/').status_code == 404
+    assert client.get('/t//create').status_code == 404
+
+    path = tmp_path / 'map.json'
+    path.write_text(json.dumps({'tenants': {'far': 'https://node2.example.com/t/far'}}))
+    monkeypatch.setattr(tenants, 'shard_map', ShardMap(str(path), roots=tenants.shard_map.roots))
+    response = client.get('/t/far/history?q=x')
+    assert response.status_code == 307
+    assert response.headers['Location'] == 'https://node2.example.com/t/far/history?q=x'
+
+
+def test_cli_works_on_one_tenant(tenants, client):
+    post_bill(client, '/t/acme', 'Asha')
+    runner = tenants.app.test_cli_runner()
+    result = runner.invoke(args=['rebuild-stats', '--tenant', 'acme'])
+    assert result.exit_code == 0 and result.output.startswith('1 bills')
+    assert runner.invoke(args=['rebuild-stats']).output.startswith('0 bills')
+    assert runner.invoke(args=['rebuild-stats', '--tenant', 'nobody']).exit_code == 1
+
+    result = runner.invoke(args=['create-tenant', 'initech'])
+    assert result.exit_code == 0
+    assert os.path.isdir(result.output.strip())
+    assert client.get('/t/initech/api/bills').status_code == 200
+
+
+def test_unlimited_holds_and_eviction():
+    pool = ShardPool(FakeShard, max_open=1, max_active=1)
+    held = pool.acquire('', limited=False)
+    assert pool.acquire('', limited=False) is held
+    with pytest.raises(Busy):
+        pool.acquire('')
+    # A held shard stays open however many others are opened.
+    pool.get('a')
+    pool.get('b')
+    assert not held.closed and pool.get('') is held
+    pool.release('')
+    pool.release('')
+    pool.get('c')
+    assert held.closed
+
+
+def test_only_tenants_are_limited(tenants, client, monkeypatch):
+    monkeypatch.setattr(tenants.shards, 'max_active', 0)
+    assert client.get('/api/bills').status_code == 200
+    response = client.get('/t/acme/api/bills')
+    assert response.status_code == 503 and response.headers['Retry-After'] == '1'
+
+
+def test_jobs_hold_their_shard(tenants):
+    seen = []
+
+    @tenants.shard_job('test-hold')
+    def hold(payload):
+        seen.append(dict(tenants.shards._active))
+
+    tenants.job_queue._handlers['test-hold']({'tenant': 'acme'})
+    assert seen == [{'acme': 1}]
+    assert tenants.shards._active == {}
@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+
+import pytest
+
+from benchmarks import synth
+import pdf
+from uploads import UploadStore
+
+
+@pytest.fixture
+def pool():
+    pool = ThreadPoolExecutor(2)
+    yield pool
+    pool.shutdown()
+
+
+def test_same_image_is_stored_once(tmp_path, pool):
+    uploads = UploadStore(str(tmp_path), sizes=(16,), pool=lambda: pool)
+    image = synth.signature_png(1)
+    first = uploads.save(io.BytesIO(image))
+    assert uploads.save(io.BytesIO(image)) == first
+    assert first.endswith('.png') and first[:2] == first[3:5]
+    assert (uploads.saves, uploads.duplicates) == (2, 1)
+    other = uploads.save(io.BytesIO(synth.signature_png(2)))
+    assert other != first
+    with open(uploads.path(first), 'rb') as f:
+        assert f.read() == image
+
+
+def test_only_images_are_accepted(tmp_path, pool):
+    uploads = UploadStore(str(tmp_path), pool=lambda: pool)
+    with pytest.raises(ValueError):
+        uploads.save(io.BytesIO(b'#!/bin/sh\necho hi\n'))
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_thumbnails_are_made_in_the_background(tmp_path, pool):
+    uploads = UploadStore(str(tmp_path), sizes=(16, 64), pool=lambda: pool)
+    name = uploads.save(io.BytesIO(synth.signature_png(1, width=240, height=80)))
+    uploads.wait()
+    thumb = uploads.thumbnail(name, 16)
+    assert thumb == uploads.thumbnail_name(name, 16)
+    with open(uploads.path(thumb), 'rb') as f:
+        width, height = pdf.png_pixels(f.read())[:2]
+    assert max(width, height) == 16
+    assert uploads.thumbnail(name, 32) is None
+    assert uploads.make_thumbnails(name) == [uploads.thumbnail_name(name, 16), uploads.thumbnail_name(name, 64)]
+
+
+def test_upload_route(app_module, client, pool, monkeypatch):
+    monkeypatch.setattr(app_module, 'thumb_pool', lambda: pool)
+    response = client.post('/api/upload-signature',
+                           data={'signature': (io.BytesIO(synth.signature_png(3)), 'sig.png')})
+    assert response.status_code == 200
+    url = response.get_json()['filepath']
+    assert url.startswith('/static/uploads/')
+
+    served = client.get(url)
+    assert served.get_data() == synth.signature_png(3)
+    assert served.cache_control.immutable and served.cache_control.max_age > 0
+    served.close()
+
+    bad = client.post('/api/upload-signature', data={'signature': (io.BytesIO(b'GIF? no'), 'sig.png')})
+    assert bad.status_code == 400
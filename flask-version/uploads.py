@@ -0,0 +1,247 @@
+"""Content-addressed store for uploaded logos and signatures.
+
+An upload is streamed to a temporary file in chunks while it is hashed and
+then renamed to ``<sha256[:2]>/<sha256>.<ext>``, so the same image uploaded
+twice is stored once and two different files called ``signature.png`` can
+no longer overwrite each other. The extension comes from the file's magic
+bytes, not from the name it was uploaded under.
+
+Downscaled PNG thumbnails for each of ``sizes`` are made in worker
+processes after the upload has been stored and live next to the originals
+under ``thumbs/<size>/``. Thumbnails are made with Pillow when it is
+installed; without it only PNGs can be thumbnailed, with nearest-neighbour
+sampling.
+"""
+import hashlib
+import io
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import pdf
+from writer import atomic_write, fsync_dir
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional
+    Image = None
+
+CHUNK_SIZE = 64 * 1024
+
+SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+NAME_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{64}\.(png|jpg|gif)$')
+THUMB_RE = re.compile(r'^thumbs/\d+/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+
+
+def sniff(head):
+    for magic, extension in SIGNATURES:
+        if head.startswith(magic):
+            return extension
+    return None
+
+
+def is_upload(name):
+    return bool(name and NAME_RE.match(name))
+
+
+def is_immutable(name):
+    """Whether ``name`` is an upload or a thumbnail of one, whose bytes never change."""
+    return is_upload(name) or bool(name and THUMB_RE.match(name))
+
+
+# -- thumbnails ------------------------------------------------------------
+
+def _png_chunk(kind, body):
+    return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body))
+
+
+def encode_png(width, height, channels, pixels):
+    color_type = {1: 0, 2: 4, 3: 2, 4: 6}[channels]
+    stride = width * channels
+    raw = b''.join(b'\0' + pixels[row * stride:(row + 1) * stride] for row in range(height))
+    return (b'\x89PNG\r\n\x1a\n'
+            + _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0))
+            + _png_chunk(b'IDAT', zlib.compress(raw, 9))
+            + _png_chunk(b'IEND', b''))
+
+
+def _target(width, height, size):
+    scale = min(size / width, size / height, 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _nearest(width, height, channels, pixels, size):
+    new_width, new_height = _target(width, height, size)
+    stride = width * channels
+    columns = [(x * width // new_width) * channels for x in range(new_width)]
+    out = bytearray()
+    for y in range(new_height):
+        row = pixels[(y * height // new_height) * stride:][:stride]
+        for column in columns:
+            out += row[column:column + channels]
+    return encode_png(new_width, new_height, channels, bytes(out))
+
+
+def make_thumbnail(source, destination, size):
+    """Write a PNG of ``source`` scaled to fit ``size`` x ``size``.
+
+    Runs in a worker process. Returns False when the image can't be
+    decoded here.
+    """
+    with open(source, 'rb') as f:
+        data = f.read()
+    if Image is not None:
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.thumbnail((size, size), Image.LANCZOS)
+            if image.mode not in ('1', 'L', 'LA', 'RGB', 'RGBA'):
+                image = image.convert('RGBA')
+            out = io.BytesIO()
+            image.save(out, 'PNG', optimize=True)
+        except Exception:
+            return False
+        result = out.getvalue()
+    else:
+        try:
+            decoded = pdf.png_pixels(data) if data.startswith(b'\x89PNG') else None
+        except (struct.error, zlib.error, IndexError):
+            decoded = None
+        if decoded is None:
+            return False
+        result = _nearest(*decoded, size)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    atomic_write(destination, result)
+    return True
+
+
+class UploadStore:
+    def __init__(self, directory, sizes=(128, 512), workers=1, pool=None):
+        self.directory = directory
+        self.sizes = tuple(sizes)
+        self.workers = workers
+        # Function returning an executor shared with other upload stores;
+        # without one the store starts its own.
+        self._shared_pool = pool
+        self._pool = None
+        self._pending = {}
+        self._failed = set()
+        # RLock: a future that is already done runs its callback immediately.
+        self._lock = threading.RLock()
+        # Reported by /metrics.
+        self.saves = 0
+        self.duplicates = 0
+        self.bytes_received = 0
+        self.save_seconds = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def save(self, stream):
+        """Store the file read from ``stream``; return its name.
+
+        Raises ValueError if it isn't a PNG, JPEG or GIF image.
+        """
+        started = time.perf_counter()
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                head = stream.read(CHUNK_SIZE)
+                extension = sniff(head)
+                if extension is None:
+                    raise ValueError('File type not allowed')
+                chunk = head
+                while chunk:
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+                    chunk = stream.read(CHUNK_SIZE)
+                f.flush()
+                os.fsync(f.fileno())
+            key = digest.hexdigest()
+            name = '%s/%s.%s' % (key[:2], key, extension)
+            path = self.path(name)
+            if os.path.exists(path):
+                os.remove(tmp)
+                self.duplicates += 1
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp, path)
+                fsync_dir(os.path.dirname(path))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.saves += 1
+        self.bytes_received += size
+        self.save_seconds += time.perf_counter() - started
+        self.schedule(name)
+        return name
+
+    def thumbnail_name(self, name, size):
+        return 'thumbs/%d/%s.png' % (size, name.rsplit('.', 1)[0])
+
+    def thumbnail(self, name, size):
+        """Name of the ``size`` thumbnail of upload ``name`` if it is ready.
+
+        Returns None (and queues the thumbnail if need be) otherwise.
+        """
+        if not is_upload(name) or size not in self.sizes:
+            return None
+        thumb = self.thumbnail_name(name, size)
+        if os.path.exists(self.path(thumb)):
+            return thumb
+        self.schedule(name)
+        return None
+
+    def schedule(self, name):
+        """Queue any missing thumbnails of ``name`` in the background."""
+        with self._lock:
+            for size in self.sizes:
+                thumb = self.thumbnail_name(name, size)
+                if thumb in self._pending or thumb in self._failed or os.path.exists(self.path(thumb)):
+                    continue
+                if self._pool is None:
+                    self._pool = (self._shared_pool() if self._shared_pool
+                                  else ProcessPoolExecutor(max_workers=self.workers))
+                future = self._pool.submit(make_thumbnail, self.path(name), self.path(thumb), size)
+                self._pending[thumb] = future
+                future.add_done_callback(lambda future, thumb=thumb: self._done(thumb, future))
+
+    def _done(self, thumb, future):
+        with self._lock:
+            del self._pending[thumb]
+            if future.exception() is not None or not future.result():
+                self._failed.add(thumb)
+
+    def wait(self):
+        """Block until every queued thumbnail has been written."""
+        with self._lock:
+            futures = list(self._pending.values())
+        for future in futures:
+            future.exception()
+
+    def make_thumbnails(self, name):
+        """Make any missing thumbnails of ``name``; return the ones that exist."""
+        if not is_upload(name):
+            return []
+        self.schedule(name)
+        thumbs = [self.thumbnail_name(name, size) for size in self.sizes]
+        with self._lock:
+            futures = [self._pending[thumb] for thumb in thumbs if thumb in self._pending]
+        for future in futures:
+            future.exception()
+        return [thumb for thumb in thumbs if os.path.exists(self.path(thumb))]
@@ -0,0 +1,117 @@
+"""Write-path primitives shared by the bill stores."""
+import json
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+
+class FileLock:
+    """Exclusive lock on ``path`` held across processes and threads.
+
+    Each acquisition opens its own descriptor, so two threads of one worker
+    exclude each other just like two gunicorn workers do.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._thread_lock = threading.Lock()
+
+    def __enter__(self):
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            self._thread_lock.acquire()
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            self._local.fd = fd
+        self._local.depth = depth + 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self._local.fd, fcntl.LOCK_UN)
+            os.close(self._local.fd)
+            self._thread_lock.release()
+
+
+def fsync_dir(directory):
+    if os.name != 'posix':
+        return
+    fd = os.open(directory or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, data):
+    """Replace ``path`` with ``data`` so readers see either old or new bytes."""
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    fsync_dir(os.path.dirname(path))
+
+
+def atomic_write_json(path, obj):
+    atomic_write(path, json.dumps(obj, indent=4).encode('utf-8'))
+
+
+class _Waiter:
+    __slots__ = ('items', 'done', 'error')
+
+    def __init__(self, items):
+        self.items = items
+        self.done = False
+        self.error = None
+
+
+class GroupCommit:
+    """Coalesce concurrent writes into a single ``flush(items)`` call.
+
+    The first thread to arrive becomes the leader and flushes everything
+    queued so far; threads that arrive meanwhile wait and are committed
+    together in the leader's next round. Under contention one fsync covers
+    many bills instead of one each.
+    """
+
+    def __init__(self, flush):
+        self._flush = flush
+        self._cond = threading.Condition()
+        self._pending = []
+        self._flushing = False
+
+    def submit(self, items):
+        waiter = _Waiter(items)
+        with self._cond:
+            self._pending.append(waiter)
+            while not waiter.done:
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                self._flushing = True
+                batch, self._pending = self._pending, []
+                self._cond.release()
+                error = None
+                try:
+                    self._flush([item for queued in batch for item in queued.items])
+                except BaseException as exc:
+                    error = exc
+                finally:
+                    self._cond.acquire()
+                for queued in batch:
+                    queued.done = True
+                    queued.error = error
+                self._flushing = False
+                self._cond.notify_all()
+        if waiter.error is not None:
+            raise waiter.error